@@ -5,7 +5,11 @@ Flask 应用初始化和 Blueprint 注册
 """
 import os
 from flask import Flask, render_template
+from flask.json.provider import DefaultJSONProvider
 
+from core.bill import Bill
+from core.bill_index import update_bill_index
+from core.session_store import bill_session
 from core.themes import load_theme_registry
 from routes.categories import categories_bp
 from routes.rules import rules_bp
@@ -14,18 +18,25 @@ from routes.books import books_bp
 from routes.progress import progress_bp
 from routes.statistics import statistics_bp
 
+class BillJSONProvider(DefaultJSONProvider):
+    """接口返回账单时把 Bill 转为普通字典"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Bill):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+
 # 创建 Flask 应用
 app = Flask(__name__)
+app.json = BillJSONProvider(app)
 app.config["UPLOAD_FOLDER"] = "temp_uploads"
 app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024  # 16MB max-limit
 
 # 确保上传目录存在
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
-# 用于存储当前账单数据（供其他模块访问）
-current_bills = {}
-
-
 app.register_blueprint(categories_bp)
 app.register_blueprint(rules_bp)
 app.register_blueprint(bills_bp)
@@ -33,6 +44,9 @@ app.register_blueprint(books_bp)
 app.register_blueprint(progress_bp)
 app.register_blueprint(statistics_bp)
 
+# 账单上传、加载或编辑后同步更新划词打标预览用的文本索引
+bill_session.on_publish(update_bill_index)
+
 
 @app.context_processor
 def inject_theme_registry():
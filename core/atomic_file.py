@@ -0,0 +1,195 @@
+"""
+原子文件写入
+
+- atomic_write_bytes / atomic_write_text：先写同目录临时文件并 fsync，再 os.replace 覆盖目标文件，
+  崩溃或并发读取时只会看到旧内容或新内容，不会读到写了一半的文件
+- coalesced_write：同一文件的写入串行执行；上一次写入进行中到达的多次写入合并为一次，
+  只落盘最后提交的内容，调用方在自己的数据（或更新的数据）落盘后返回
+- file_lock：跨进程的排他锁（锁文件 + fcntl.flock），用于多个进程（如 gunicorn 多 worker）写同一组文件
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，只能保证进程内互斥（由调用方的线程锁负责）
+    fcntl = None
+
+
+# 进程的 umask（os.umask 只能先设置再读回，在导入时读取一次，避免运行中与其他线程竞争）
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _file_mode(file_path: Path) -> int:
+    """替换后目标文件应有的权限：沿用已有文件的权限，新文件按 umask 取默认值"""
+    try:
+        return os.stat(file_path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def fsync_directory(directory: Path) -> None:
+    """把目录项（改名结果）刷到磁盘，平台不支持时忽略"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_synced(file_path, data: bytes) -> None:
+    """写入文件并 fsync（不做原子替换，用于调用方自行 os.replace 的临时文件）"""
+    with open(file_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def atomic_write_bytes(file_path, data: bytes) -> None:
+    """原子地把 data 写入 file_path（保留目标文件原有的权限）"""
+    file_path = Path(file_path)
+    directory = file_path.parent
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=f"{file_path.name}.", suffix=".tmp")
+    try:
+        # mkstemp 创建的文件权限为 0600，os.replace 后会变成目标文件的权限
+        os.chmod(tmp_name, _file_mode(file_path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
+
+
+def atomic_write_text(file_path, text: str, encoding: str = "utf-8") -> None:
+    """原子地把文本写入 file_path"""
+    atomic_write_bytes(file_path, text.encode(encoding))
+
+
+@contextmanager
+def file_lock(lock_path) -> Iterator[None]:
+    """
+    持有 lock_path 上的跨进程排他锁（不存在时创建锁文件）
+
+    flock 按打开的文件计，同一进程内两次进入也互斥，不可重入；进程退出时由系统释放。
+    不支持 flock 的平台上不加锁。
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+# ==================== 合并写入 ====================
+
+class _WriteBatch:
+    """一次落盘：期间提交的写入合并到同一批，只写最后一次提交的内容"""
+
+    __slots__ = ("render", "on_flushed", "done", "error")
+
+    def __init__(self):
+        self.render: Optional[Callable[[], bytes]] = None
+        self.on_flushed: Optional[Callable[[], None]] = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+
+class _FileWriteState:
+    """单个文件的写入状态"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        # 尚未开始落盘的批次
+        self.pending: Optional[_WriteBatch] = None
+        # 是否有线程正在写这个文件
+        self.writing = False
+
+
+_write_states: Dict[str, _FileWriteState] = {}
+_write_states_lock = threading.Lock()
+
+
+def _get_write_state(file_path) -> _FileWriteState:
+    key = os.path.abspath(file_path)
+    with _write_states_lock:
+        state = _write_states.get(key)
+        if state is None:
+            state = _write_states[key] = _FileWriteState()
+        return state
+
+
+def coalesced_write(
+    file_path,
+    render: Callable[[], bytes],
+    on_flushed: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    原子写入文件，合并同一文件的突发写入
+
+    同一时刻只有一个线程在写某个文件。写入进行中到达的写入合并为一批，只保留最新一次：
+    被覆盖的写入既不生成内容也不落盘，其调用方等到这一批落盘后返回（落盘失败时抛出同一异常）。
+
+    Args:
+        file_path: 目标文件
+        render: 生成文件内容（只在确实需要落盘时调用，在锁外执行）
+        on_flushed: 该内容落盘后调用（在写入线程中、同一文件的下一次写入之前执行）
+
+    合并只在进程内进行。多个进程写同一文件时各自使用独立的临时文件再改名，
+    文件始终完整，以最后一次改名为准（读取方按文件签名发现变化，见 core.utils._load_json）。
+    """
+    state = _get_write_state(file_path)
+    with state.cond:
+        batch = state.pending
+        if batch is None:
+            batch = state.pending = _WriteBatch()
+        batch.render = render
+        batch.on_flushed = on_flushed
+        while state.writing and not batch.done:
+            state.cond.wait()
+        if batch.done:
+            if batch.error is not None:
+                raise batch.error
+            return
+
+        # 由当前线程写这一批，之后提交的写入进入新的批次
+        state.writing = True
+        state.pending = None
+
+    try:
+        atomic_write_bytes(file_path, batch.render())
+        if batch.on_flushed is not None:
+            batch.on_flushed()
+    except BaseException as exc:
+        batch.error = exc
+    finally:
+        with state.cond:
+            batch.done = True
+            state.writing = False
+            state.cond.notify_all()
+
+    if batch.error is not None:
+        raise batch.error
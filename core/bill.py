@@ -0,0 +1,185 @@
+"""
+账单记录类型
+
+解析后的账单用 Bill 保存：标准字段（STANDARD_FIELDS / EXPORT_COLUMNS 及收/支）存放在 __slots__ 中，
+其余列放入 extra。账单处理器只保留标准字段（见 Bill.from_row），收/付款方式、交易状态、
+商家订单号等只在解析过滤阶段使用的列不再随账单保存。Bill 实现了 MutableMapping，
+现有按字段名读写账单的代码（bill["金额"]、bill.get("类别", "")）无需修改；
+写入 JSON（进度文件、接口返回）时用 to_dict() / bill_json_default 转为普通字典。
+"""
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from core.config import EXPORT_COLUMNS, STANDARD_FIELDS
+
+
+# 已知标准字段的属性名；config 中新增的字段使用 field_<序号>
+_FIELD_ATTR_NAMES: Dict[str, str] = {
+    "交易时间": "time",
+    "金额": "amount",
+    "类别": "category",
+    "标签": "tag",
+    "交易对方": "counterparty",
+    "商品说明": "description",
+    "备注": "remark",
+    "账本": "book",
+    "命中规则": "hit_rule",
+    "收/支": "direction",
+}
+
+# 标准字段 -> 属性名（顺序即 to_dict 的输出顺序）：导出列、STANDARD_FIELDS 中其余字段，再加收/支
+BILL_FIELDS: Dict[str, str] = {
+    name: _FIELD_ATTR_NAMES.get(name, f"field_{index}")
+    for index, name in enumerate(dict.fromkeys([*EXPORT_COLUMNS, *STANDARD_FIELDS, "收/支"]))
+}
+
+_FIELD_ATTRS = tuple(BILL_FIELDS.values())
+
+
+class Bill(MutableMapping):
+    """
+    单条账单
+
+    未赋值的标准字段视为不存在（与字典缺少该键一致），to_dict() 也不会输出。
+    """
+
+    __slots__ = tuple(BILL_FIELDS.values()) + ("extra",)
+
+    time: str
+    amount: float
+    category: str
+    tag: str
+    counterparty: str
+    description: str
+    remark: str
+    book: str
+    hit_rule: str
+    direction: str
+    extra: Optional[Dict[str, Any]]
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        self.extra = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Bill":
+        """由普通字典创建（已是 Bill 时原样返回）"""
+        if isinstance(data, cls):
+            return data
+        return cls(data)
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any], extra_fields: Iterable[str] = ()) -> "Bill":
+        """
+        由解析出的原始行创建，只保留标准字段和 extra_fields 中的列
+
+        Args:
+            row: 处理器解析出的账单字典
+            extra_fields: 需要保留的非标准列
+        """
+        bill = cls()
+        for key, attr in BILL_FIELDS.items():
+            if key in row:
+                setattr(bill, attr, row[key])
+        extra = {key: row[key] for key in extra_fields if key in row}
+        if extra:
+            bill.extra = extra
+        return bill
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转为普通字典（用于 JSON 序列化）"""
+        result = {}
+        for key, attr in BILL_FIELDS.items():
+            try:
+                result[key] = getattr(self, attr)
+            except AttributeError:
+                continue
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+    def __getitem__(self, key: str) -> Any:
+        attr = BILL_FIELDS.get(key)
+        if attr is not None:
+            try:
+                return getattr(self, attr)
+            except AttributeError:
+                raise KeyError(key) from None
+        extra = self.extra
+        if extra is None or key not in extra:
+            raise KeyError(key)
+        return extra[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        attr = BILL_FIELDS.get(key)
+        if attr is not None:
+            return getattr(self, attr, default)
+        extra = self.extra
+        return default if extra is None else extra.get(key, default)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        attr = BILL_FIELDS.get(key)
+        if attr is not None:
+            setattr(self, attr, value)
+        elif self.extra is None:
+            self.extra = {key: value}
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        attr = BILL_FIELDS.get(key)
+        if attr is not None:
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+        if self.extra is None or key not in self.extra:
+            raise KeyError(key)
+        del self.extra[key]
+
+    def __contains__(self, key: object) -> bool:
+        attr = BILL_FIELDS.get(key)
+        if attr is not None:
+            return hasattr(self, attr)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self) -> Iterator[str]:
+        for key, attr in BILL_FIELDS.items():
+            if hasattr(self, attr):
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        count = sum(1 for attr in BILL_FIELDS.values() if hasattr(self, attr))
+        return count + (len(self.extra) if self.extra else 0)
+
+    def __repr__(self) -> str:
+        return f"Bill({self.to_dict()!r})"
+
+    def copy(self) -> "Bill":
+        bill = Bill.__new__(Bill)
+        for attr in _FIELD_ATTRS:
+            try:
+                setattr(bill, attr, getattr(self, attr))
+            except AttributeError:
+                continue
+        bill.extra = dict(self.extra) if self.extra else None
+        return bill
+
+
+def bill_json_default(obj: Any) -> Any:
+    """json.dump 的 default 参数：把 Bill 转为字典"""
+    if isinstance(obj, Bill):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def bills_from_json(data: Any) -> Any:
+    """把从 JSON 读出的账单字典（{id: {...}}）转为 Bill，列表等其他结构原样返回"""
+    if not isinstance(data, dict):
+        return data
+    return {bill_id: Bill.from_dict(bill) if isinstance(bill, dict) else bill for bill_id, bill in data.items()}
@@ -0,0 +1,256 @@
+"""
+账单文本倒排索引
+
+为当前账单的 交易对方 / 商品说明 建立 1-gram + 2-gram 倒排索引，
+用于划词打标时预览“候选规则会命中哪些账单”，无需逐条跑规则匹配。
+"""
+import re
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+from core.rule_engine import ANY_RULE_FIELDS, compile_pattern
+
+
+# 建立索引的字段
+INDEXED_FIELDS = ANY_RULE_FIELDS
+
+
+def _grams(text: str) -> Set[str]:
+    """文本中出现的全部 1-gram 与 2-gram"""
+    return {*text, *map(str.__add__, text, text[1:])}
+
+
+class BillTextIndex:
+    """
+    账单文本倒排索引
+
+    关键词查询：用关键词的 2-gram（单字时用 1-gram）倒排表求交集得到候选，
+    再用子串判断复核，结果与规则引擎的关键词匹配一致。
+    正则查询：无法从倒排表剪枝，直接扫描索引中保存的文本。
+    """
+
+    def __init__(self):
+        # {字段: {bill_id: 文本}}
+        self._texts: Dict[str, Dict[str, str]] = {field: {} for field in INDEXED_FIELDS}
+        # {字段: {gram: {bill_id, ...}}}
+        self._postings: Dict[str, Dict[str, Set[str]]] = {field: {} for field in INDEXED_FIELDS}
+        # 建索引时的账单字典（用于判断索引是否对应当前账单）
+        self.source: Optional[dict] = None
+        # 索引对应的账单会话 epoch 与版本（见 core.session_store），None 表示不对应会话
+        self.epoch: Optional[int] = None
+        self.version: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._texts[INDEXED_FIELDS[0]])
+
+    @classmethod
+    def from_bills(cls, bills: dict) -> "BillTextIndex":
+        index = cls()
+        for bill_id, bill in bills.items():
+            index.update_bill(bill_id, bill)
+        index.source = bills
+        return index
+
+    def refresh(self, bills: dict) -> None:
+        """与账单字典对齐：只重建文本有变化的条目，删除已不存在的条目"""
+        for bill_id, bill in bills.items():
+            self.update_bill(bill_id, bill)
+        stale = [bill_id for bill_id in self._texts[INDEXED_FIELDS[0]] if bill_id not in bills]
+        for bill_id in stale:
+            self.remove_bill(bill_id)
+        self.source = bills
+
+    def update_bill(self, bill_id: str, bill: dict) -> None:
+        """新增或更新单条账单的索引，文本未变化时不做任何事"""
+        for field in INDEXED_FIELDS:
+            text = bill.get(field) or ""
+            texts = self._texts[field]
+            old_text = texts.get(bill_id)
+            if old_text == text:
+                continue
+
+            postings = self._postings[field]
+            if old_text is not None:
+                self._discard(postings, bill_id, old_text)
+            texts[bill_id] = text
+            for gram in _grams(text):
+                bucket = postings.get(gram)
+                if bucket is None:
+                    postings[gram] = {bill_id}
+                else:
+                    bucket.add(bill_id)
+
+    def remove_bill(self, bill_id: str) -> None:
+        """从索引中删除单条账单"""
+        for field in INDEXED_FIELDS:
+            old_text = self._texts[field].pop(bill_id, None)
+            if old_text is not None:
+                self._discard(self._postings[field], bill_id, old_text)
+
+    @staticmethod
+    def _discard(postings: Dict[str, Set[str]], bill_id: str, text: str) -> None:
+        for gram in _grams(text):
+            bucket = postings.get(gram)
+            if bucket is None:
+                continue
+            bucket.discard(bill_id)
+            if not bucket:
+                del postings[gram]
+
+    def _search_keyword_in_field(self, keyword: str, field: str) -> Set[str]:
+        texts = self._texts[field]
+        if not keyword:
+            return set(texts)
+
+        postings = self._postings[field]
+        grams = {keyword} if len(keyword) == 1 else _grams(keyword) - set(keyword)
+        buckets = []
+        for gram in grams:
+            bucket = postings.get(gram)
+            if not bucket:
+                return set()
+            buckets.append(bucket)
+
+        buckets.sort(key=len)
+        candidates = set(buckets[0])
+        for bucket in buckets[1:]:
+            candidates &= bucket
+            if not candidates:
+                return candidates
+
+        if len(keyword) <= 2:
+            return candidates
+        return {bill_id for bill_id in candidates if keyword in texts[bill_id]}
+
+    def _search_regex_in_field(self, compiled: re.Pattern, field: str) -> Set[str]:
+        return {bill_id for bill_id, text in self._texts[field].items() if compiled.search(text)}
+
+    def search(self, patterns: Iterable[str], key: str, match_mode: str = "keyword") -> Set[str]:
+        """
+        查询命中账单
+
+        Args:
+            patterns: 关键词或正则列表（任一命中即算命中）
+            key: 匹配字段，"交易对方" / "商品说明" / "ANY"
+            match_mode: "keyword" 或 "regex"
+
+        Raises:
+            ValueError: 正则无效
+        """
+        fields = INDEXED_FIELDS if key == "ANY" else (key,)
+        result: Set[str] = set()
+        for pattern in patterns:
+            if match_mode == "regex":
+                compiled, error = compile_pattern(pattern)
+                if compiled is None:
+                    raise ValueError(f"正则 {pattern!r} 无效: {error}")
+            for field in fields:
+                if field not in self._texts:
+                    continue
+                if match_mode == "regex":
+                    result |= self._search_regex_in_field(compiled, field)
+                else:
+                    result |= self._search_keyword_in_field(pattern, field)
+        return result
+
+
+# ==================== 当前账单索引 ====================
+
+_current_index: Optional[BillTextIndex] = None
+
+# 多个请求线程共用同一个索引：同步与查询在锁内进行
+_index_lock = threading.RLock()
+
+
+def sync_bill_index(bills: dict, epoch: Optional[int] = None) -> BillTextIndex:
+    """
+    确保索引与当前账单一致
+
+    账单被整体替换时重建索引，否则只更新变化的条目。传入账单会话的 epoch 时按 epoch 判断
+    （编辑得到的新版本是写时复制的新字典，epoch 不变），否则按字典对象判断。
+    """
+    global _current_index
+    with _index_lock:
+        index = _current_index
+        if index is None or (index.source is not bills if epoch is None else index.epoch != epoch):
+            index = BillTextIndex.from_bills(bills)
+            index.epoch = epoch
+            _current_index = index
+        elif epoch is None or index.source is not bills:
+            # 会话中已发布的账单不会再被原地修改，同一字典无需重新比较
+            index.refresh(bills)
+        index.version = None
+        return index
+
+
+def _mostly_indexed(index: BillTextIndex, bills: dict) -> bool:
+    """账单中至少一半已在索引中"""
+    indexed = index._texts[INDEXED_FIELDS[0]]
+    return 2 * sum(map(indexed.__contains__, bills)) >= len(bills)
+
+
+def update_bill_index(snapshot, changed_ids: Optional[Set[str]]) -> None:
+    """
+    账单会话发布新版本时同步索引（注册为 bill_session.on_publish 回调，在编辑锁内调用）
+
+    同一 epoch 内的编辑只更新涉及的账单。整体替换（上传、加载或保存进度、自动打标等）或索引
+    没有跟上上一个版本时与新账单对齐：已有索引覆盖大部分账单时就地刷新，只重新索引文本有变化的
+    账单（文本不变的保存、打标不重建任何条目）；否则（上传了另一份账单）先释放旧索引再重建，
+    避免新旧两份索引同时占用内存。
+    """
+    global _current_index
+    bills = snapshot.bills
+    with _index_lock:
+        index = _current_index
+        up_to_date = (
+            index is not None
+            and changed_ids is not None
+            and index.epoch == snapshot.epoch
+            and index.version is not None
+            and snapshot.version - 1 <= index.version <= snapshot.version
+        )
+        if not up_to_date:
+            if index is not None and _mostly_indexed(index, bills):
+                index.refresh(bills)
+            else:
+                _current_index = index = None
+                index = BillTextIndex.from_bills(bills)
+        else:
+            for bill_id in changed_ids:
+                bill = bills.get(bill_id)
+                if bill is None:
+                    index.remove_bill(bill_id)
+                else:
+                    index.update_bill(bill_id, bill)
+            index.source = bills
+        index.epoch = snapshot.epoch
+        index.version = snapshot.version
+        _current_index = index
+
+
+def search_bill_index(
+    snapshot,
+    patterns: Iterable[str],
+    key: str,
+    match_mode: str = "keyword",
+) -> Set[str]:
+    """
+    在账单会话某一版本（BillSnapshot）中查询（可被多个请求线程并发调用）
+
+    索引由 update_bill_index 随发布同步；索引已是同一 epoch 的该版本或更新版本时直接查询，
+    结果限定在该版本的账单内；否则（未注册回调等）先与该版本同步。
+    """
+    with _index_lock:
+        index = _current_index
+        if (
+            index is None
+            or index.epoch != snapshot.epoch
+            or index.version is None
+            or index.version < snapshot.version
+        ):
+            index = sync_bill_index(snapshot.bills, snapshot.epoch)
+            index.version = snapshot.version
+        hits = index.search(patterns, key, match_mode)
+    if index.version != snapshot.version:
+        hits = {bill_id for bill_id in hits if bill_id in snapshot.bills}
+    return hits
@@ -5,7 +5,7 @@
 所有文件路径、字段映射、处理器配置都在此处定义。
 """
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 
 # ==================== 路径配置 ====================
@@ -16,6 +16,16 @@ DATA_DIR = Path("data")
 # 进度文件（账单处理进度）
 PROGRESS_FILE = DATA_DIR / "bills.process"
 
+# 进度改动日志（见 core.progress_store）
+PROGRESS_JOURNAL_FILE = DATA_DIR / "bills.process.journal"
+
+# 进度日志条数达到此值时在后台折叠进进度文件
+PROGRESS_JOURNAL_COMPACT_ENTRIES: int = 5000
+
+# 进度快照格式："columnar"：压缩的列式快照（见 core.progress_store），"json"：旧版 JSON
+# 读取时自动识别格式，旧版 JSON 快照在加载时迁移为当前格式
+PROGRESS_SNAPSHOT_FORMAT: str = "columnar"
+
 # 配置文件路径
 RULES_FILE = DATA_DIR / "rules.json"
 CATEGORIES_FILE = DATA_DIR / "categories.json"
@@ -77,6 +87,30 @@ MEAL_TIME_PERIODS: List[Tuple[str, str, str]] = [
 ]
 
 
+# ==================== 打标引擎配置 ====================
+
+# 待打标账单数不少于此值且有多个 CPU 时，自动改用多进程打标
+PARALLEL_TAGGING_MIN_BILLS: int = 100000
+
+# 多进程打标每个分片的账单数
+PARALLEL_TAGGING_CHUNK_SIZE: int = 20000
+
+# 多进程打标的进程数（None 表示使用全部 CPU）
+PARALLEL_TAGGING_WORKERS: Optional[int] = None
+
+
+# ==================== 招商银行 PDF 解析配置 ====================
+
+# PDF 页数不少于此值且有多个 CPU 时，按页分段在进程池中解析
+CMB_PARALLEL_MIN_PAGES: int = 32
+
+# 多进程解析时每个分段的页数
+CMB_PARALLEL_PAGE_CHUNK: int = 16
+
+# 多进程解析的进程数（None 表示使用全部 CPU）
+CMB_PARALLEL_WORKERS: Optional[int] = None
+
+
 # ==================== 账单文件格式验证 ====================
 
 # 支付宝账单
@@ -90,6 +124,9 @@ WECHAT_FORMAT_MARKER: str = "----------------------微信支付账单明细列
 # 支持的文件编码
 SUPPORTED_ENCODINGS: List[str] = ['utf-8', 'gbk', 'gb2312', 'utf-16']
 
+# 识别编码时读取的文件头字节数（需覆盖到格式标记所在行）
+ENCODING_SNIFF_BYTES: int = 64 * 1024
+
 
 # ==================== 金额相关配置 ====================
 
@@ -0,0 +1,514 @@
+"""
+账单进度存储（快照 + 追加日志）
+
+进度由两部分组成：
+- 快照（PROGRESS_FILE）：某一时刻的全部账单，{交易订单号: 账单} 的 JSON
+- 日志（PROGRESS_JOURNAL_FILE）：快照之后的改动，每行一条 JSON：
+  {"id": 交易订单号, "bill": {...}} 表示新增或整条替换，{"id": 交易订单号, "bill": null} 表示删除
+
+保存改动时只向日志追加变化的账单，耗时与改动条数成正比；日志条数达到 compact_entries 后
+在后台线程把日志折叠进新快照。加载时读取快照，再按顺序重放日志。
+
+快照默认使用列式格式（PROGRESS_SNAPSHOT_FORMAT = "columnar"）：
+    SNAPSHOT_MAGIC + zlib 压缩的 JSON
+    {"ids": [交易订单号, ...],
+     "columns": {标准字段: [值, ...] 或 {"strings": [不同取值, ...], "codes": [下标, ...]}},
+     "rows": {行号: {字段: 值}}}
+每个标准字段一列，null / -1 表示该账单缺少此字段；类别、标签等取值很少的字段（INTERNED_FIELDS）
+存为字符串表 + 下标（列中有非字符串的值时按普通列保存）。非标准字段和值为 None 的标准字段放在 rows 中。
+加载时按列直接填充 Bill 的 slot，不再逐条解析 {字段: 值} 字典；不以 SNAPSHOT_MAGIC 开头的快照
+按旧版 JSON 读取。
+"""
+import json
+import os
+import threading
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from core.atomic_file import atomic_write_bytes, file_lock, fsync_directory, write_synced
+from core.bill import BILL_FIELDS, Bill, bill_json_default
+from core.config import (
+    PROGRESS_FILE,
+    PROGRESS_JOURNAL_FILE,
+    PROGRESS_JOURNAL_COMPACT_ENTRIES,
+    PROGRESS_SNAPSHOT_FORMAT,
+)
+
+
+# 列式快照的文件头
+SNAPSHOT_MAGIC = b"FLASHBILL-PROGRESS-1\n"
+
+# 存为字符串表 + 下标的字段
+INTERNED_FIELDS = ("类别", "标签", "账本", "命中规则", "收/支")
+
+# 缺少字段的占位（与值为 None 区分）
+_ABSENT = object()
+
+_FIELD_NAMES = tuple(BILL_FIELDS)
+_FIELD_ATTRS = tuple(BILL_FIELDS.values())
+
+
+def _dump_bill(bill) -> str:
+    """单条账单的 JSON（键排序，内容相同的账单序列化结果一致）"""
+    return json.dumps(bill, ensure_ascii=False, sort_keys=True, default=bill_json_default)
+
+
+def _split_bill(bill) -> Tuple[tuple, Optional[dict]]:
+    """拆成 (按 BILL_FIELDS 顺序的标准字段值，缺少的为 _ABSENT, 其余字段)"""
+    if isinstance(bill, Bill):
+        return tuple([getattr(bill, attr, _ABSENT) for attr in _FIELD_ATTRS]), bill.extra or None
+    values = tuple([bill.get(name, _ABSENT) for name in _FIELD_NAMES])
+    extra = {key: value for key, value in bill.items() if key not in BILL_FIELDS}
+    return values, extra or None
+
+
+# 可以直接保存并用 == 比较的标准字段值类型（不可变）；另外比较类型，区分 1 / 1.0 / True
+_SCALAR_TYPES = frozenset({str, int, float, bool, type(None), type(_ABSENT)})
+
+# 值类型组合的共享实例，避免每条账单各存一份
+_type_keys: Dict[tuple, tuple] = {}
+
+
+def _values_digest(values: tuple) -> Optional[tuple]:
+    """标准字段值的指纹 (值, 类型)；含列表等可变值时返回 None"""
+    types = tuple(map(type, values))
+    key = _type_keys.get(types)
+    if key is None:
+        if not _SCALAR_TYPES.issuperset(types):
+            return None
+        key = _type_keys.setdefault(types, types)
+    return values, key
+
+
+def _digest(bill, values: Optional[tuple] = None, extra: Optional[dict] = None):
+    """
+    账单内容的指纹（只在进程内用于比较是否变化，Bill 与内容相同的字典结果一致）
+
+    只有标准字段且值都是标量时为 (值, 类型)，否则为规范化的 JSON。
+    不用 hash()：哈希碰撞（如 hash(-1.0) == hash(-2.0)）会把改动当成未变化而丢失。
+    """
+    if values is None:
+        values, extra = _split_bill(bill)
+    digest = _values_digest(values) if extra is None else None
+    return _dump_bill(bill) if digest is None else digest
+
+
+# ==================== 列式快照编解码 ====================
+
+def _consume(iterator) -> None:
+    """在 C 层耗尽迭代器（用于批量调用 slot 描述符）"""
+    deque(iterator, maxlen=0)
+
+
+def encode_columnar(bills: dict) -> Tuple[bytes, dict]:
+    """把账单编码为列式快照，同时返回 {交易订单号: 指纹}"""
+    ids = list(bills)
+    rows = []
+    overrides = {}
+    digests = {}
+    for index, (bill_id, bill) in enumerate(bills.items()):
+        values, extra = _split_bill(bill)
+        rows.append(values)
+        if extra is not None:
+            overrides[index] = dict(extra)
+        digests[bill_id] = _digest(bill, values, extra)
+
+    columns = {}
+    for name, column in zip(_FIELD_NAMES, zip(*rows) if rows else [() for _ in _FIELD_NAMES]):
+        if None in column:
+            # 值为 None 与缺少字段在列中都是 null，None 另外记在 rows 中
+            for index, value in enumerate(column):
+                if value is None:
+                    overrides.setdefault(index, {})[name] = None
+        if _ABSENT in column:
+            column = [None if value is _ABSENT else value for value in column]
+        if name in INTERNED_FIELDS and all(type(value) is str for value in column if value is not None):
+            # 只有字符串进字符串表，含列表等其他值的列按普通列保存
+            strings = {}
+            codes = [-1 if value is None else strings.setdefault(value, len(strings)) for value in column]
+            columns[name] = {"strings": list(strings), "codes": codes}
+        else:
+            columns[name] = list(column)
+
+    doc = {"ids": ids, "columns": columns, "rows": overrides}
+    payload = json.dumps(doc, ensure_ascii=False, separators=(",", ":"), default=bill_json_default)
+    return SNAPSHOT_MAGIC + zlib.compress(payload.encode("utf-8"), 1), digests
+
+
+def decode_columnar(data: bytes) -> Tuple[Dict[str, Bill], dict]:
+    """解码列式快照，返回 ({交易订单号: Bill}, {交易订单号: 指纹})"""
+    doc = json.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC):]))
+    ids = doc["ids"]
+    bills = list(map(Bill.__new__, repeat(Bill, len(ids))))
+    _consume(map(Bill.extra.__set__, bills, repeat(None)))
+
+    columns = []
+    for name, attr in BILL_FIELDS.items():
+        column = doc["columns"].get(name)
+        if column is None:
+            column = [_ABSENT] * len(ids)
+        elif isinstance(column, dict):
+            strings = column["strings"]
+            strings.append(_ABSENT)  # 下标 -1
+            column = list(map(strings.__getitem__, column["codes"]))
+        elif None in column:
+            column = [_ABSENT if value is None else value for value in column]
+        columns.append(column)
+
+        setter = getattr(Bill, attr).__set__
+        if _ABSENT in column:
+            for bill, value in zip(bills, column):
+                if value is not _ABSENT:
+                    setter(bill, value)
+        else:
+            # 整列都有值时直接用 slot 描述符批量赋值，不经过 Bill.__setitem__
+            _consume(map(setter, bills, column))
+
+    column_types = [set(map(type, column)) for column in columns]
+    if all(len(types) == 1 for types in column_types):
+        # 每列只有一种类型（常见情况）：所有行的类型组合相同，不必逐行计算
+        types = tuple(next(iter(types)) for types in column_types)
+        if _SCALAR_TYPES.issuperset(types):
+            types = _type_keys.setdefault(types, types)
+            digests = dict(zip(ids, zip(zip(*columns), repeat(types))))
+        else:
+            digests = dict(zip(ids, map(_dump_bill, bills)))
+    else:
+        digests = dict(zip(ids, map(_values_digest, zip(*columns))))
+        if None in digests.values():
+            for bill_id, bill in zip(ids, bills):
+                if digests[bill_id] is None:
+                    digests[bill_id] = _dump_bill(bill)
+    for index, fields in doc["rows"].items():
+        bill = bills[int(index)]
+        for key, value in fields.items():
+            bill[key] = value
+        digests[ids[int(index)]] = _digest(bill)
+    return dict(zip(ids, bills)), digests
+
+
+def as_bill_dict(data) -> dict:
+    """快照可能是旧版的账单列表，统一转为 {交易订单号: 账单}"""
+    if isinstance(data, list):
+        return {bill["交易订单号"]: bill for bill in data}
+    return data
+
+
+class ProgressStore:
+    """
+    账单进度的快照 + 追加日志存储
+
+    记录每条已落盘账单内容的指纹，save_bills 据此找出变化的账单，只把它们追加到日志。
+    指纹未知（进程刚启动、快照被外部删除或被其他进程重写）时退回整体写快照。
+
+    读写快照和日志时同时持有线程锁与快照旁的锁文件（见 core.atomic_file.file_lock），
+    多个进程共用同一份进度时不会交错写入；压缩在替换快照前确认快照未被其他进程换掉。
+    """
+
+    def __init__(
+        self,
+        snapshot_path,
+        journal_path,
+        compact_entries: int = PROGRESS_JOURNAL_COMPACT_ENTRIES,
+        snapshot_format: str = PROGRESS_SNAPSHOT_FORMAT,
+    ):
+        if snapshot_format not in ("columnar", "json"):
+            raise ValueError(f"未知的进度快照格式: {snapshot_format}")
+        self.snapshot_path = Path(snapshot_path)
+        self.journal_path = Path(journal_path)
+        # 正在折叠进快照的日志（压缩中断时下次加载仍会重放）
+        self.compacting_path = Path(f"{journal_path}.compacting")
+        self.compact_entries = compact_entries
+        self.snapshot_format = snapshot_format
+
+        self.lock_path = Path(f"{snapshot_path}.lock")
+
+        self._lock = threading.Lock()
+        # 本进程最后一次读写的快照文件标识，与磁盘上不一致说明快照被其他进程替换
+        self._snapshot_id: Optional[tuple] = None
+        # {交易订单号: 已落盘内容的指纹}，None 表示未知
+        self._digests: Optional[dict] = None
+        # 当前日志的条数，None 表示未统计
+        self._journal_entries: Optional[int] = None
+        # 整体写快照或清空时递增，用于丢弃过期的压缩结果
+        self._generation = 0
+        self._compactor: Optional[threading.Thread] = None
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """线程锁 + 跨进程锁"""
+        with self._lock, file_lock(self.lock_path):
+            yield
+
+    def _snapshot_identity(self) -> Optional[tuple]:
+        """快照文件标识 (inode, mtime_ns, size)，原子替换后会变化；快照不存在时返回 None"""
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    # ==================== 读取 ====================
+
+    def exists(self) -> bool:
+        """是否存在非空的进度"""
+        return any(
+            path.exists() and path.stat().st_size > 0
+            for path in (self.snapshot_path, self.compacting_path, self.journal_path)
+        )
+
+    def load(self) -> Optional[dict]:
+        """读取快照并重放日志，没有进度时返回 None"""
+        with self._locked():
+            snapshot = self._read_snapshot()
+            if snapshot is None:
+                return None
+            bills, digests, snapshot_format = snapshot
+            self._snapshot_id = self._snapshot_identity()
+            for path in (self.compacting_path, self.journal_path):
+                for bill_id in self._replay(bills, path):
+                    if bill_id in bills:
+                        digests[bill_id] = _digest(bills[bill_id])
+                    else:
+                        digests.pop(bill_id, None)
+            self._digests = digests
+            if snapshot_format != self.snapshot_format:
+                # 迁移旧格式：按当前格式重写快照（顺带折叠日志）
+                self._rewrite(bills)
+            return bills
+
+    def _read_snapshot(self) -> Optional[Tuple[dict, dict, str]]:
+        """读取快照，返回 (账单, {交易订单号: 指纹}, 快照格式)，没有快照时返回 None"""
+        if not self.snapshot_path.exists():
+            return None
+        with open(self.snapshot_path, "rb") as f:
+            data = f.read()
+        if data.startswith(SNAPSHOT_MAGIC):
+            return (*decode_columnar(data), "columnar")
+        bills = as_bill_dict(json.loads(data.decode("utf-8")))
+        return bills, {bill_id: _digest(bill) for bill_id, bill in bills.items()}, "json"
+
+    @staticmethod
+    def _replay(bills: dict, path: Path) -> list:
+        """按顺序把日志应用到 bills（原地修改），返回涉及的交易订单号；末尾写了一半的行忽略"""
+        if not path.exists():
+            return []
+        bill_ids = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if entry["bill"] is None:
+                    bills.pop(entry["id"], None)
+                else:
+                    bills[entry["id"]] = entry["bill"]
+                bill_ids.append(entry["id"])
+        return bill_ids
+
+    # ==================== 写入 ====================
+
+    def write_snapshot(self, bills: dict) -> None:
+        """整体写快照并清空日志（上传、全量打标等批量改动）"""
+        with self._locked():
+            self._rewrite(bills)
+
+    def _rewrite(self, bills: dict) -> None:
+        self._generation += 1
+        # 先删日志再替换快照：中途崩溃时留下旧快照，而不是新快照 + 过期日志
+        self._remove_journals()
+        self._write_snapshot(bills)
+
+    def _write_snapshot(self, bills: dict) -> None:
+        data, digests = self._encode_snapshot(bills)
+        atomic_write_bytes(self.snapshot_path, data)
+        self._digests = digests
+        self._snapshot_id = self._snapshot_identity()
+
+    def _encode_snapshot(self, bills: dict) -> Tuple[bytes, dict]:
+        """按 snapshot_format 编码快照，同时返回 {交易订单号: 指纹}"""
+        if self.snapshot_format == "columnar":
+            return encode_columnar(bills)
+        digests = {}
+        parts = []
+        for bill_id, bill in bills.items():
+            digests[bill_id] = _digest(bill)
+            parts.append(f"{json.dumps(bill_id, ensure_ascii=False)}: {_dump_bill(bill)}")
+        return ("{" + ", ".join(parts) + "}").encode("utf-8"), digests
+
+    def save_bills(self, bills: dict, bill_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        保存账单改动
+
+        Args:
+            bills: 全部账单
+            bill_ids: 可能变化的账单 ID；不传时与已落盘内容逐条比较，
+                      并把已不在 bills 中的账单记为删除
+
+        Returns:
+            追加到日志的条数（退回整体写快照时为全部账单数）
+        """
+        with self._locked():
+            snapshot_id = self._snapshot_identity()
+            if self._digests is None or snapshot_id is None or snapshot_id != self._snapshot_id:
+                self._rewrite(bills)
+                return len(bills)
+
+            digests = self._digests
+            lines = []
+            candidates = bills.keys() if bill_ids is None else bill_ids
+            for bill_id in candidates:
+                bill = bills.get(bill_id)
+                if bill is None:
+                    if digests.pop(bill_id, None) is not None:
+                        lines.append(json.dumps({"id": bill_id, "bill": None}, ensure_ascii=False))
+                    continue
+                digest = _digest(bill)
+                if digests.get(bill_id) == digest:
+                    continue
+                digests[bill_id] = digest
+                lines.append(f'{{"id": {json.dumps(bill_id, ensure_ascii=False)}, "bill": {_dump_bill(bill)}}}')
+            if bill_ids is None:
+                removed = [bill_id for bill_id in digests if bill_id not in bills]
+                for bill_id in removed:
+                    del digests[bill_id]
+                    lines.append(json.dumps({"id": bill_id, "bill": None}, ensure_ascii=False))
+
+            if lines:
+                self._append(lines)
+            return len(lines)
+
+    def _append(self, lines: list) -> None:
+        if self._journal_entries is None:
+            self._journal_entries = self._truncate_torn_tail(self.journal_path)
+        try:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            # 可能留下写了一半的行，下次追加前重新检查
+            self._journal_entries = None
+            raise
+        self._journal_entries += len(lines)
+        if self._journal_entries >= self.compact_entries:
+            self._start_compaction()
+
+    @staticmethod
+    def _truncate_torn_tail(path: Path) -> int:
+        """
+        截掉日志末尾写了一半的行（上次写入中途崩溃），返回完整的行数
+
+        重放在第一条无法解析的行处停止，不截掉的话之后追加的改动都会被忽略。
+        """
+        if not path.exists():
+            return 0
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+        return data.count(b"\n", 0, end)
+
+    def _remove_journals(self) -> None:
+        for path in (self.compacting_path, self.journal_path):
+            if path.exists():
+                os.remove(path)
+        self._journal_entries = 0
+
+    def clear(self) -> None:
+        """删除快照和日志"""
+        with self._locked():
+            self._generation += 1
+            if self.snapshot_path.exists():
+                os.remove(self.snapshot_path)
+            self._remove_journals()
+            self._digests = None
+            self._snapshot_id = None
+
+    # ==================== 压缩 ====================
+
+    def _start_compaction(self) -> None:
+        """在后台线程压缩日志（调用方持有锁），已有压缩在进行时跳过"""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact, name="progress-compactor", daemon=True)
+        self._compactor.start()
+
+    def wait_for_compaction(self) -> None:
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def compact(self) -> None:
+        """
+        把日志折叠进新快照
+
+        先把当前日志改名为 .compacting（之后的改动写入新日志，不阻塞保存），
+        在锁外生成新快照；替换快照和删除 .compacting 在锁内完成。
+        期间快照被整体重写或清空（包括其他进程所为）时放弃本次结果。
+        """
+        with self._locked():
+            if not self.snapshot_path.exists():
+                return
+            if self.journal_path.exists():
+                self._truncate_torn_tail(self.journal_path)
+                if self.compacting_path.exists():
+                    # 上次压缩中断：把新日志并入待压缩的日志
+                    self._truncate_torn_tail(self.compacting_path)
+                    with open(self.journal_path, "r", encoding="utf-8") as src, \
+                            open(self.compacting_path, "a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.compacting_path)
+            elif not self.compacting_path.exists():
+                return
+            self._journal_entries = 0
+            generation = self._generation
+            snapshot_id = self._snapshot_identity()
+
+        # 每个压缩线程各用一个临时文件（其他进程可能同时在压缩同一份日志）
+        tmp_path = Path(f"{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            bills = self._read_snapshot()[0]
+            self._replay(bills, self.compacting_path)
+            write_synced(tmp_path, self._encode_snapshot(bills)[0])
+        except (OSError, TypeError, ValueError, zlib.error):
+            # 快照在压缩期间被整体重写或删除
+            if generation == self._generation and self._snapshot_identity() == snapshot_id:
+                raise
+            return
+
+        with self._locked():
+            if generation != self._generation or self._snapshot_identity() != snapshot_id:
+                os.remove(tmp_path)
+                return
+            replaced_own = self._snapshot_id == snapshot_id
+            os.replace(tmp_path, self.snapshot_path)
+            os.remove(self.compacting_path)
+            fsync_directory(self.snapshot_path.parent)
+            if replaced_own:
+                # 内容不变，本进程记录的指纹仍然有效
+                self._snapshot_id = self._snapshot_identity()
+
+
+# 当前进度（data/bills.process）
+progress_store = ProgressStore(PROGRESS_FILE, PROGRESS_JOURNAL_FILE)
+
+
+def load_progress_bills() -> Optional[Dict[str, Bill]]:
+    """读取当前进度并转为 Bill，没有进度时返回 None"""
+    bills = progress_store.load()
+    if bills is None:
+        return None
+    return {bill_id: Bill.from_dict(bill) for bill_id, bill in bills.items()}
@@ -0,0 +1,500 @@
+"""
+规则编译与匹配模块
+
+将 rules.json 中的规则一次性编译为多模式匹配器，供 apply_rules_to_bills 使用。
+
+匹配语义与逐条规则遍历完全一致（先命中者优先）：
+    规则顺序 → 规则内字段顺序（ANY 为 交易对方、商品说明）→ 规则内关键词顺序
+"""
+import json
+import re
+from collections import Counter
+from functools import lru_cache
+from time import perf_counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+
+# ANY 规则覆盖的字段（顺序即匹配优先级）
+ANY_RULE_FIELDS: Tuple[str, ...] = ("交易对方", "商品说明")
+
+# 命中优先级：(规则序号, 字段序号, 关键词序号)，越小越优先
+Priority = Tuple[int, int, int]
+
+# 单个合并正则最多包含的子模式数
+REGEX_GROUP_SIZE = 64
+
+# 无法安全放入合并正则的写法：命名组、反向引用、条件组、全局内联标志
+_REGEX_UNGROUPABLE_RE = re.compile(r"\(\?P[<=]|\\[1-9]|\\g<|\(\?\(|^\(\?[aiLmsux]+\)")
+
+
+@lru_cache(maxsize=4096)
+def compile_pattern(pattern: str) -> Tuple[Optional[re.Pattern], str]:
+    """
+    编译单个正则（带缓存）
+
+    Returns:
+        (编译结果, 错误信息)，编译失败时编译结果为 None
+    """
+    try:
+        return re.compile(pattern), ""
+    except re.error as e:
+        return None, str(e)
+
+
+def validate_rules(rules: List[dict]) -> List[str]:
+    """检查规则中的无效正则，返回错误描述列表（为空表示全部有效）"""
+    errors = []
+    for idx, rule in enumerate(rules):
+        if not isinstance(rule, dict) or rule.get("match_mode") != "regex":
+            continue
+        for pattern in rule.get("rule") or []:
+            _compiled, error = compile_pattern(pattern)
+            if error:
+                errors.append(f"第 {idx + 1} 条规则的正则 {pattern!r} 无效: {error}")
+    return errors
+
+
+def rule_target_fields(rule: dict) -> Tuple[str, ...]:
+    """返回规则需要匹配的账单字段"""
+    key = rule.get("key", "")
+    if key == "ANY":
+        return ANY_RULE_FIELDS
+    return (key,)
+
+
+def rule_match_plan(rule: dict) -> Tuple[Tuple[str, ...], List[str]]:
+    """
+    返回规则实际参与匹配的 (字段, 模式)
+
+    逐条匹配时空模式总能命中，但命中结果是空字符串，会被当作未命中并结束该规则的匹配，
+    因此空模式之后的模式、以及第一个字段之后的字段都不会生效。
+    """
+    fields = rule_target_fields(rule)
+    patterns = list(rule.get("rule") or [])
+    if "" in patterns:
+        return fields[:1], patterns[:patterns.index("")]
+    return fields, patterns
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick 多关键词自动机
+
+    每个关键词携带一个可比较的 payload，search() 单次扫描文本，
+    返回所有命中关键词中 payload 最小的一个。
+    """
+
+    __slots__ = ("_goto", "_fail", "_best", "_built")
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._best: List[Optional[Any]] = [None]
+        self._built = False
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def add(self, keyword: str, payload: Any) -> None:
+        """添加关键词，同一关键词重复添加时保留最小的 payload"""
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            state = nxt
+
+        current = self._best[state]
+        if current is None or payload < current:
+            self._best[state] = payload
+        self._built = False
+
+    def build(self) -> None:
+        """计算失败指针，并沿失败链把最优 payload 向下传递"""
+        goto, fail, best = self._goto, self._fail, self._best
+        queue = list(goto[0].values())
+        for state in queue:
+            fail[state] = 0
+
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+
+                inherited = best[fail[nxt]]
+                if inherited is not None and (best[nxt] is None or inherited < best[nxt]):
+                    best[nxt] = inherited
+
+        self._built = True
+
+    def search(self, text: str) -> Optional[Any]:
+        """扫描文本，返回命中关键词中最小的 payload，未命中返回 None"""
+        if not self._built:
+            self.build()
+
+        goto, fail, best_of = self._goto, self._fail, self._best
+        best = best_of[0]  # 空关键词始终命中
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            candidate = best_of[state]
+            if candidate is not None and (best is None or candidate < best):
+                best = candidate
+        return best
+
+
+class RegexGroup:
+    """
+    合并正则组
+
+    把同一字段上的多条正则合并为一个带命名组的交替式，一次 search 即可判断
+    整组是否可能命中；命中后只需逐条复核排在命中项之前的正则。
+    """
+
+    __slots__ = ("entries", "combined")
+
+    def __init__(self, entries: List[Tuple[Priority, re.Pattern]]):
+        self.entries = entries
+        self.combined: Optional[re.Pattern] = None
+        if len(entries) > 1:
+            alternation = "|".join(
+                f"(?P<r{idx}>{compiled.pattern})" for idx, (_priority, compiled) in enumerate(entries)
+            )
+            try:
+                self.combined = re.compile(alternation)
+            except re.error:
+                self.combined = None
+
+    @property
+    def first(self) -> Priority:
+        return self.entries[0][0]
+
+    def search(self, text: str, limit: Optional[Priority]) -> Optional[Priority]:
+        """返回组内命中的最小优先级（需小于 limit），未命中返回 None"""
+        end = len(self.entries)
+        if self.combined is not None:
+            m = self.combined.search(text)
+            if m is None:
+                return None
+            # 交替式返回的是最左位置上的第一个子模式，之前的子模式可能在更右侧命中
+            end = int(m.lastgroup[1:])
+
+        for priority, compiled in self.entries[:end]:
+            if limit is not None and priority >= limit:
+                return None
+            if compiled.search(text):
+                return priority
+
+        if end < len(self.entries):
+            priority = self.entries[end][0]
+            if limit is None or priority < limit:
+                return priority
+        return None
+
+
+class CompiledRuleSet:
+    """
+    编译后的规则集
+
+    按字段为关键词规则各建一个自动机；正则规则预编译后按字段合并成组。
+    """
+
+    def __init__(self, rules: List[dict]):
+        self.rules = rules
+        self._automata: Dict[str, KeywordAutomaton] = {}
+        # 每个字段上的合并正则组，组内与组间均按优先级排序
+        self._regex_groups: Dict[str, List[RegexGroup]] = {}
+        # 编译失败的正则（已跳过，与逐条匹配时忽略无效正则的行为一致）
+        self.errors: List[str] = []
+        self._compile()
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _compile(self) -> None:
+        regex_entries: Dict[str, List[Tuple[Priority, re.Pattern]]] = {}
+        self.errors = validate_rules(self.rules)
+
+        for rule_idx, rule in enumerate(self.rules):
+            is_regex = rule.get("match_mode") == "regex"
+            fields, patterns = rule_match_plan(rule)
+            for field_idx, field in enumerate(fields):
+                for pattern_idx, pattern in enumerate(patterns):
+                    priority = (rule_idx, field_idx, pattern_idx)
+                    if is_regex:
+                        compiled, _error = compile_pattern(pattern)
+                        if compiled is not None:
+                            regex_entries.setdefault(field, []).append((priority, compiled))
+                    else:
+                        automaton = self._automata.setdefault(field, KeywordAutomaton())
+                        automaton.add(pattern, priority)
+
+        for automaton in self._automata.values():
+            automaton.build()
+
+        for field, entries in regex_entries.items():
+            self._regex_groups[field] = self._group_regex_entries(entries)
+
+    @staticmethod
+    def _group_regex_entries(entries: List[Tuple[Priority, re.Pattern]]) -> List[RegexGroup]:
+        """按优先级顺序切分正则组，无法合并的正则单独成组"""
+        groups: List[RegexGroup] = []
+        pending: List[Tuple[Priority, re.Pattern]] = []
+        for entry in sorted(entries, key=lambda item: item[0]):
+            if _REGEX_UNGROUPABLE_RE.search(entry[1].pattern):
+                if pending:
+                    groups.append(RegexGroup(pending))
+                    pending = []
+                groups.append(RegexGroup([entry]))
+                continue
+            pending.append(entry)
+            if len(pending) >= REGEX_GROUP_SIZE:
+                groups.append(RegexGroup(pending))
+                pending = []
+        if pending:
+            groups.append(RegexGroup(pending))
+        return groups
+
+    def _search_regex(self, bill: dict, limit: Optional[Priority]) -> Optional[Priority]:
+        best = limit
+        found = None
+        for field, groups in self._regex_groups.items():
+            text = bill.get(field) or ""
+            for group in groups:
+                if best is not None and group.first >= best:
+                    break
+                priority = group.search(text, best)
+                if priority is not None:
+                    best = found = priority
+                    break
+        return found
+
+    def match(self, bill: dict) -> Optional[Tuple[dict, str]]:
+        """
+        返回账单命中的第一条规则及命中的模式
+
+        Returns:
+            (规则, 模式) 或 None
+        """
+        best: Optional[Priority] = None
+        for field, automaton in self._automata.items():
+            found = automaton.search(bill.get(field) or "")
+            if found is not None and (best is None or found < best):
+                best = found
+
+        if self._regex_groups:
+            regex_best = self._search_regex(bill, best)
+            if regex_best is not None:
+                best = regex_best
+
+        if best is None:
+            return None
+
+        rule_idx, _field_idx, pattern_idx = best
+        rule = self.rules[rule_idx]
+        return rule, rule["rule"][pattern_idx]
+
+
+def compile_rules(rules: List[dict]) -> CompiledRuleSet:
+    """将规则列表编译为匹配器"""
+    return CompiledRuleSet(rules)
+
+
+# ==================== 规则统计 ====================
+
+def match_single_rule(bill: dict, rule: dict) -> Optional[str]:
+    """逐字段、逐模式检查单条规则，返回命中的模式（无效正则视为不命中）"""
+    is_regex = rule.get("match_mode") == "regex"
+    fields, patterns = rule_match_plan(rule)
+    for field in fields:
+        text = bill.get(field) or ""
+        for pattern in patterns:
+            if is_regex:
+                compiled, _error = compile_pattern(pattern)
+                if compiled is not None and compiled.search(text):
+                    return pattern
+            elif pattern in text:
+                return pattern
+    return None
+
+
+class RuleStats:
+    """
+    按规则统计的命中情况
+
+    evaluations: 账单走到该规则时做匹配的次数
+    hits:        该规则作为第一条命中规则的次数
+    seconds:     该规则累计匹配耗时
+    """
+
+    def __init__(self, rules: List[dict]):
+        self.rules = rules
+        self.evaluations = [0] * len(rules)
+        self.hits = [0] * len(rules)
+        self.seconds = [0.0] * len(rules)
+        self.bills = 0
+
+    @property
+    def matched(self) -> int:
+        return sum(self.hits)
+
+    def average_position(self) -> Optional[float]:
+        """命中时规则在列表中的平均位置（从 0 开始），没有命中时为 None"""
+        if not self.matched:
+            return None
+        return sum(idx * hits for idx, hits in enumerate(self.hits)) / self.matched
+
+    def to_dict(self) -> dict:
+        average = self.average_position()
+        return {
+            "bills": self.bills,
+            "matched": self.matched,
+            "average_position": None if average is None else round(average, 2),
+            "average_evaluations": round(sum(self.evaluations) / self.bills, 2) if self.bills else 0,
+            "total_ms": round(sum(self.seconds) * 1000, 3),
+            "rules": [
+                {
+                    "index": idx,
+                    "key": rule.get("key", ""),
+                    "rule": rule.get("rule") or [],
+                    "match_mode": rule.get("match_mode") or "keyword",
+                    "category": rule.get("category", ""),
+                    "tag": rule.get("tag", ""),
+                    "evaluations": self.evaluations[idx],
+                    "hits": self.hits[idx],
+                    "total_ms": round(self.seconds[idx] * 1000, 3),
+                    "avg_us": round(self.seconds[idx] * 1e6 / self.evaluations[idx], 3) if self.evaluations[idx] else 0,
+                }
+                for idx, rule in enumerate(self.rules)
+            ],
+        }
+
+
+class InstrumentedRuleSet:
+    """
+    带统计的逐条规则匹配器
+
+    接口与 CompiledRuleSet.match 相同，但按规则顺序逐条匹配并计时，
+    用于统计每条规则的匹配次数、命中次数和耗时（比编译匹配器慢）。
+    """
+
+    def __init__(self, rules: List[dict], stats: Optional[RuleStats] = None):
+        self.rules = rules
+        self.stats = stats if stats is not None else RuleStats(rules)
+
+    def match(self, bill: dict) -> Optional[Tuple[dict, str]]:
+        stats = self.stats
+        stats.bills += 1
+        for idx, rule in enumerate(self.rules):
+            start = perf_counter()
+            matched = match_single_rule(bill, rule)
+            stats.seconds[idx] += perf_counter() - start
+            stats.evaluations[idx] += 1
+            if matched is not None:
+                stats.hits[idx] += 1
+                return rule, matched
+        return None
+
+
+# ==================== 规则差异 ====================
+
+class RuleDiff(NamedTuple):
+    """新旧规则列表的差异（按匹配条件比较）"""
+    added: List[int]      # 新列表中新增或匹配条件改动过的规则序号
+    removed: List[int]    # 旧列表中被删除或匹配条件改动过的规则序号
+    reordered: bool       # 保留下来的规则相对顺序是否变化
+
+    @property
+    def unchanged(self) -> bool:
+        return not (self.added or self.removed or self.reordered)
+
+
+def rule_signature(rule: dict) -> tuple:
+    """规则的匹配条件签名，类别/标签/备注等打标结果不参与比较"""
+    return (
+        rule.get("key", ""),
+        rule.get("match_mode") or "keyword",
+        tuple(rule.get("rule") or []),
+    )
+
+
+def diff_rules(old_rules: List[dict], new_rules: List[dict]) -> RuleDiff:
+    """比较新旧规则列表，找出新增、删除的规则以及顺序是否变化"""
+    old_signatures = [rule_signature(rule) for rule in old_rules]
+    new_signatures = [rule_signature(rule) for rule in new_rules]
+
+    remaining = Counter(old_signatures)
+    added, kept = [], []
+    for idx, signature in enumerate(new_signatures):
+        if remaining[signature] > 0:
+            remaining[signature] -= 1
+            kept.append(signature)
+        else:
+            added.append(idx)
+
+    removed = []
+    for idx in range(len(old_signatures) - 1, -1, -1):
+        signature = old_signatures[idx]
+        if remaining[signature] > 0:
+            remaining[signature] -= 1
+            removed.append(idx)
+    removed.reverse()
+
+    removed_set = set(removed)
+    old_kept = [sig for idx, sig in enumerate(old_signatures) if idx not in removed_set]
+    return RuleDiff(added=added, removed=removed, reordered=old_kept != kept)
+
+
+def rules_fingerprint(rules: List[dict]) -> str:
+    """规则列表的内容指纹（规则集版本），用于记录账单已按哪组规则打过标"""
+    return json.dumps(rules, ensure_ascii=False, sort_keys=True)
+
+
+def rule_label(rule: dict, pattern: str) -> str:
+    """规则命中某个模式时写入账单 命中规则 字段的内容"""
+    return f"{rule['key']}: {pattern}"
+
+
+def _rule_version(rule: dict) -> tuple:
+    """规则的匹配条件与打标结果，任一变化都视为规则被改动"""
+    return (
+        rule_signature(rule),
+        rule.get("category", ""),
+        rule.get("tag", ""),
+        rule.get("comment", ""),
+        json.dumps(rule.get("time_based") or [], ensure_ascii=False, sort_keys=True),
+    )
+
+
+def changed_rule_labels(old_rules: List[dict], new_rules: List[dict]) -> Dict[str, set]:
+    """
+    找出旧规则中被删除或改动（匹配条件或打标结果）的规则
+
+    Returns:
+        {命中规则: {(类别, 备注), ...}}：命中规则 字段为该内容、且类别与备注仍是该旧规则打标结果的账单
+        由被改动的规则打标
+    """
+    kept = Counter(_rule_version(rule) for rule in new_rules)
+    labels: Dict[str, set] = {}
+    for rule in old_rules:
+        version = _rule_version(rule)
+        if kept[version] > 0:
+            kept[version] -= 1
+            continue
+        result = (rule.get("category", ""), rule.get("comment", ""))
+        for pattern in rule.get("rule") or []:
+            labels.setdefault(rule_label(rule, pattern), set()).add(result)
+    return labels
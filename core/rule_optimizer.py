@@ -0,0 +1,159 @@
+"""
+规则顺序优化
+
+规则按“先命中者优先”生效。在不改变当前账单打标结果的前提下，把命中多的规则往前移，
+让常见账单更早结束匹配。
+
+两条规则存在冲突（相对顺序必须保留）的判断：
+    - 在当前账单中观察到同时命中两条规则的账单
+    - 共享字段的关键词规则之间，某个关键词包含另一个关键词
+    - 共享字段且其中一条是正则规则（无法静态判断，保守视为冲突）
+
+没有冲突的规则互换顺序，不会改变当前任何一条账单的打标结果；这一保证只针对当前账单。
+共享字段的两条关键词规则即使关键词互不包含，也可能被以后的账单同时命中（如 “美团” 与
+“外卖” 都能命中 “美团外卖”），交换后这类账单的打标结果会改变。这样的规则对记在
+RuleOrderReport.unverified 中。
+"""
+import heapq
+from typing import Dict, List, NamedTuple, Set
+
+from core.bill_index import INDEXED_FIELDS, BillTextIndex
+from core.rule_engine import compile_pattern, match_single_rule, rule_match_plan
+
+
+class RuleOrderReport(NamedTuple):
+    """规则顺序优化结果"""
+    order: List[int]           # 新顺序中每个位置对应的原规则序号
+    hits: List[int]            # 每条规则（原序号）在当前账单上的首次命中次数
+    conflicts: int             # 冲突的规则对数
+    unverified: int            # 交换了顺序、以后的账单可能同时命中的规则对数
+    bills: int                 # 参与统计的账单数
+    before: float              # 优化前平均每条账单的规则比较次数
+    after: float               # 优化后平均每条账单的规则比较次数
+
+    @property
+    def moved(self) -> int:
+        return sum(1 for position, idx in enumerate(self.order) if position != idx)
+
+    def to_dict(self) -> dict:
+        return {
+            "order": self.order,
+            "moved": self.moved,
+            "conflicts": self.conflicts,
+            "unverified_pairs": self.unverified,
+            "bills": self.bills,
+            "avg_comparisons_before": round(self.before, 2),
+            "avg_comparisons_after": round(self.after, 2),
+        }
+
+
+def _matching_bills(rule: dict, bills: dict, index: BillTextIndex) -> Set[str]:
+    """规则在账单中能命中的全部账单 ID（不考虑其他规则）"""
+    fields, patterns = rule_match_plan(rule)
+    is_regex = rule.get("match_mode") == "regex"
+    if is_regex:
+        patterns = [pattern for pattern in patterns if compile_pattern(pattern)[0] is not None]
+    if not patterns:
+        return set()
+
+    if all(field in INDEXED_FIELDS for field in fields):
+        result: Set[str] = set()
+        for field in fields:
+            result |= index.search(patterns, field, "regex" if is_regex else "keyword")
+        return result
+    return {bill_id for bill_id, bill in bills.items() if match_single_rule(bill, rule) is not None}
+
+
+def _share_fields(a: dict, b: dict) -> bool:
+    """两条规则都有匹配模式且匹配字段有交集（存在同时命中两者的账单的可能）"""
+    fields_a, patterns_a = rule_match_plan(a)
+    fields_b, patterns_b = rule_match_plan(b)
+    return bool(patterns_a and patterns_b and set(fields_a) & set(fields_b))
+
+
+def _static_conflict(a: dict, b: dict) -> bool:
+    """
+    不看账单、仅凭规则本身判断两条规则是否必须保持相对顺序
+
+    只把一个关键词包含另一个关键词（命中前者的文本必然命中后者）和正则规则视为冲突；
+    关键词互不包含的规则仍可能被同一条账单同时命中，见 _share_fields。
+    """
+    if not _share_fields(a, b):
+        return False
+    if a.get("match_mode") == "regex" or b.get("match_mode") == "regex":
+        return True
+    patterns_a = rule_match_plan(a)[1]
+    patterns_b = rule_match_plan(b)[1]
+    return any(p in q or q in p for p in patterns_a for q in patterns_b)
+
+
+def optimize_rule_order(rules: List[dict], bills: dict) -> RuleOrderReport:
+    """
+    计算不改变当前账单打标结果的最优规则顺序
+
+    在冲突约束下做拓扑排序，每一步从可放置的规则中选当前账单上命中最多的一条
+    （命中数相同时保持原顺序）。新顺序对以后的账单不一定保持语义，
+    交换了顺序且共享匹配字段的规则对数见 RuleOrderReport.unverified。
+
+    Args:
+        rules: 规则列表
+        bills: 用于统计命中频率的账单（打标结果不参与匹配）
+    """
+    index = BillTextIndex.from_bills(bills)
+    matches = [_matching_bills(rule, bills, index) for rule in rules]
+
+    # 每条账单能命中的规则（按原顺序）
+    rules_by_bill: Dict[str, List[int]] = {}
+    for idx, bill_ids in enumerate(matches):
+        for bill_id in bill_ids:
+            rules_by_bill.setdefault(bill_id, []).append(idx)
+
+    hits = [0] * len(rules)
+    edges: List[Set[int]] = [set() for _ in rules]
+    for matched in rules_by_bill.values():
+        hits[matched[0]] += 1
+        for pos, earlier in enumerate(matched):
+            edges[earlier].update(matched[pos + 1:])
+
+    # 共享字段但不算冲突的规则对（可以交换，但以后的账单可能同时命中）
+    overlapping = []
+    for i in range(len(rules)):
+        for j in range(i + 1, len(rules)):
+            if j in edges[i]:
+                continue
+            if _static_conflict(rules[i], rules[j]):
+                edges[i].add(j)
+            elif _share_fields(rules[i], rules[j]):
+                overlapping.append((i, j))
+
+    indegree = [0] * len(rules)
+    for targets in edges:
+        for j in targets:
+            indegree[j] += 1
+
+    ready = [(-hits[idx], idx) for idx in range(len(rules)) if indegree[idx] == 0]
+    heapq.heapify(ready)
+    order: List[int] = []
+    while ready:
+        _neg_hits, idx = heapq.heappop(ready)
+        order.append(idx)
+        for j in edges[idx]:
+            indegree[j] -= 1
+            if indegree[j] == 0:
+                heapq.heappush(ready, (-hits[j], j))
+
+    position = {idx: pos for pos, idx in enumerate(order)}
+    unmatched = len(bills) - len(rules_by_bill)
+    before = sum(matched[0] + 1 for matched in rules_by_bill.values()) + unmatched * len(rules)
+    after = sum(position[matched[0]] + 1 for matched in rules_by_bill.values()) + unmatched * len(rules)
+    total = len(bills) or 1
+
+    return RuleOrderReport(
+        order=order,
+        hits=hits,
+        conflicts=sum(len(targets) for targets in edges),
+        unverified=sum(1 for i, j in overlapping if position[j] < position[i]),
+        bills=len(bills),
+        before=before / total,
+        after=after / total,
+    )
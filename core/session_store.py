@@ -0,0 +1,213 @@
+"""
+当前账单会话
+
+上传或加载进度后的账单，供多个请求线程并发访问：
+- 读者通过 snapshot() 取得某一版本的账单（BillSnapshot），只读使用，不受之后的编辑影响
+- 写者通过 edit() 在写时复制的字典上修改，退出时发布为新版本；编辑互相串行，
+  编辑期间读者继续读取旧版本，不会被长时间的打标阻塞
+- 版本号单调递增，每次发布加一（用于增量保存的冲突检测）；
+  epoch 在账单被整体替换（上传、加载进度等）时加一，同一 epoch 内的版本由编辑得到
+- tagged_rules 记录当前未打标的账单已经过哪组规则匹配（规则集指纹，见 core.rule_engine.rules_fingerprint），
+  规则变更时据此判断能否增量打标；整体替换时默认为 None（未知）
+
+发布出去的账单字典和其中的账单都不能再原地修改：编辑时先用 BillEdit.mutable()
+或 edit(copy_if=...) 取得副本。
+
+on_publish() 注册的回调在每次发布后（仍在编辑锁内）收到新版本和本次编辑涉及的账单 ID，
+用于增量维护由账单派生的数据（如 core.bill_index 的文本索引）。
+"""
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, NamedTuple, Optional, Set
+
+
+class RWLock:
+    """读写锁：允许多个读者并发，写者独占；有写者等待时新的读者排队，避免写者饿死"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read_locked(self) -> Iterator[None]:
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_locked(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class BillSnapshot(NamedTuple):
+    """某一版本的账单（只读）"""
+    bills: dict
+    version: int
+    epoch: int
+    # 未打标账单已经过匹配的规则集指纹，None 表示未知
+    tagged_rules: Optional[str] = None
+
+
+class BillEdit:
+    """一次编辑：在写时复制的账单字典上修改，退出 edit() 时发布"""
+
+    def __init__(self, base: BillSnapshot, bills: dict, copied: set):
+        # 编辑开始时的版本
+        self.base = base
+        # 可修改的账单字典（与已发布的字典不是同一对象）
+        self.bills = bills
+        # 发布后的版本（取消或未发布时为 base）
+        self.result = base
+        # 发布时记录的规则集指纹（修改账单使未打标账单未经当前规则匹配时，调用方应置为 None）
+        self.tagged_rules = base.tagged_rules
+        self._copied = copied
+        self._removed: Set[str] = set()
+        self._working = bills
+        self._replaced = False
+        self._cancelled = False
+
+    def mutable(self, bill_id: str):
+        """取出可原地修改的账单（第一次取出时复制，不影响已发布的版本）"""
+        bill = self.bills[bill_id]
+        if not self._replaced and bill_id not in self._copied:
+            bill = self.bills[bill_id] = bill.copy()
+            self._copied.add(bill_id)
+        return bill
+
+    def add(self, bill_id: str, bill) -> None:
+        """新增或整条替换账单（bill 之后归本次编辑所有，可原地修改）"""
+        self.bills[bill_id] = bill
+        self._copied.add(bill_id)
+
+    def remove(self, bill_id: str) -> None:
+        """删除账单（不存在时忽略）"""
+        if self.bills.pop(bill_id, None) is not None:
+            self._removed.add(bill_id)
+
+    def changed_ids(self) -> Optional[Set[str]]:
+        """
+        本次编辑可能改动的账单 ID（取过副本、新增或删除的账单）
+
+        整体替换，或 bills 被换成了另一个字典时无法得知，返回 None。
+        """
+        if self._replaced or self.bills is not self._working:
+            return None
+        return self._copied | self._removed
+
+    def replace(self, bills: dict, tagged_rules: Optional[str] = None) -> None:
+        """整体替换为另一份账单（发布为新的 epoch），tagged_rules 为这些账单打标所用的规则集指纹"""
+        self.bills = bills
+        self.tagged_rules = tagged_rules
+        self._replaced = True
+
+    def cancel(self) -> None:
+        """放弃对账单的修改，不发布新版本（tagged_rules 有变化时只更新当前版本的记录）"""
+        self._cancelled = True
+
+
+class BillSession:
+    """当前账单会话（线程安全）"""
+
+    def __init__(self):
+        self._lock = RWLock()
+        # 串行化编辑；只在发布时短暂持有读写锁的写锁
+        self._edit_lock = threading.Lock()
+        self._snapshot = BillSnapshot({}, 0, 0)
+        self._listeners: List[Callable[[BillSnapshot, Optional[Set[str]]], None]] = []
+
+    def snapshot(self) -> BillSnapshot:
+        """当前版本的账单"""
+        with self._lock.read_locked():
+            return self._snapshot
+
+    @property
+    def bills(self) -> dict:
+        """当前版本的账单字典（只读）"""
+        return self.snapshot().bills
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
+    @contextmanager
+    def edit(self, copy_if: Optional[Callable[[dict], bool]] = None) -> Iterator[BillEdit]:
+        """
+        编辑当前账单，正常退出时发布为新版本，抛出异常时放弃
+
+        Args:
+            copy_if: 进入编辑时预先复制满足条件的账单（用于会原地修改大量账单的打标），
+                     其余账单需要修改时用 BillEdit.mutable() 取出副本
+        """
+        with self._edit_lock:
+            base = self.snapshot()
+            if copy_if is None:
+                bills = dict(base.bills)
+                copied = set()
+            else:
+                bills = {}
+                copied = set()
+                for bill_id, bill in base.bills.items():
+                    if copy_if(bill):
+                        bill = bill.copy()
+                        copied.add(bill_id)
+                    bills[bill_id] = bill
+            edit = BillEdit(base, bills, copied)
+            yield edit
+            if edit._cancelled:
+                if edit.tagged_rules != base.tagged_rules:
+                    edit.result = self._publish(base._replace(tagged_rules=edit.tagged_rules), set())
+                return
+            epoch = base.epoch + 1 if edit._replaced else base.epoch
+            snapshot = BillSnapshot(edit.bills, base.version + 1, epoch, edit.tagged_rules)
+            edit.result = self._publish(snapshot, edit.changed_ids())
+
+    def replace(self, bills: dict) -> BillSnapshot:
+        """整体替换当前账单（bills 之后归会话所有，调用方不应再修改）"""
+        with self.edit() as edit:
+            edit.replace(bills)
+        return edit.result
+
+    def on_publish(self, listener: Callable[[BillSnapshot, Optional[Set[str]]], None]) -> None:
+        """
+        注册发布回调：listener(新版本, 涉及的账单 ID)，ID 为 None 表示整体替换或无法得知
+
+        回调在编辑锁内按发布顺序调用，异常会被记录并忽略（不影响已发布的版本）。
+        """
+        self._listeners.append(listener)
+
+    def _publish(self, snapshot: BillSnapshot, changed_ids: Optional[Set[str]]) -> BillSnapshot:
+        with self._lock.write_locked():
+            self._snapshot = snapshot
+        for listener in self._listeners:
+            try:
+                listener(snapshot, changed_ids)
+            except Exception as e:
+                print(f"账单发布回调失败: {e}")
+        return snapshot
+
+
+# 当前账单（供各路由共享）
+bill_session = BillSession()
@@ -3,14 +3,20 @@
 
 提供支付宝和微信账单的解析、过滤、自动打标功能，以及配置文件读写操作。
 """
+import os
 import re
+import io
 import csv
 import json
+import codecs
 import time
 import hashlib
+from bisect import bisect_right
 from datetime import datetime
 from abc import ABC, abstractmethod
-from typing import Dict, List, Any, Optional
+from contextlib import contextmanager
+from itertools import chain, count
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple
 
 from core.config import (
     MEAL_TIME_PERIODS,
@@ -19,6 +25,7 @@ from core.config import (
     WECHAT_CHECKPOINT_LINE,
     WECHAT_FORMAT_MARKER,
     SUPPORTED_ENCODINGS,
+    ENCODING_SNIFF_BYTES,
     SUBSIDY_KEYWORDS,
     SUBSIDY_DEDUCTION,
     MIN_AMOUNT,
@@ -35,25 +42,90 @@ from core.config import (
     OPENAI_MODEL,
     AI_TAG_BATCH_SIZE,
     AI_TAG_SYSTEM_PROMPT,
+    PARALLEL_TAGGING_MIN_BILLS,
+    PARALLEL_TAGGING_CHUNK_SIZE,
+    PARALLEL_TAGGING_WORKERS,
+    CMB_PARALLEL_MIN_PAGES,
+    CMB_PARALLEL_PAGE_CHUNK,
+    CMB_PARALLEL_WORKERS,
+)
+from core.atomic_file import coalesced_write
+from core.bill import Bill
+from core.rule_engine import (
+    CompiledRuleSet,
+    InstrumentedRuleSet,
+    RuleStats,
+    changed_rule_labels,
+    compile_pattern,
+    compile_rules,
+    diff_rules,
+    rule_label,
+    rule_match_plan,
 )
 
 
 # ==================== 配置文件读写 ====================
 
+# 进程级配置缓存：{文件路径: (文件签名, 解析结果, 代数)}
+# 文件签名为 (mtime_ns, size)，外部改动文件后会自动失效；save_* 写入时直接刷新
+# 代数在每次重新解析或 save_* 写入时递增，用于判断由配置派生的数据（编译后的规则）是否过期：
+# save_* 可能写回同一个被原地修改过的对象，只比较对象无法发现改动
+_json_cache: Dict[str, tuple] = {}
+_json_generation = count(1)
+
+# 规则编译缓存：(规则缓存的代数, 编译结果)
+_compiled_rules_cache: tuple = (None, None)
+
+
+def _file_signature(file_path) -> Optional[tuple]:
+    """返回文件签名，文件不存在时返回 None"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
 def _load_json(file_path, default: Any) -> Any:
-    """加载 JSON 文件，文件不存在时返回默认值"""
+    """
+    加载 JSON 文件，文件不存在时返回默认值
+
+    文件未变化时直接返回缓存的解析结果（同一对象），调用方如需修改，
+    应在修改后通过对应的 save_* 写回。
+    """
+    cache_key = str(file_path)
+    signature = _file_signature(file_path)
+    if signature is None:
+        _json_cache.pop(cache_key, None)
+        return default
+
+    cached = _json_cache.get(cache_key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
     try:
-        return json.loads(file_path.read_text(encoding="utf-8"))
+        data = json.loads(file_path.read_text(encoding="utf-8"))
     except FileNotFoundError:
+        _json_cache.pop(cache_key, None)
         return default
+    _json_cache[cache_key] = (signature, data, next(_json_generation))
+    return data
 
 
 def _save_json(file_path, data: Any, indent: int = 2) -> None:
-    """保存数据到 JSON 文件"""
-    file_path.write_text(
-        json.dumps(data, ensure_ascii=False, indent=indent),
-        encoding="utf-8"
-    )
+    """
+    保存数据到 JSON 文件，并同步刷新缓存
+
+    原子写入（临时文件 + fsync + 改名），同一文件的并发/突发保存合并为一次落盘，
+    见 core.atomic_file.coalesced_write。
+    """
+    def render() -> bytes:
+        return json.dumps(data, ensure_ascii=False, indent=indent).encode("utf-8")
+
+    def refresh_cache() -> None:
+        _json_cache[str(file_path)] = (_file_signature(file_path), data, next(_json_generation))
+
+    coalesced_write(file_path, render, refresh_cache)
 
 
 def load_rules() -> list:
@@ -61,6 +133,20 @@ def load_rules() -> list:
     return _load_json(RULES_FILE, [])
 
 
+def get_compiled_rules() -> CompiledRuleSet:
+    """获取编译后的规则集，规则文件未变化时复用上次的编译结果"""
+    global _compiled_rules_cache
+    rules = load_rules()
+    # 缓存项整体替换，取到的代数与其中的规则对象一一对应；规则文件不存在时不缓存
+    cached = _json_cache.get(str(RULES_FILE))
+    generation = cached[2] if cached is not None and cached[1] is rules else None
+    cached_generation, compiled = _compiled_rules_cache
+    if generation is None or cached_generation != generation:
+        compiled = compile_rules(rules)
+        _compiled_rules_cache = (generation, compiled)
+    return compiled
+
+
 def save_rules(rules: list) -> None:
     """保存规则配置"""
     _save_json(RULES_FILE, rules)
@@ -124,6 +210,112 @@ class RefundError(BillProcessError):
     """退款处理错误"""
 
 
+# ==================== 账单文件读取 ====================
+
+# BOM 与去掉 BOM 后使用的编码
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+
+def detect_encoding(file_path: str, checkpoint_line: int, marker: str) -> Tuple[str, int]:
+    """
+    识别账单文件编码，并定位账单明细（CSV 表头）的起始字节
+    
+    先看 BOM；没有 BOM 时只读取文件头 ENCODING_SNIFF_BYTES 字节，
+    依次用 SUPPORTED_ENCODINGS 增量解码，第 checkpoint_line 行以 marker 开头即认为编码正确。
+    
+    Returns:
+        (编码, 第 checkpoint_line 行之后的字节偏移)
+    
+    Raises:
+        FileFormatError: 所有编码都无法解码或找不到格式标记
+    """
+    with open(file_path, "rb") as f:
+        head = f.read(ENCODING_SNIFF_BYTES)
+    
+    bom_len, candidates = 0, SUPPORTED_ENCODINGS
+    for bom, enc in _BOMS:
+        if head.startswith(bom):
+            bom_len, candidates = len(bom), [enc]
+            break
+    
+    for enc in candidates:
+        try:
+            text = codecs.getincrementaldecoder(enc)().decode(head[bom_len:], final=False)
+        except UnicodeError:  # 包括 UTF-16 缺少 BOM
+            continue
+        
+        # newline="" 保留原始换行符，重新编码后才能得到准确的字节数
+        buffer = io.StringIO(text, newline="")
+        lines = [buffer.readline() for _ in range(checkpoint_line)]
+        if not lines[-1].endswith(("\n", "\r")) or not lines[-1].startswith(marker):
+            continue
+        
+        offset = bom_len + len("".join(lines).encode(enc))
+        return enc, offset
+    
+    raise FileFormatError(
+        f"无法读取文件，尝试了所有支持的编码，第 {checkpoint_line} 行都不是账单格式标记"
+    )
+
+
+@contextmanager
+def open_bill_csv(file_path: str, encoding: str, offset: int) -> Iterator[csv.DictReader]:
+    """从 offset 处开始按 CSV 逐行读取账单明细（offset 处为表头）"""
+    with open(file_path, "rb") as raw:
+        raw.seek(offset)
+        with io.TextIOWrapper(raw, encoding=encoding, newline="") as f:
+            yield csv.DictReader(f)
+
+
+def _xlsx_cell_text(value: Any) -> str:
+    """把单元格值转为与 pandas 导出 CSV 一致的文本"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return str(value)
+
+
+def iter_xlsx_rows(file_path: str, checkpoint_line: int, marker: str) -> Iterator[dict]:
+    """
+    以 openpyxl 只读模式逐行读取 XLSX 账单
+    
+    第 checkpoint_line 行须以 marker 开头，下一行为表头，之后每行转为 {列名: 文本}，
+    单元格文本与 pandas 转换为 CSV 后再读取的结果一致；全空行跳过。
+    
+    Raises:
+        FileFormatError: 格式标记不在约定行
+    """
+    from openpyxl import load_workbook
+    
+    try:
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        raise FileFormatError(f"无法读取 XLSX 文件: {e}")
+    
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        checkpoint = None
+        for _ in range(checkpoint_line):
+            checkpoint = next(rows, None)
+        if not checkpoint or not _xlsx_cell_text(checkpoint[0]).startswith(marker):
+            raise FileFormatError(f"文件格式不正确，第 {checkpoint_line} 行验证失败")
+        
+        header = [_xlsx_cell_text(value) for value in next(rows, ())]
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            cells = [_xlsx_cell_text(value) for value in row[:len(header)]]
+            cells.extend([""] * (len(header) - len(cells)))
+            yield dict(zip(header, cells))
+    finally:
+        workbook.close()
+
+
 # ==================== 招商银行 PDF 解析辅助 ====================
 
 CMB_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
@@ -159,6 +351,7 @@ CMB_ENGLISH_HEADER_COMPACT_TOKENS = tuple(
     sorted({token.replace(" ", "") for token in CMB_ENGLISH_HEADER_TOKENS}, key=len, reverse=True)
 )
 CMB_REFUND_SUMMARY_KEYWORDS = ("退款",)
+CMB_WHITESPACE_RE = re.compile(r"\s+")
 
 
 def _cmb_parse_amount(text: str) -> Optional[float]:
@@ -175,7 +368,7 @@ def _cmb_parse_amount(text: str) -> Optional[float]:
 
 
 def _cmb_normalize_text(text: str) -> str:
-    return re.sub(r"\s+", "", text or "")
+    return CMB_WHITESPACE_RE.sub("", text or "")
 
 
 def _cmb_parse_bill_date(text: str) -> Optional[datetime]:
@@ -274,76 +467,97 @@ def _cmb_reconcile_refunds(bills: Dict[str, dict]) -> Dict[str, dict]:
     return _cmb_reconcile_refunds_with_issues(bills)[0]
 
 
-def _cmb_extract_char_items(page: Any) -> List[tuple]:
+def _cmb_extract_span_items(page: Any) -> List[tuple]:
+    """
+    提取页面上的文本片段 (x0, y0, x1, y1, text, chars)
+
+    chars 为 rawdict 中该片段的字符列表（没有字符坐标时为 None），只在片段需要拆分时才逐字符展开，
+    见 _cmb_split_span。
+    """
+    import fitz
+
     items: List[tuple] = []
-    raw = page.get_text("rawdict")
+    # 只需要文本块，不让 PyMuPDF 提取图片（账单上的行标、印章）
+    raw = page.get_text("rawdict", flags=fitz.TEXTFLAGS_RAWDICT & ~fitz.TEXT_PRESERVE_IMAGES)
     for block in raw.get("blocks", []):
         if block.get("type") != 0:
             continue
         for line in block.get("lines", []):
             for span in line.get("spans", []):
                 chars = span.get("chars")
-                if chars:
-                    for ch in chars:
-                        x0, y0, x1, y1 = ch["bbox"]
-                        c = ch.get("c", "")
-                        if c:
-                            items.append((float(x0), float(y0), float(x1), float(y1), str(c)))
-                    continue
-
-                text = span.get("text", "")
                 bbox = span.get("bbox")
+                if chars:
+                    text = "".join(ch.get("c", "") for ch in chars)
+                else:
+                    text = span.get("text", "")
+                    chars = None
                 if not text or not bbox:
                     continue
                 x0, y0, x1, y1 = bbox
-                char_w = (x1 - x0) / max(len(text), 1)
-                for idx, ch in enumerate(text):
-                    cx0 = x0 + idx * char_w
-                    cx1 = cx0 + char_w
-                    items.append((float(cx0), float(y0), float(cx1), float(y1), str(ch)))
+                items.append((float(x0), float(y0), float(x1), float(y1), str(text), chars))
     return items
 
 
+def _cmb_split_span(x0: float, x1: float, text: str, chars: Optional[list]) -> Iterator[tuple]:
+    """把文本片段拆为逐字符的 (x0, x1, c)；没有字符坐标时按片段宽度均分"""
+    if chars is not None:
+        for ch in chars:
+            c = ch.get("c", "")
+            if c:
+                cx0, _cy0, cx1, _cy1 = ch["bbox"]
+                yield float(cx0), float(cx1), str(c)
+        return
+
+    char_w = (x1 - x0) / max(len(text), 1)
+    for idx, c in enumerate(text):
+        cx0 = x0 + idx * char_w
+        yield cx0, cx0 + char_w, c
+
+
 def _cmb_group_items_into_lines(items: List[tuple], y_tol: float = 1.2) -> List[dict]:
+    """
+    按 y 坐标把文本片段归并成行，行的 y 取加入字符 y0 的滑动平均
+
+    片段按 (y0, x0) 扫描，行的 y 不会超过当前片段的 y0；新建一行时已有各行都比当前片段低出 y_tol 以上，
+    之后也不会再被命中，因此只需与最近新建的一行比较，整体复杂度由排序决定。
+    片段中的每个字符依次参与滑动平均，结果与逐字符归并一致。
+    """
     sorted_items = sorted(items, key=lambda item: (item[1], item[0]))
     lines: List[dict] = []
+    current: Optional[dict] = None
 
-    for x0, y0, x1, _y1, text in sorted_items:
-        matched = None
-        for line in lines:
-            if abs(line["y"] - y0) <= y_tol:
-                matched = line
-                break
-        if matched is None:
-            matched = {"y": y0, "items": []}
-            lines.append(matched)
+    for x0, y0, x1, _y1, text, chars in sorted_items:
+        if current is None or y0 - current["y"] > y_tol:
+            current = {"y": y0, "items": []}
+            lines.append(current)
 
-        matched["items"].append((x0, x1, text))
-        matched["y"] = (matched["y"] + y0) / 2
+        current["items"].append((x0, x1, text, chars))
+        y = current["y"]
+        for _c in text:
+            y = (y + y0) / 2
+        current["y"] = y
 
     for line in lines:
         line["items"].sort(key=lambda item: item[0])
-        line["text"] = "".join(text for _, _, text in line["items"]).strip()
+        line["text"] = "".join(item[2] for item in line["items"]).strip()
+        line["compact"] = _cmb_normalize_text(line["text"])
 
     return sorted(lines, key=lambda item: item["y"])
 
 
 def _cmb_find_header(lines: List[dict]) -> tuple[int, Dict[str, float]]:
     for idx, line in enumerate(lines):
-        text = _cmb_normalize_text(line["text"])
+        text = line["compact"]
         if not all(name in text for name in CMB_REQUIRED_HEADERS):
             continue
 
-        compact_chars = [
-            _cmb_normalize_text(item_text)
-            for _x0, _x1, item_text in line["items"]
-            if _cmb_normalize_text(item_text)
-        ]
-        compact_xs = [
-            x0
-            for x0, _x1, item_text in line["items"]
-            if _cmb_normalize_text(item_text)
-        ]
+        compact_chars: List[str] = []
+        compact_xs: List[float] = []
+        for x0, x1, item_text, chars in line["items"]:
+            for cx0, _cx1, c in _cmb_split_span(x0, x1, item_text, chars):
+                if not c.isspace():
+                    compact_chars.append(c if len(c) == 1 else _cmb_normalize_text(c))
+                    compact_xs.append(cx0)
         compact_text = "".join(compact_chars)
         anchors: Dict[str, float] = {}
         for header in CMB_HEADER_ORDER:
@@ -358,33 +572,39 @@ def _cmb_find_header(lines: List[dict]) -> tuple[int, Dict[str, float]]:
     raise ValueError("未找到中文表头")
 
 
-def _cmb_build_column_ranges(anchors: Dict[str, float], page_width: float) -> List[dict]:
+def _cmb_build_column_ranges(anchors: Dict[str, float]) -> tuple[List[float], List[str]]:
+    """
+    按表头锚点划分列，返回 (各列起点, 列名)，起点升序
+
+    第 i 列覆盖 [起点 i, 起点 i+1)，最后一列向右延伸到页面边缘之外。
+    """
     ordered = sorted(anchors.items(), key=lambda item: item[1])
-    ranges: List[dict] = []
-    for idx, (name, x0) in enumerate(ordered):
-        x1 = ordered[idx + 1][1] if idx + 1 < len(ordered) else page_width + 1
-        ranges.append({"name": name, "x0": x0, "x1": x1})
-    return ranges
-
-
-def _cmb_pick_column(x0: float, x1: float, ranges: List[dict]) -> Optional[str]:
-    cx = (x0 + x1) / 2
-    for col in ranges:
-        if col["x0"] <= cx < col["x1"]:
-            return col["name"]
-    if ranges and cx >= ranges[-1]["x0"]:
-        return ranges[-1]["name"]
-    return None
+    return [x0 for _name, x0 in ordered], [name for name, _x0 in ordered]
+
+
+def _cmb_column_index(x: float, starts: List[float]) -> int:
+    """x 所在列的序号，位于第一列左侧时为 -1"""
+    return bisect_right(starts, x) - 1
 
 
-def _cmb_line_to_cells(line: dict, ranges: List[dict]) -> Dict[str, str]:
-    cells = {col["name"]: "" for col in ranges}
-    for x0, x1, text in line["items"]:
-        col = _cmb_pick_column(x0, x1, ranges)
-        if col is None:
+def _cmb_line_to_cells(line: dict, starts: List[float], names: List[str]) -> Dict[str, str]:
+    """
+    把一行文本片段分配到各列
+
+    片段两端落在同一列时整段归入该列（其中每个字符的中点也都在该列内）；
+    跨越列边界的片段才拆成字符，按字符中点逐个分配。各列片段收集后一次拼接。
+    """
+    fragments: List[List[str]] = [[] for _name in names]
+    for x0, x1, text, chars in line["items"]:
+        idx = _cmb_column_index(x0, starts)
+        if idx >= 0 and idx == _cmb_column_index(x1, starts):
+            fragments[idx].append(text)
             continue
-        cells[col] += text
-    return {key: value.strip() for key, value in cells.items()}
+        for cx0, cx1, c in _cmb_split_span(x0, x1, text, chars):
+            idx = _cmb_column_index((cx0 + cx1) / 2, starts)
+            if idx >= 0:
+                fragments[idx].append(c)
+    return {name: "".join(parts).strip() for name, parts in zip(names, fragments)}
 
 
 def _cmb_is_english_header_line(text: str) -> bool:
@@ -418,17 +638,17 @@ def _cmb_is_footer_line(text: str) -> bool:
 
 
 def _cmb_extract_page_visual_rows(page: Any) -> List[dict]:
-    lines = _cmb_group_items_into_lines(_cmb_extract_char_items(page), y_tol=1.2)
+    lines = _cmb_group_items_into_lines(_cmb_extract_span_items(page), y_tol=1.2)
     try:
         header_idx, anchors = _cmb_find_header(lines)
     except ValueError:
         return []
 
-    ranges = _cmb_build_column_ranges(anchors, page.rect.width)
+    starts, names = _cmb_build_column_ranges(anchors)
     rows: List[dict] = []
     for line in lines[header_idx + 1 :]:
         text = line["text"]
-        normalized = _cmb_normalize_text(text)
+        normalized = line["compact"]
 
         if not normalized:
             continue
@@ -439,7 +659,7 @@ def _cmb_extract_page_visual_rows(page: Any) -> List[dict]:
         if _cmb_is_footer_line(text):
             break
 
-        cells = _cmb_line_to_cells(line, ranges)
+        cells = _cmb_line_to_cells(line, starts, names)
         if not any(cells.values()):
             continue
 
@@ -462,6 +682,50 @@ def _cmb_extract_page_visual_rows(page: Any) -> List[dict]:
     return rows
 
 
+def _cmb_extract_pages(doc: Any, start: int, stop: int) -> List[dict]:
+    """按页序解析 [start, stop) 页的表格行"""
+    rows: List[dict] = []
+    for page_no in range(start, stop):
+        rows.extend(_cmb_extract_page_visual_rows(doc[page_no]))
+    return rows
+
+
+def _cmb_extract_page_range(file_path: str, start: int, stop: int) -> List[dict]:
+    """在工作进程中打开 PDF 并解析 [start, stop) 页"""
+    import fitz
+
+    with fitz.open(file_path) as doc:
+        return _cmb_extract_pages(doc, start, stop)
+
+
+def _cmb_parallel_workers() -> int:
+    return CMB_PARALLEL_WORKERS or os.cpu_count() or 1
+
+
+def _cmb_extract_visual_rows(doc: Any, file_path: str) -> List[dict]:
+    """
+    解析整份 PDF 的表格行（按页序）
+
+    页数不少于 CMB_PARALLEL_MIN_PAGES 且有多个 CPU 时，按 CMB_PARALLEL_PAGE_CHUNK 页分段发给进程池，
+    每个工作进程自行打开文件解析一段，结果按页序拼接；否则在当前进程逐页解析。
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    page_count = doc.page_count
+    chunk_size = CMB_PARALLEL_PAGE_CHUNK
+    workers = min(_cmb_parallel_workers(), -(-page_count // chunk_size))
+    if page_count < CMB_PARALLEL_MIN_PAGES or workers <= 1:
+        return _cmb_extract_pages(doc, 0, page_count)
+
+    starts = range(0, page_count, chunk_size)
+    stops = [min(start + chunk_size, page_count) for start in starts]
+    rows: List[dict] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk_rows in pool.map(_cmb_extract_page_range, [file_path] * len(stops), starts, stops):
+            rows.extend(chunk_rows)
+    return rows
+
+
 def _cmb_is_main_row(row: dict) -> bool:
     return bool(CMB_DATE_RE.fullmatch(row.get("date", "")))
 
@@ -564,6 +828,46 @@ def time_cmp(start: str, check: str, end: str = "23:59") -> bool:
     return _parse_time(start) <= _parse_time(check) <= _parse_time(end)
 
 
+def _minute_of_day(time_str: str) -> tuple:
+    """
+    解析 "HH:MM" 或 "HH:MM:SS"
+
+    Returns:
+        (当天第几分钟, 是否带有非零秒数)
+    """
+    parts = time_str.split(":")
+    if len(parts) not in (2, 3) or not all(p.strip().isdigit() for p in parts):
+        raise ValueError(f"无效的时间格式: {time_str!r}")
+    hour, minute = int(parts[0]), int(parts[1])
+    second = int(parts[2]) if len(parts) == 3 else 0
+    if hour > 23 or minute > 59 or second > 61:
+        raise ValueError(f"无效的时间格式: {time_str!r}")
+    return hour * 60 + minute, second > 0
+
+
+def _build_meal_tables() -> tuple:
+    """
+    由 MEAL_TIME_PERIODS 生成两张 1440 项的分钟查找表（先定义的时间段优先）
+
+    整分钟时间按闭区间 [start, end] 查表；带秒数的时间（如 10:59:30）
+    落在 start 所在分钟之后、end 所在分钟之前，按半开区间 [start, end) 查表。
+    """
+    exact: List[Optional[str]] = [None] * 1440
+    within: List[Optional[str]] = [None] * 1440
+    for start, end, meal_type in MEAL_TIME_PERIODS:
+        start_min, _ = _minute_of_day(start)
+        end_min, _ = _minute_of_day(end)
+        for minute in range(start_min, end_min + 1):
+            if exact[minute] is None:
+                exact[minute] = meal_type
+            if minute < end_min and within[minute] is None:
+                within[minute] = meal_type
+    return tuple(exact), tuple(within)
+
+
+_MEAL_BY_MINUTE, _MEAL_WITHIN_MINUTE = _build_meal_tables()
+
+
 def time_map(bill_time: str) -> Optional[str]:
     """
     根据时间返回对应的餐点类型
@@ -574,40 +878,48 @@ def time_map(bill_time: str) -> Optional[str]:
     Returns:
         餐点类型或 None
     """
-    for start, end, meal_type in MEAL_TIME_PERIODS:
-        if time_cmp(start, bill_time, end):
-            return meal_type
-    return None
+    minute, has_seconds = _minute_of_day(bill_time)
+    return (_MEAL_WITHIN_MINUTE if has_seconds else _MEAL_BY_MINUTE)[minute]
 
 
-# ==================== 规则引擎 ====================
+def time_map_series(times) -> "pd.Series":
+    """
+    批量计算餐点类型（time_map 的向量化版本）
 
-def _match_rule(bill: dict, rule: dict) -> Optional[str]:
-    """检查账单是否匹配规则，返回匹配的模式"""
-    key = rule.get("key", "")
-    
-    # 支持多字段匹配 (ANY)
-    if key == "ANY":
-        target_fields = ["交易对方", "商品说明"]
-    else:
-        target_fields = [key]
-        
-    for field in target_fields:
-        bill_value = bill.get(field, "")
-        for pattern in rule["rule"]:
-            # 正则匹配模式
-            if rule.get("match_mode") == "regex":
-                try:
-                    if re.search(pattern, bill_value):
-                        return pattern
-                except re.error:
-                    continue # 忽略无效正则
-            # 默认关键词匹配
-            elif pattern in bill_value:
-                return pattern
-    return None
+    Args:
+        times: 交易时间列（"日期 HH:MM[:SS]" 字符串或 datetime，同一列中可以混用带秒与不带秒的格式）
+
+    Returns:
+        与输入索引一致的 Series，无法解析或不在任何时间段内的为 None
+    """
+    import numpy as np
+    import pandas as pd
+
+    series = pd.Series(times)
+    # 逐个推断格式：只用第一个值推断时，格式不同的行会变成 NaT
+    parsed = pd.to_datetime(series, errors="coerce", format="mixed")
+    valid = parsed.notna().to_numpy()
+    minutes = (parsed.dt.hour * 60 + parsed.dt.minute).fillna(0).to_numpy(dtype=np.int64)
+    has_seconds = ((parsed.dt.second > 0) | (parsed.dt.microsecond > 0)).to_numpy()
+
+    exact = np.array(_MEAL_BY_MINUTE, dtype=object)
+    within = np.array(_MEAL_WITHIN_MINUTE, dtype=object)
+    meals = np.where(has_seconds, within[minutes], exact[minutes])
+    meals[~valid] = None
+
+    # pandas 无法解析日期部分的行，与字典引擎一样只看空格后的时间部分
+    for row in np.flatnonzero(~valid):
+        value = series.iloc[row]
+        if isinstance(value, str) and " " in value:
+            try:
+                meals[row] = time_map(value.split(" ")[1])
+            except ValueError:
+                pass
+    return pd.Series(meals, index=series.index, dtype=object)
 
 
+# ==================== 规则引擎 ====================
+
 def _apply_time_based_tag(bill: dict, rule: dict) -> str:
     """根据规则和账单时间确定标签"""
     # 只对"食"类别且启用时间标签的规则处理
@@ -615,8 +927,11 @@ def _apply_time_based_tag(bill: dict, rule: dict) -> str:
         return rule.get("tag", "")
     
     time_str = bill["交易时间"].split(" ")[1]
-    time_tag = time_map(time_str)
-    
+    return _resolve_time_tag(rule, time_map(time_str))
+
+
+def _resolve_time_tag(rule: dict, time_tag: Optional[str]) -> str:
+    """根据规则的 time_based 设置，在餐点标签与规则标签之间取舍"""
     if not time_tag:
         return rule.get("tag", "")
     
@@ -634,39 +949,283 @@ def _apply_time_based_tag(bill: dict, rule: dict) -> str:
     return time_tag if time_tag in time_based else rule.get("tag", "")
 
 
-def apply_rules_to_bills(bills: Dict[str, Any]) -> Dict[str, Any]:
+# 打标结果字段
+TAGGING_FIELDS = ("类别", "标签", "备注", "命中规则")
+
+
+def reset_tagging(bill: dict) -> None:
+    """清空账单的打标结果（原地修改）"""
+    for field in TAGGING_FIELDS:
+        bill[field] = ""
+
+
+def _tag_bill(bill: dict, matcher: CompiledRuleSet) -> None:
+    """用编译后的规则集为单条未打标账单打标（原地修改）"""
+    reset_tagging(bill)
+    
+    hit = matcher.match(bill)
+    if hit:
+        rule, matched = hit
+        bill["命中规则"] = rule_label(rule, matched)
+        bill["类别"] = rule["category"]
+        bill["标签"] = _apply_time_based_tag(bill, rule)
+        bill["备注"] = rule.get("comment", "")
+    
+    if bill["类别"] and not bill["标签"]:
+        bill["标签"] = "-"
+
+
+def _apply_rules_vectorized(bills: Dict[str, Any], rules: List[dict]) -> None:
     """
-    应用规则到账单，自动打标签
+    向量化打标引擎（原地修改）
     
-    只对未打标的账单进行规则匹配，已标记的账单保持不变
+    把未打标账单载入 DataFrame，按规则顺序对仍未命中的行做 str.contains，
+    命中的行从工作表中移除；打标结果按列计算后再写回账单。
+    结果与逐条匹配的字典引擎一致。
     """
-    rules = load_rules()
+    import numpy as np
+    import pandas as pd
+    
+    pending_ids = [bill_id for bill_id, bill in bills.items() if not bill.get("类别", "").strip()]
+    if not pending_ids:
+        return
+    
+    plans = [rule_match_plan(rule) for rule in rules]
+    fields = {field for rule_fields, _patterns in plans for field in rule_fields}
+    frame = pd.DataFrame(
+        {field: [bills[bill_id].get(field) or "" for bill_id in pending_ids] for field in fields},
+        index=pd.RangeIndex(len(pending_ids)),
+        dtype=object,
+    )
+    
+    # 每行命中的规则序号与模式（-1 表示未命中）
+    hit_rule = np.full(len(pending_ids), -1, dtype=np.int64)
+    hit_pattern = np.full(len(pending_ids), "", dtype=object)
+    
+    remaining = frame
+    for rule_idx, rule in enumerate(rules):
+        if remaining.empty:
+            break
+        is_regex = rule.get("match_mode") == "regex"
+        matched = pd.Series("", index=remaining.index, dtype=object)
+        todo = remaining
+        rule_fields, patterns = plans[rule_idx]
+        for field in rule_fields:
+            for pattern in patterns:
+                if todo.empty:
+                    break
+                if is_regex and compile_pattern(pattern)[0] is None:
+                    continue
+                mask = todo[field].str.contains(pattern, regex=is_regex, na=False).to_numpy(dtype=bool)
+                if mask.any():
+                    matched[todo.index[mask]] = pattern
+                    todo = todo[~mask]
+        
+        rows = remaining.index.difference(todo.index)
+        hit_rule[rows] = rule_idx
+        hit_pattern[rows] = matched[rows].to_numpy()
+        remaining = todo
+    
+    categories = np.full(len(pending_ids), "", dtype=object)
+    tags = np.full(len(pending_ids), "", dtype=object)
+    comments = np.full(len(pending_ids), "", dtype=object)
+    labels = np.full(len(pending_ids), "", dtype=object)
+    
+    for rule_idx in np.unique(hit_rule[hit_rule >= 0]):
+        rule = rules[rule_idx]
+        rows = np.flatnonzero(hit_rule == rule_idx)
+        categories[rows] = rule["category"]
+        comments[rows] = rule.get("comment", "")
+        labels[rows] = [rule_label(rule, pattern) for pattern in hit_pattern[rows]]
+        
+        if rule.get("time_based") and rule["category"] == "食":
+            meals = time_map_series([bills[pending_ids[row]]["交易时间"] for row in rows])
+            tags[rows] = [_resolve_time_tag(rule, meal) for meal in meals]
+        else:
+            tags[rows] = rule.get("tag", "")
+    
+    tags[(categories != "") & (tags == "")] = "-"
+    
+    for row, bill_id in enumerate(pending_ids):
+        bill = bills[bill_id]
+        bill["类别"] = categories[row]
+        bill["标签"] = tags[row]
+        bill["备注"] = comments[row]
+        bill["命中规则"] = labels[row]
 
+
+# 多进程打标时每个工作进程持有的规则集（由 _init_tagging_worker 设置）
+_worker_matcher: Optional[CompiledRuleSet] = None
+
+
+def _init_tagging_worker(rules: List[dict]) -> None:
+    """工作进程初始化：规则只随初始化参数传一次，在进程内编译"""
+    global _worker_matcher
+    _worker_matcher = compile_rules(rules)
+
+
+def _tag_bill_chunk(chunk: List[tuple]) -> List[tuple]:
+    """
+    在工作进程中为一个分片打标
+    
+    Args:
+        chunk: [(bill_id, 账单), ...]
+    
+    Returns:
+        [(bill_id, (类别, 标签, 备注, 命中规则)), ...]
+    """
+    results = []
+    for bill_id, bill in chunk:
+        _tag_bill(bill, _worker_matcher)
+        results.append((bill_id, tuple(bill[field] for field in TAGGING_FIELDS)))
+    return results
+
+
+def _parallel_workers() -> int:
+    return PARALLEL_TAGGING_WORKERS or os.cpu_count() or 1
+
+
+def _apply_rules_parallel(bills: Dict[str, Any]) -> None:
+    """
+    多进程打标（原地修改）
+    
+    只把未打标账单按 PARALLEL_TAGGING_CHUNK_SIZE 分片发给进程池，
+    工作进程只回传打标字段，按 bill_id 合并回原账单。
+    未打标账单不足一个分片时直接在当前进程打标。
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    pending = [(bill_id, bill) for bill_id, bill in bills.items() if not bill.get("类别", "").strip()]
+    chunk_size = PARALLEL_TAGGING_CHUNK_SIZE
+    workers = min(_parallel_workers(), -(-len(pending) // chunk_size))
+    if workers <= 1:
+        matcher = get_compiled_rules()
+        for _bill_id, bill in pending:
+            _tag_bill(bill, matcher)
+        return
+    
+    rules = load_rules()
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_tagging_worker, initargs=(rules,)) as pool:
+        for results in pool.map(_tag_bill_chunk, chunks):
+            for bill_id, values in results:
+                bills[bill_id].update(zip(TAGGING_FIELDS, values))
+
+
+def apply_rules_to_bills(
+    bills: Dict[str, Any],
+    engine: str = "auto",
+    stats: Optional[RuleStats] = None,
+) -> Dict[str, Any]:
+    """
+    应用规则到账单，自动打标签
+    
+    只对未打标的账单进行规则匹配，已标记的账单保持不变。
+    
+    Args:
+        bills: 账单字典（原地修改）
+        engine: "dict"：规则编译为多模式匹配器（见 core.rule_engine）逐条匹配，
+                规则文件未变化时复用缓存的编译结果；
+                "vectorized"：pandas 按规则批量匹配（见 _apply_rules_vectorized），
+                耗时与 规则数 × 账单数 成正比，比字典引擎慢得多，只在显式指定时使用；
+                "process"：分片后在进程池中用字典引擎打标（见 _apply_rules_parallel）；
+                "auto"：有多个 CPU 且账单数不少于 PARALLEL_TAGGING_MIN_BILLS 时用多进程，
+                否则用字典引擎
+        stats: 传入时忽略 engine，按规则顺序逐条匹配并把每条规则的匹配次数、
+               命中次数和耗时记录到 stats 中（见 core.rule_engine.RuleStats）
+    """
+    if stats is not None:
+        matcher = InstrumentedRuleSet(stats.rules, stats)
+        for bill in bills.values():
+            if not bill.get("类别", "").strip():
+                _tag_bill(bill, matcher)
+        return bills
+    
+    if engine == "auto":
+        if len(bills) >= PARALLEL_TAGGING_MIN_BILLS and _parallel_workers() > 1:
+            engine = "process"
+        else:
+            engine = "dict"
+    
+    if engine == "vectorized":
+        _apply_rules_vectorized(bills, load_rules())
+        return bills
+    if engine == "process":
+        _apply_rules_parallel(bills)
+        return bills
+    if engine != "dict":
+        raise ValueError(f"未知的打标引擎: {engine}")
+    
+    matcher = get_compiled_rules()
     
     for bill_id, bill in bills.items():
         if bill.get("类别", "").strip():
             continue
-        
-        bill["类别"] = ""
-        bill["标签"] = ""
-        bill["备注"] = ""
-        bill["命中规则"] = ""
-        
-        for rule in rules:
-            matched = _match_rule(bill, rule)
-            if matched:
-                bill["命中规则"] = f"{rule['key']}: {matched}"
-                bill["类别"] = rule["category"]
-                bill["标签"] = _apply_time_based_tag(bill, rule)
-                bill["备注"] = rule.get("comment", "")
-                break
-        
-        if bill["类别"] and not bill["标签"]:
-            bill["标签"] = "-"
+        _tag_bill(bill, matcher)
     
     return bills
 
 
+def find_changed_rule_bills(bills: Dict[str, Any], old_rules: list, new_rules: list) -> List[str]:
+    """
+    找出由已删除或已改动的规则打标的账单（需要按新规则重新打标）
+
+    按 命中规则 字段对应到旧规则；类别或备注与该旧规则的打标结果不一致的账单视为手动修改过，不计入。
+    """
+    labels = changed_rule_labels(old_rules, new_rules)
+    if not labels:
+        return []
+    return [
+        bill_id for bill_id, bill in bills.items()
+        if (bill.get("类别", ""), bill.get("备注", "")) in labels.get(bill.get("命中规则"), ())
+    ]
+
+
+def apply_rules_incrementally(
+    bills: Dict[str, Any],
+    old_rules: list,
+    new_rules: list,
+    recheck: Iterable[str] = (),
+) -> List[str]:
+    """
+    规则变更后的增量打标（原地修改）
+    
+    已打标的账单与全量打标一样保持不变；未打标的账单在旧规则下没有命中，
+    因此只可能命中新增或改动过匹配条件的规则，只需用这部分规则（保持新顺序）重新匹配。
+    仅删除或调整顺序时不会产生新的命中。
+    recheck 中的账单（见 find_changed_rule_bills）清空打标结果后用全部新规则重新匹配。
+    
+    前提：当前未打标的账单都已经过旧规则匹配（调用方按会话记录的规则集版本判断，
+    不满足时应改用 apply_rules_to_bills 全量打标）。
+    
+    Returns:
+        打标结果发生变化的账单 ID 列表
+    """
+    diff = diff_rules(old_rules, new_rules)
+    matcher = compile_rules([new_rules[idx] for idx in diff.added])
+    
+    changed = []
+    recheck = set(recheck)
+    if recheck:
+        full_matcher = compile_rules(new_rules)
+        for bill_id in recheck:
+            bill = bills[bill_id]
+            before = tuple(bill.get(field) for field in TAGGING_FIELDS)
+            _tag_bill(bill, full_matcher)
+            if tuple(bill[field] for field in TAGGING_FIELDS) != before:
+                changed.append(bill_id)
+    
+    for bill_id, bill in bills.items():
+        if bill_id in recheck or bill.get("类别", "").strip():
+            continue
+        before = tuple(bill.get(field) for field in TAGGING_FIELDS)
+        _tag_bill(bill, matcher)
+        if tuple(bill[field] for field in TAGGING_FIELDS) != before:
+            changed.append(bill_id)
+    
+    return changed
+
+
 # ==================== AI 打标 ====================
 
 def ai_tag_bills(bills: List[dict]) -> dict:
@@ -775,17 +1334,22 @@ class BaseBillProcessor(ABC):
     账单处理器抽象基类
     
     定义统一的处理流程：验证 → 预处理 → 过滤 → 打标
+    
+    过滤后的账单转为 Bill（见 core.bill），只保留标准字段。
     """
     
     def __init__(self, file_path: str):
         self.file_path = file_path
-        self.raw_data: List[dict] = []
+        # 原始数据（可以是逐行读取的迭代器，只能在 _preprocess 中遍历一次）
+        self.raw_data: Iterable[dict] = []
         self.bill: Dict[str, Any] = {}
         
         # 标准处理流程
         self._validate()
         self._preprocess()
         self._filter()
+        self._sort()
+        self.bill = {bill_id: Bill.from_row(bill) for bill_id, bill in self.bill.items()}
         self.bill = apply_rules_to_bills(self.bill)
     
     @abstractmethod
@@ -803,6 +1367,51 @@ class BaseBillProcessor(ABC):
         默认实现为空，子类可选择性覆盖
         """
     
+    def _sort(self) -> None:
+        """
+        调整输出顺序
+        
+        默认保持解析顺序，子类可选择性覆盖
+        """
+    
+    def _read_rows(self, checkpoint_line: int, marker: str, id_column: str) -> Iterator[dict]:
+        """
+        逐行读取账单明细
+        
+        格式检查（编码、格式标记、id_column 列）在调用时立即完成，明细行在遍历时才逐行读取。
+        
+        Raises:
+            FileFormatError: 格式标记不在约定行、缺少 id_column 列或编码错误
+        """
+        rows = self._iter_rows(checkpoint_line, marker, id_column)
+        first = next(rows, None)
+        if first is None:
+            return iter(())
+        return chain([first], rows)
+    
+    def _iter_rows(self, checkpoint_line: int, marker: str, id_column: str) -> Iterator[dict]:
+        """
+        XLSX 文件直接以只读模式读取单元格；CSV 文件先识别编码和明细起始位置，再流式读取。
+        """
+        if self.file_path.lower().endswith(".xlsx"):
+            rows = iter_xlsx_rows(self.file_path, checkpoint_line, marker)
+            first = next(rows, None)
+            if first is not None:
+                if id_column not in first:
+                    raise FileFormatError(f"文件格式不正确，缺少{id_column}列")
+                yield first
+                yield from rows
+            return
+        
+        self._encoding, offset = detect_encoding(self.file_path, checkpoint_line, marker)
+        try:
+            with open_bill_csv(self.file_path, self._encoding, offset) as reader:
+                if id_column not in (reader.fieldnames or []):
+                    raise FileFormatError(f"文件格式不正确，缺少{id_column}列")
+                yield from reader
+        except UnicodeError as e:
+            raise FileFormatError(f"文件编码与 {self._encoding} 不一致: {e}")
+    
     def _parse_refund_id(self, bill_id: str) -> Optional[str]:
         """
         解析退款订单号，提取原始订单号
@@ -872,96 +1481,67 @@ class Alipay(BaseBillProcessor):
         }
     
     def _validate(self) -> None:
-        """验证支付宝账单格式并读取数据（单次读取优化）"""
-        self._encoding = None
-        self.raw_data = []
-        
-        # 尝试多种编码，一次性完成验证和读取
-        for enc in SUPPORTED_ENCODINGS:
-            try:
-                with open(self.file_path, "r", encoding=enc) as f:
-                    lines = f.readlines()
-                    
-                    # 验证格式标记
-                    if len(lines) < ALIPAY_CHECKPOINT_LINE:
-                        continue
-                    
-                    checkpoint_line = lines[ALIPAY_CHECKPOINT_LINE - 1]
-                    if not checkpoint_line.startswith(ALIPAY_FORMAT_MARKER):
-                        continue
-                    
-                    # 读取 CSV 数据
-                    csv_content = "".join(lines[ALIPAY_CHECKPOINT_LINE:])
-                    reader = csv.DictReader(csv_content.splitlines())
-                    self.raw_data = sorted(
-                        list(reader),
-                        key=lambda x: x["交易订单号"].strip()
-                    )
-                    self._encoding = enc
-                    return
-                    
-            except (UnicodeDecodeError, KeyError):
-                continue
-        
-        raise FileFormatError("无法读取文件，尝试了所有支持的编码或文件格式不正确")
+        """验证支付宝账单格式，明细在预处理时逐行读取（CSV / XLSX）"""
+        self.raw_data = self._read_rows(ALIPAY_CHECKPOINT_LINE, ALIPAY_FORMAT_MARKER, "交易订单号")
     
     def _preprocess(self) -> None:
-        """预处理支付宝账单"""
-        bills = {}
+        """
+        预处理支付宝账单（单次遍历）
+        
+        普通订单直接放入 self.bill；退款订单按原订单号归集，
+        遍历结束后按累计退款金额冲减原订单，同一订单的多笔部分退款会累加。
+        """
+        self.bill = {}
         self.failed_rows = []
+        # {原订单号: [(退款订单号, 退款账单), ...]}
+        refunds: Dict[str, List[tuple]] = {}
+        seen = set()
         
-        # 第一轮：结构化数据
-        for data in self.raw_data:
-            bill_id = data["交易订单号"].strip()
+        for bill in self.raw_data:
+            bill_id = bill.pop("交易订单号").strip()
             
-            if bill_id in bills:
+            if bill_id in seen:
                 raise DuplicateBillError(f"订单号重复: {bill_id}")
             
-            bills[bill_id] = dict(data)
-            del bills[bill_id]["交易订单号"]
-            bills[bill_id]["金额"] = float(data["金额"])
+            bill["金额"] = float(bill["金额"])
             
             # 处理餐补扣除
-            payment = bills[bill_id].get("收/付款方式", "")
+            payment = bill.get("收/付款方式", "")
             for keyword in SUBSIDY_KEYWORDS:
                 if keyword in payment:
-                    bills[bill_id]["金额"] = max(0, bills[bill_id]["金额"] - SUBSIDY_DEDUCTION)
+                    bill["金额"] = max(0, bill["金额"] - SUBSIDY_DEDUCTION)
                     break
             
             # 过滤金额过小
-            if bills[bill_id]["金额"] < MIN_AMOUNT:
-                del bills[bill_id]
-        
-        # 第二轮：处理退款
-        self.bill = {}
-        processed = set()
-        
-        for bill_id, bill in bills.items():
-            if bill_id in processed:
+            if bill["金额"] < MIN_AMOUNT:
                 continue
+            seen.add(bill_id)
             
             original_id = self._parse_refund_id(bill_id)
-            
             if original_id is None:
-                # 普通订单
                 self.bill[bill_id] = bill
             else:
-                # 退款订单
-                processed.add(bill_id)
-                if original_id not in bills:
-                    if bill.get("交易分类") != "收入":
-                        self.failed_rows.append(self._build_failed_row(bill, "退款未匹配到支付记录"))
-                        print(f"退款订单 {bill_id} 找不到原订单 {original_id}")
-                    continue
-
-                real_amount = bills[original_id]["金额"] - bill["金额"]
+                refunds.setdefault(original_id, []).append((bill_id, bill))
+        
+        # 冲减退款
+        for original_id, items in refunds.items():
+            original = self.bill.get(original_id)
+            if original is None:
+                for refund_id, refund in items:
+                    if refund.get("交易分类") != "收入":
+                        self.failed_rows.append(self._build_failed_row(refund, "退款未匹配到支付记录"))
+                        print(f"退款订单 {refund_id} 找不到原订单 {original_id}")
+                continue
+            
+            # 按文件顺序累计退款，报告第一笔使累计金额超过原订单的退款
+            real_amount = original["金额"]
+            for refund_id, refund in items:
+                real_amount -= refund["金额"]
                 if real_amount < -MIN_AMOUNT:
-                    raise RefundError(f"退款金额超过原订单: {bill_id}")
-                elif real_amount > MIN_AMOUNT:
-                    self.bill[original_id] = dict(bills[original_id])
-                    self.bill[original_id]["金额"] = real_amount
-                    processed.add(original_id)
-
+                    raise RefundError(f"退款金额超过原订单: {refund_id}")
+            if real_amount > MIN_AMOUNT:
+                original["金额"] = real_amount
+        
         self.count_bills = len(self.bill)
         self.count_rows = self.count_bills + len(self.failed_rows)
     
@@ -984,24 +1564,8 @@ class Wechat(BaseBillProcessor):
     """微信账单处理器"""
     
     def _validate(self) -> None:
-        """验证微信账单格式并读取数据"""
-        with open(self.file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            
-            if len(lines) < WECHAT_CHECKPOINT_LINE:
-                raise FileFormatError("文件行数不足")
-            
-            checkpoint_line = lines[WECHAT_CHECKPOINT_LINE - 1]
-            if not checkpoint_line.startswith(WECHAT_FORMAT_MARKER):
-                raise FileFormatError(f"文件格式不正确，第 {WECHAT_CHECKPOINT_LINE} 行验证失败")
-            
-            # 读取 CSV 数据
-            csv_content = "".join(lines[WECHAT_CHECKPOINT_LINE:])
-            reader = csv.DictReader(csv_content.splitlines())
-            self.raw_data = sorted(
-                list(reader),
-                key=lambda x: x["交易单号"].strip()
-            )
+        """验证微信账单格式，明细在预处理时逐行读取（CSV / XLSX）"""
+        self.raw_data = self._read_rows(WECHAT_CHECKPOINT_LINE, WECHAT_FORMAT_MARKER, "交易单号")
     
     def _preprocess(self) -> None:
         """预处理微信账单"""
@@ -1013,7 +1577,7 @@ class Wechat(BaseBillProcessor):
             if bill_id in self.bill:
                 raise DuplicateBillError(f"交易单号重复: {bill_id}")
             
-            bill = dict(data)
+            bill = data
             del bill["交易单号"]
             
             # 解析金额（移除¥符号和逗号）
@@ -1062,7 +1626,7 @@ class CmbPDF(BaseBillProcessor):
         super().__init__(file_path)
 
     def _validate(self) -> None:
-        """读取并解析 PDF 表格行为 raw_rows。"""
+        """读取并解析 PDF 表格行为 raw_rows（页数较多时多进程解析，见 _cmb_extract_visual_rows）。"""
         try:
             import fitz
         except ImportError as exc:
@@ -1070,9 +1634,7 @@ class CmbPDF(BaseBillProcessor):
 
         try:
             with fitz.open(self.file_path) as doc:
-                visual_rows = []
-                for page in doc:
-                    visual_rows.extend(_cmb_extract_page_visual_rows(page))
+                visual_rows = _cmb_extract_visual_rows(doc, self.file_path)
                 self.raw_rows = _cmb_merge_rows(visual_rows)
                 self.count_rows = len(self.raw_rows)
         except Exception as exc:
@@ -4,8 +4,9 @@
 处理账单上传、获取、统计、自动打标、导出等操作。
 """
 import os
-import json
 import io
+import copy
+import uuid
 import pandas as pd
 from flask import Blueprint, request, jsonify, send_file, current_app
 from werkzeug.utils import secure_filename
@@ -19,7 +20,10 @@ from core.utils import (
     load_rules,
     save_rules,
 )
-from core.config import PROGRESS_FILE, EXPORT_COLUMNS
+from core.config import EXPORT_COLUMNS
+from core.rule_engine import rules_fingerprint
+from core.progress_store import load_progress_bills, progress_store
+from core.session_store import bill_session
 
 # ==================== Blueprint 配置 ====================
 bills_bp = Blueprint("bills", __name__)
@@ -38,30 +42,17 @@ ALLOWED_EXTENSIONS = {
 }
 
 
-# ==================== 账单状态访问器 ====================
-def get_current_bills() -> dict:
-    """获取当前账单数据（延迟导入避免循环依赖）"""
-    from app import current_bills
-    return current_bills
-
-
-def set_current_bills(bills: dict) -> None:
-    """设置当前账单数据"""
-    import app
-    app.current_bills = bills
-
-
-def ensure_dict_format(bills) -> dict:
-    """确保账单数据为字典格式"""
-    if isinstance(bills, list):
-        return {bill["交易订单号"]: bill for bill in bills}
-    return bills
-
-
-def save_to_progress(bills: dict) -> None:
-    """保存账单到进度文件"""
-    with open(PROGRESS_FILE, "w", encoding="utf-8") as f:
-        json.dump(bills, f, ensure_ascii=False, indent=2)
+# ==================== 辅助函数 ====================
+def save_to_progress(bills: dict, bill_ids: list = None) -> None:
+    """
+    保存账单到进度文件
+    
+    传入 bill_ids 时只把这些账单的改动追加到进度日志，否则整体重写进度快照。
+    """
+    if bill_ids is None:
+        progress_store.write_snapshot(bills)
+    else:
+        progress_store.save_bills(bills, bill_ids)
 
 
 def cleanup_temp_files(paths: list[str]) -> None:
@@ -80,7 +71,7 @@ def cleanup_temp_files(paths: list[str]) -> None:
 @bills_bp.route("/bills")
 def get_bills():
     """获取当前账单"""
-    bills = get_current_bills()
+    bills = bill_session.bills
     if bills:
         return jsonify({"success": True, "bills": bills})
     return jsonify({"success": False, "message": "没有账单数据"})
@@ -109,26 +100,22 @@ def upload_file():
         ext_text = " / ".join(allowed_exts)
         return jsonify({"error": f"文件格式不匹配：{bill_type} 仅支持 {ext_text}"}), 400
     
-    # 保存上传文件
-    filename = secure_filename(file.filename)
+    # 保存上传文件（文件名加随机前缀，避免同时上传同名文件时互相覆盖；
+    # 扩展名单独保留，secure_filename 会去掉中文文件名中的全部中文）
+    ext = os.path.splitext(filename_lower)[1]
+    filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+    if not filename.lower().endswith(ext):
+        filename += ext
     filepath = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
     file.save(filepath)
 
     temp_files = [filepath]
     try:
-        # 转换 xlsx 为 csv（仅支付宝/微信需要）
-        if bill_type in ("alipay", "wechat") and file.filename.lower().endswith(".xlsx"):
-            df = pd.read_excel(filepath)
-            csv_path = os.path.join(current_app.config["UPLOAD_FOLDER"], "temp.csv")
-            df.to_csv(csv_path, index=False)
-            temp_files.append(csv_path)
-        else:
-            csv_path = filepath
-
-        # 解析账单
+        # 解析账单（XLSX 由处理器直接读取，解析后按当前规则打标）
+        tagged_rules = rules_fingerprint(load_rules())
         ProcessorClass, book_name = BILL_PROCESSORS[bill_type]
         try:
-            processor = ProcessorClass(csv_path)
+            processor = ProcessorClass(filepath)
         except BillProcessError as e:
             return jsonify({"error": str(e)}), 400
 
@@ -138,8 +125,9 @@ def upload_file():
         for bill in bills.values():
             bill["账本"] = book_name
 
-        save_to_progress(bills)
-        set_current_bills(bills)
+        with bill_session.edit() as edit:
+            save_to_progress(bills)
+            edit.replace(bills, tagged_rules)
 
         count_rows = getattr(processor, "count_rows", len(bills))
         count_bills = getattr(processor, "count_bills", len(bills))
@@ -169,13 +157,10 @@ def upload_file():
 def api_bills():
     """获取账单列表（按时间倒序）"""
     try:
-        bills = get_current_bills()
+        bills = bill_session.bills
         if not bills:
             return jsonify({"success": False, "message": "没有账单数据"})
         
-        bills = ensure_dict_format(bills)
-        set_current_bills(bills)
-        
         bills_list = sorted(
             bills.values(),
             key=lambda x: x.get("交易时间", ""),
@@ -191,13 +176,10 @@ def api_bills():
 def api_bill_stats():
     """获取账单标记统计"""
     try:
-        bills = get_current_bills()
+        bills = bill_session.bills
         if not bills:
             return jsonify({"success": False, "message": "没有账单数据"})
         
-        bills = ensure_dict_format(bills)
-        set_current_bills(bills)
-        
         total = len(bills)
         
         category_tagged = sum(1 for b in bills.values() if b.get("类别", "").strip())
@@ -227,18 +209,20 @@ def api_bill_stats():
 @bills_bp.route("/api/auto_tag", methods=["POST"])
 def auto_tag():
     """根据规则自动打标"""
-    if not get_current_bills():
+    if not bill_session.bills:
         return jsonify({"success": False, "message": "没有账单数据"})
     
     try:
-        with open(PROGRESS_FILE, "r", encoding="utf-8") as f:
-            bills = json.load(f)
-        
-        bills = ensure_dict_format(bills)
-        bills = apply_rules_to_bills(bills)
-        
-        set_current_bills(bills)
-        save_to_progress(bills)
+        with bill_session.edit() as edit:
+            bills = load_progress_bills()
+            if bills is None:
+                edit.cancel()
+                return jsonify({"success": False, "message": "没有找到进度文件"})
+            
+            tagged_rules = rules_fingerprint(load_rules())
+            bills = apply_rules_to_bills(bills)
+            save_to_progress(bills)
+            edit.replace(bills, tagged_rules)
         
         return jsonify({"success": True, "message": "自动打标成功"})
     
@@ -299,10 +283,9 @@ def ai_tag():
         
         # 如果前端没传，则使用后端数据
         if not bills_list:
-            if not get_current_bills():
+            bills = bill_session.bills
+            if not bills:
                 return jsonify({"success": False, "message": "没有账单数据"})
-            bills = get_current_bills()
-            bills = ensure_dict_format(bills)
             bills_list = list(bills.values())
         
         # 调用 AI 打标
@@ -337,26 +320,28 @@ def apply_ai_tags():
         if not tagged_bills and not (save_rules_flag and selected_rules):
             return jsonify({"success": False, "message": "没有要应用的打标结果或规则"})
         
-        bills = get_current_bills()
-        bills = ensure_dict_format(bills)
-        
         # 应用打标结果
-        applied_count = 0
-        for tagged in tagged_bills:
-            order_id = tagged.get("交易订单号")
-            if order_id and order_id in bills:
-                bills[order_id]["类别"] = tagged.get("类别", "")
-                bills[order_id]["标签"] = tagged.get("标签", "")
-                bills[order_id]["备注"] = tagged.get("备注", "")
-                bills[order_id]["命中规则"] = "AI 打标"
-                applied_count += 1
-        
-        set_current_bills(bills)
-        save_to_progress(bills)
+        with bill_session.edit() as edit:
+            applied_ids = []
+            for tagged in tagged_bills:
+                order_id = tagged.get("交易订单号")
+                if order_id and order_id in edit.bills:
+                    bill = edit.mutable(order_id)
+                    bill["类别"] = tagged.get("类别", "")
+                    bill["标签"] = tagged.get("标签", "")
+                    bill["备注"] = tagged.get("备注", "")
+                    bill["命中规则"] = "AI 打标"
+                    applied_ids.append(order_id)
+            if applied_ids:
+                save_to_progress(edit.bills, applied_ids)
+            else:
+                edit.cancel()
+        applied_count = len(applied_ids)
         
         # 保存用户采纳的规则（合并到现有规则）
         if save_rules_flag and selected_rules:
-            existing_rules = load_rules()
+            # 在副本上合并，load_rules() 返回的是缓存对象
+            existing_rules = copy.deepcopy(load_rules())
             for rule in selected_rules:
                 key = rule.get("key", "交易对方")
                 category = rule.get("category", "")
@@ -3,22 +3,17 @@
 
 处理账单进度的保存、加载、检查、清除操作。
 """
-import os
-import json
 from flask import Blueprint, request, jsonify
-from core.config import PROGRESS_FILE, REQUIRED_BILL_FIELDS
+from core.config import REQUIRED_BILL_FIELDS
+from core.bill import Bill, bills_from_json
+from core.progress_store import as_bill_dict, load_progress_bills, progress_store
+from core.session_store import bill_session
 
 # ==================== Blueprint 配置 ====================
 progress_bp = Blueprint('progress', __name__)
 
 
-# ==================== 账单状态访问器 ====================
-def set_current_bills(bills: dict) -> None:
-    """设置当前账单数据"""
-    import app
-    app.current_bills = bills
-
-
+# ==================== 辅助函数 ====================
 def ensure_required_fields(bills) -> None:
     """确保账单数据包含必要字段（原地修改）"""
     items = bills.values() if isinstance(bills, dict) else bills
@@ -32,16 +27,16 @@ def ensure_required_fields(bills) -> None:
 def load_progress():
     """从文件加载账单进度"""
     try:
-        if not os.path.exists(PROGRESS_FILE):
-            return jsonify({"success": False, "message": "没有找到进度文件"})
-        
-        with open(PROGRESS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
-        ensure_required_fields(data)
-        set_current_bills(data)
+        with bill_session.edit() as edit:
+            data = load_progress_bills()
+            if data is None:
+                edit.cancel()
+                return jsonify({"success": False, "message": "没有找到进度文件"})
+            
+            ensure_required_fields(data)
+            edit.replace(data)
         
-        return jsonify({"success": True, "bills": data})
+        return jsonify({"success": True, "bills": data, "version": edit.result.version})
     
     except Exception as e:
         return jsonify({"success": False, "message": f"加载进度失败: {str(e)}"})
@@ -52,10 +47,7 @@ def load_progress():
 def check_progress():
     """检查是否存在有效的进度文件"""
     try:
-        has_progress = (
-            os.path.exists(PROGRESS_FILE) and 
-            os.path.getsize(PROGRESS_FILE) > 0
-        )
+        has_progress = progress_store.exists()
         return jsonify({"success": True, "has_progress": has_progress})
     
     except Exception as e:
@@ -67,10 +59,9 @@ def check_progress():
 def clear_cache():
     """清除进度文件和内存数据"""
     try:
-        if os.path.exists(PROGRESS_FILE):
-            os.remove(PROGRESS_FILE)
-        
-        set_current_bills({})
+        with bill_session.edit() as edit:
+            progress_store.clear()
+            edit.replace({})
         return jsonify({"success": True, "message": "缓存已清除"})
     
     except Exception as e:
@@ -80,19 +71,84 @@ def clear_cache():
 # ==================== 路由：保存进度 ====================
 @progress_bp.route("/api/save_progress", methods=["POST"])
 def save_progress():
-    """保存账单进度到文件"""
+    """保存全部账单作为当前账单（只把与已保存内容不同的账单追加到进度日志）"""
     try:
         data = request.get_json()
         if not data or "bills" not in data:
             return jsonify({"success": False, "message": "无效的数据格式"})
         
-        bills = data["bills"]
+        bills = bills_from_json(as_bill_dict(data["bills"]))
         ensure_required_fields(bills)
+        with bill_session.edit() as edit:
+            progress_store.save_bills(bills)
+            edit.replace(bills)
+        
+        return jsonify({"success": True, "message": "保存成功", "version": edit.result.version})
+    
+    except Exception as e:
+        return jsonify({"success": False, "message": f"保存失败: {str(e)}"})
+
+
+@progress_bp.route("/api/save_progress", methods=["PATCH"])
+def patch_progress():
+    """
+    增量保存账单进度
+    
+    请求体：{"version": 版本号, "bills": {交易订单号: {字段: 值}}, "removed": [交易订单号]}
+    bills 中只需包含变化的账单和字段：已有账单按字段更新，不存在的账单作为新账单加入。
+    改动应用到当前账单（只复制被修改的账单）并追加到进度日志，耗时与改动条数成正比。
+    version 与服务端当前版本不一致（账单已被上传、自动打标等改动）时返回 409，
+    客户端应重新加载或改用 POST 整体保存。
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or "version" not in data:
+            return jsonify({"success": False, "message": "无效的数据格式"})
+        
+        changes = data.get("bills") or {}
+        removed = data.get("removed") or []
+        if not isinstance(changes, dict) or not isinstance(removed, list) \
+                or not all(isinstance(fields, dict) for fields in changes.values()):
+            return jsonify({"success": False, "message": "无效的数据格式"})
         
-        with open(PROGRESS_FILE, "w", encoding="utf-8") as f:
-            json.dump(bills, f, ensure_ascii=False, indent=2)
+        with bill_session.edit() as edit:
+            base = edit.base
+            if not base.bills or data["version"] != base.version:
+                edit.cancel()
+                return jsonify({
+                    "success": False,
+                    "conflict": True,
+                    "version": base.version,
+                    "message": "账单已被修改，请重新加载后再保存",
+                }), 409
+            
+            bills = edit.bills
+            for bill_id, fields in changes.items():
+                if bill_id in bills:
+                    bill = edit.mutable(bill_id)
+                    bill.update(fields)
+                else:
+                    bill = Bill.from_dict(fields)
+                    ensure_required_fields([bill])
+                    edit.add(bill_id, bill)
+                if not bill.get("类别", "").strip():
+                    # 新增或被清空类别的账单没有经过当前规则匹配
+                    edit.tagged_rules = None
+            for bill_id in removed:
+                edit.remove(bill_id)
+            
+            changed_ids = [*changes, *removed]
+            if changed_ids:
+                progress_store.save_bills(bills, changed_ids)
+            else:
+                edit.cancel()
         
-        return jsonify({"success": True, "message": "保存成功"})
+        return jsonify({
+            "success": True,
+            "message": "保存成功",
+            "version": edit.result.version,
+            "saved": len(changed_ids),
+        })
     
     except Exception as e:
         return jsonify({"success": False, "message": f"保存失败: {str(e)}"})
@@ -3,40 +3,72 @@
 
 处理规则的页面展示和 API 操作。
 """
-import json
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for
-from core.utils import load_rules, save_rules, load_categories, apply_rules_to_bills
-from core.config import PROGRESS_FILE
+from core.utils import (
+    load_rules,
+    save_rules,
+    load_categories,
+    apply_rules_to_bills,
+    apply_rules_incrementally,
+    find_changed_rule_bills,
+    reset_tagging,
+)
+from core.rule_engine import RuleStats, rules_fingerprint, validate_rules
+from core.bill_index import search_bill_index
+from core.progress_store import progress_store
+from core.session_store import bill_session
+from core.rule_optimizer import optimize_rule_order
 
 # ==================== Blueprint 配置 ====================
 rules_bp = Blueprint('rules', __name__)
 
 
-# ==================== 账单状态访问器 ====================
-def get_current_bills() -> dict:
-    """获取当前账单数据（延迟导入避免循环依赖）"""
-    from app import current_bills
-    return current_bills
+# ==================== 打标同步 ====================
+def _is_untagged(bill) -> bool:
+    """未打标的账单（打标只会修改这些账单）"""
+    return not bill.get("类别", "").strip()
 
 
-def set_current_bills(bills: dict) -> None:
-    """设置当前账单数据"""
-    import app
-    app.current_bills = bills
-
-
-def apply_rules_and_sync(bills: dict) -> dict:
-    """应用规则并同步到进度文件"""
-    updated = apply_rules_to_bills(bills)
-    set_current_bills(updated)
+def apply_rules_and_sync(old_rules: list = None) -> dict:
+    """
+    把规则应用到当前账单并同步到进度文件，返回打标后的账单
     
-    try:
-        with open(PROGRESS_FILE, "w", encoding="utf-8") as f:
-            json.dump(updated, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"保存进度失败: {e}")
+    在当前账单的副本上打标（只复制未打标的账单），完成后发布为新版本，
+    打标期间其他请求仍可读取旧版本。
+    传入变更前的规则 old_rules 时，由被删除或改动的规则打标的账单按新规则重新打标；
+    会话记录的规则集（tagged_rules）与 old_rules 一致时走增量模式：只用新增/改动的规则匹配未打标账单，
+    只把打标结果变化的账单追加到进度日志，没有账单变化时不写进度。
+    未打标账单没有经过 old_rules 匹配（加载进度、保存进度后新增或清空的账单）时退回全量打标。
+    """
+    rules = load_rules()
+    with bill_session.edit(copy_if=_is_untagged) as edit:
+        recheck = []
+        if old_rules is not None:
+            recheck = find_changed_rule_bills(edit.bills, old_rules, rules)
+            for bill_id in recheck:
+                edit.mutable(bill_id)
+        
+        if old_rules is not None and edit.base.tagged_rules == rules_fingerprint(old_rules):
+            changed = apply_rules_incrementally(edit.bills, old_rules, rules, recheck)
+            if not changed:
+                edit.cancel()
+        else:
+            for bill_id in recheck:
+                reset_tagging(edit.bills[bill_id])
+            edit.bills = apply_rules_to_bills(edit.bills)
+            changed = None
+        edit.tagged_rules = rules_fingerprint(rules)
+        
+        if changed is None or changed:
+            try:
+                if changed is None:
+                    progress_store.write_snapshot(edit.bills)
+                else:
+                    progress_store.save_bills(edit.bills, changed)
+            except Exception as e:
+                print(f"保存进度失败: {e}")
     
-    return updated
+    return edit.result.bills
 
 
 # ==================== 路由：规则页面 ====================
@@ -89,9 +121,8 @@ def handle_rules():
     
     save_rules(new_rules)
     
-    bills = get_current_bills()
-    if bills:
-        apply_rules_and_sync(bills)
+    if bill_session.bills:
+        apply_rules_and_sync()
     
     return redirect(url_for("rules.handle_rules"))
 
@@ -113,13 +144,113 @@ def update_rules():
         if not isinstance(rules, list):
             return jsonify({"success": False, "message": "无效的数据格式"}), 400
         
+        errors = validate_rules(rules)
+        if errors:
+            return jsonify({"success": False, "message": "；".join(errors), "errors": errors}), 400
+        
+        old_rules = load_rules()
         save_rules(rules)
         
-        bills = get_current_bills()
-        if bills:
-            apply_rules_and_sync(bills)
+        if bill_session.bills:
+            apply_rules_and_sync(old_rules=old_rules)
         
         return jsonify({"success": True, "message": "规则已更新"})
     
     except Exception as e:
         return jsonify({"success": False, "message": f"更新失败：{str(e)}"}), 500
+
+
+@rules_bp.route("/api/rules/preview", methods=["POST"])
+def preview_rule():
+    """
+    预览候选规则会命中的账单（划词打标）
+    
+    请求体：{"key": "交易对方" / "商品说明" / "ANY", "rule": [关键词或正则], "match_mode": "keyword" / "regex"}
+    只看候选规则本身能否命中，不考虑排在它前面的规则。
+    """
+    data = request.get_json(silent=True) or {}
+    key = data.get("key", "交易对方")
+    patterns = data.get("rule", [])
+    match_mode = data.get("match_mode") or "keyword"
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    
+    if not isinstance(patterns, list) or not all(isinstance(p, str) for p in patterns):
+        return jsonify({"success": False, "message": "无效的数据格式"}), 400
+    
+    snapshot = bill_session.snapshot()
+    bills = snapshot.bills
+    if not bills:
+        return jsonify({"success": False, "message": "没有账单数据"})
+    
+    try:
+        hits = search_bill_index(snapshot, patterns, key, match_mode)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    bill_ids = sorted(hits)
+    untagged_count = sum(1 for bill_id in bill_ids if not bills[bill_id].get("类别", "").strip())
+    return jsonify({
+        "success": True,
+        "count": len(bill_ids),
+        "untagged_count": untagged_count,
+        "bill_ids": bill_ids,
+    })
+
+
+@rules_bp.route("/api/rules/stats", methods=["GET"])
+def rule_stats():
+    """
+    规则命中统计（在当前账单的副本上试运行，不修改账单）
+    
+    查询参数 scope：
+        untagged（默认）：只统计未打标账单，与实际打标时的匹配过程一致
+        all：把所有账单都当作未打标来统计，用于查看每条规则在全部账单上的命中情况
+    """
+    scope = request.args.get("scope", "untagged")
+    if scope not in ("untagged", "all"):
+        return jsonify({"success": False, "message": "无效的 scope 参数"}), 400
+    
+    bills = bill_session.bills
+    if not bills:
+        return jsonify({"success": False, "message": "没有账单数据"})
+    
+    dry_run = {bill_id: dict(bill) for bill_id, bill in bills.items()}
+    if scope == "all":
+        for bill in dry_run.values():
+            reset_tagging(bill)
+    
+    stats = RuleStats(load_rules())
+    apply_rules_to_bills(dry_run, stats=stats)
+    return jsonify({"success": True, "stats": stats.to_dict()})
+
+
+@rules_bp.route("/api/rules/optimize", methods=["POST"])
+def optimize_rules():
+    """
+    按当前账单的命中频率优化规则顺序（不改变当前账单的打标结果）
+    
+    请求体：{"apply": false}，默认只返回试运行报告；apply 为 true 时保存新顺序。
+    新顺序只保证当前账单的打标结果不变：交换了顺序、共享匹配字段的规则（report.unverified_pairs）
+    可能被以后的账单同时命中而得到不同的结果，此时响应中附带 warning。
+    """
+    data = request.get_json(silent=True) or {}
+    bills = bill_session.bills
+    if not bills:
+        return jsonify({"success": False, "message": "没有账单数据"})
+    
+    rules = load_rules()
+    report = optimize_rule_order(rules, bills)
+    result = {"success": True, "applied": False, "report": report.to_dict()}
+    if report.unverified:
+        result["warning"] = (
+            f"新顺序只保证当前账单的打标结果不变：有 {report.unverified} 对交换了顺序的规则匹配相同字段，"
+            f"以后同时命中两者的账单可能得到不同的类别"
+        )
+    
+    if data.get("apply") and report.moved:
+        save_rules([rules[idx] for idx in report.order])
+        apply_rules_and_sync(old_rules=rules)
+        result["applied"] = True
+    
+    return jsonify(result)
@@ -5,15 +5,19 @@
 """
 import os
 from pathlib import Path
-from core.utils import Alipay
+import pytest
+from core.bill import Bill
+from core.utils import Alipay, FileFormatError
 
 
-def write_alipay_csv(path: Path, rows: list[str]) -> None:
+ALIPAY_HEADER = '交易时间,交易分类,交易对方,对方账号,商品说明,收/支,金额,收/付款方式,交易状态,交易订单号,商家订单号,备注'
+
+
+def write_alipay_csv(path: Path, rows: list[str], encoding: str = 'utf-8', header: str = ALIPAY_HEADER) -> None:
     prelude = ['\n'] * 23
     marker = '------------------------支付宝支付科技有限公司  电子客户回单------------------------\n'
-    header = '交易时间,交易分类,交易对方,对方账号,商品说明,收/支,金额,收/付款方式,交易状态,交易订单号,商家订单号,备注\n'
-    content = ''.join(prelude + [marker, header] + [f'{row}\n' for row in rows])
-    path.write_text(content, encoding='utf-8')
+    content = ''.join(prelude + [marker, header + '\n'] + [f'{row}\n' for row in rows])
+    path.write_text(content, encoding=encoding)
 
 
 class TestAlipayParsing:
@@ -162,11 +166,21 @@ class TestAlipayDataIntegrity:
         csv_path = "tests/test_data/alipay-sample.csv"
         processor = Alipay(csv_path)
         
-        required_fields = ["交易时间", "金额", "交易对方", "商品说明", "收/支", "收/付款方式", "交易状态"]
+        required_fields = ["交易时间", "金额", "交易对方", "商品说明", "收/支"]
         
         for bill_id, bill in processor.bill.items():
             for field in required_fields:
                 assert field in bill, f"账单 {bill_id} 缺少必需字段: {field}"
+    
+    def test_unused_columns_dropped(self):
+        """测试只在解析阶段使用的原始列不随账单保存"""
+        csv_path = "tests/test_data/alipay-sample.csv"
+        processor = Alipay(csv_path)
+        
+        for bill_id, bill in processor.bill.items():
+            assert isinstance(bill, Bill)
+            for field in ["收/付款方式", "交易状态", "商家订单号", "交易分类"]:
+                assert field not in bill, f"账单 {bill_id} 不应保留字段: {field}"
 
 
 class TestAlipayRefund:
@@ -216,3 +230,206 @@ class TestAlipayRefund:
         assert len(processor.failed_rows) == 1
         assert processor.failed_rows[0]["原因"] == "退款未匹配到支付记录"
         assert processor.failed_rows[0]["客户摘要"] == "退款-测试商品"
+
+
+
+class TestAlipayStreaming:
+    """测试支付宝账单的编码识别与流式读取"""
+
+    ROW = "2025/01/02 12:00,餐饮美食,测试餐厅,test@example.com,午餐,支出,{amount},余额,交易成功,{bill_id},MERCHANT_1,"
+
+    def test_gbk_file(self, tmp_path):
+        """测试 GBK 编码的账单"""
+        csv_path = tmp_path / "alipay-gbk.csv"
+        write_alipay_csv(csv_path, [self.ROW.format(amount="12.50", bill_id="2025010200000001")], encoding='gbk')
+
+        processor = Alipay(str(csv_path))
+        assert processor._encoding == 'gbk'
+        assert processor.bill["2025010200000001"]["金额"] == 12.5
+        assert processor.bill["2025010200000001"]["交易对方"] == "测试餐厅"
+
+    def test_quoted_field_with_newline(self, tmp_path):
+        """测试带引号且含换行的字段按一个单元格读取"""
+        csv_path = tmp_path / "alipay-multiline.csv"
+        row = '2025/01/02 12:00,餐饮美食,测试餐厅,test@example.com,"午餐\n加饮料",支出,8.00,余额,交易成功,2025010200000002,MERCHANT_1,'
+        write_alipay_csv(csv_path, [row])
+
+        processor = Alipay(str(csv_path))
+        assert processor.bill["2025010200000002"]["商品说明"] == "午餐\n加饮料"
+
+    def test_missing_order_id_column(self, tmp_path):
+        """测试缺少交易订单号列时报格式错误"""
+        csv_path = tmp_path / "alipay-no-id.csv"
+        write_alipay_csv(csv_path, ["2025/01/02 12:00,餐饮美食"], header="交易时间,交易分类")
+
+        with pytest.raises(FileFormatError):
+            Alipay(str(csv_path))
+
+    def test_wrong_marker(self, tmp_path):
+        """测试格式标记不在约定行时报格式错误"""
+        csv_path = tmp_path / "alipay-bad.csv"
+        csv_path.write_text("交易时间,金额\n2025/01/02 12:00,1.00\n", encoding='utf-8')
+
+        with pytest.raises(FileFormatError):
+            Alipay(str(csv_path))
+
+
+class TestDetectEncoding:
+    """测试 detect_encoding() 的编码识别与明细偏移"""
+
+    ROW = "2025/01/02 12:00,餐饮美食,测试餐厅,test@example.com,午餐,支出,9.90,余额,交易成功,2025010200000003,MERCHANT_1,"
+
+    @pytest.mark.parametrize("encoding, expected", [
+        ("utf-8", "utf-8"),
+        ("utf-8-sig", "utf-8"),
+        ("gbk", "gbk"),
+        ("utf-16", "utf-16-le"),
+    ])
+    def test_offset_points_at_header(self, tmp_path, encoding, expected):
+        """测试各编码（含 BOM）下偏移都指向表头行"""
+        from core.config import ALIPAY_CHECKPOINT_LINE, ALIPAY_FORMAT_MARKER
+        from core.utils import detect_encoding
+
+        csv_path = tmp_path / f"alipay-{encoding}.csv"
+        write_alipay_csv(csv_path, [self.ROW], encoding=encoding)
+
+        enc, offset = detect_encoding(str(csv_path), ALIPAY_CHECKPOINT_LINE, ALIPAY_FORMAT_MARKER)
+        assert enc == expected
+        assert csv_path.read_bytes()[offset:].decode(enc).startswith(ALIPAY_HEADER)
+
+        processor = Alipay(str(csv_path))
+        assert processor.bill["2025010200000003"]["金额"] == 9.9
+
+
+class TestAlipayXlsx:
+    """测试直接读取 XLSX 账单"""
+
+    def test_xlsx_matches_csv(self, tmp_path):
+        """测试 XLSX 与同内容 CSV 的解析结果一致"""
+        from openpyxl import Workbook
+
+        rows = [
+            "2025/01/02 12:00,餐饮美食,测试餐厅,test@example.com,午餐,支出,12.50,余额,交易成功,2025010200000004,MERCHANT_1,",
+            "2025/01/03 09:00,交通出行,测试公交,test@example.com,乘车,支出,2.00,余额,交易成功,2025010300000005,MERCHANT_2,",
+        ]
+        csv_path = tmp_path / "alipay.csv"
+        write_alipay_csv(csv_path, rows)
+
+        workbook = Workbook()
+        sheet = workbook.active
+        for line in csv_path.read_text(encoding='utf-8').splitlines():
+            sheet.append([cell or None for cell in line.split(",")] if line else [None])
+        xlsx_path = tmp_path / "alipay.xlsx"
+        workbook.save(xlsx_path)
+
+        assert Alipay(str(xlsx_path)).bill == Alipay(str(csv_path)).bill
+
+    def test_xlsx_wrong_marker(self, tmp_path):
+        """测试 XLSX 格式标记不在约定行时报格式错误"""
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(["交易时间", "金额"])
+        xlsx_path = tmp_path / "alipay-bad.xlsx"
+        workbook.save(xlsx_path)
+
+        with pytest.raises(FileFormatError):
+            Alipay(str(xlsx_path))
+
+
+class TestAlipayRowOrder:
+    """测试解析结果与文件中的行顺序无关"""
+
+    def test_reversed_rows_give_same_bills(self, tmp_path):
+        """测试明细行倒序后解析结果不变（输出顺序跟随文件，调用方按交易时间排序）"""
+        from core.config import ALIPAY_CHECKPOINT_LINE, ALIPAY_FORMAT_MARKER
+        from core.utils import detect_encoding
+
+        csv_path = "tests/test_data/alipay-sample.csv"
+        enc, _offset = detect_encoding(csv_path, ALIPAY_CHECKPOINT_LINE, ALIPAY_FORMAT_MARKER)
+        lines = Path(csv_path).read_text(encoding=enc).splitlines(keepends=True)
+        head, rows = lines[:ALIPAY_CHECKPOINT_LINE + 1], lines[ALIPAY_CHECKPOINT_LINE + 1:]
+        rows = [row if row.endswith("\n") else row + "\n" for row in rows if row.strip()]
+
+        reversed_path = tmp_path / "alipay-reversed.csv"
+        reversed_path.write_text("".join(head + rows[::-1]), encoding=enc)
+
+        expected = Alipay(csv_path).bill
+        actual = Alipay(str(reversed_path)).bill
+        assert actual == expected
+        assert list(actual) == list(expected)[::-1]
+
+
+class TestAlipayRefundAccumulation:
+    """测试同一订单多笔退款的累计冲减"""
+
+    PAY = "2025/01/02 12:00,餐饮美食,测试餐厅,test@example.com,午餐,支出,{amount},余额,交易成功,{bill_id},MERCHANT_1,"
+    REFUND = "2025/01/03 12:00,退款,测试餐厅,test@example.com,退款-午餐,不计收支,{amount},余额,退款成功,{bill_id},MERCHANT_1,"
+
+    def test_multiple_partial_refunds(self, tmp_path):
+        """测试多笔部分退款累加（退款行在原订单之前也能配对）"""
+        from pytest import approx
+
+        csv_path = tmp_path / "alipay-refunds.csv"
+        write_alipay_csv(csv_path, [
+            self.REFUND.format(amount="1.50", bill_id="2025010200000010_r1"),
+            self.PAY.format(amount="10.00", bill_id="2025010200000010"),
+            self.REFUND.format(amount="2.50", bill_id="2025010200000010_r2"),
+        ])
+
+        processor = Alipay(str(csv_path))
+        assert processor.bill["2025010200000010"]["金额"] == approx(6.0)
+        assert processor.count_bills == 1
+
+    def test_refunds_exceeding_original(self, tmp_path):
+        """测试累计退款超过原订单金额时报错"""
+        from core.utils import RefundError
+
+        csv_path = tmp_path / "alipay-over-refund.csv"
+        write_alipay_csv(csv_path, [
+            self.PAY.format(amount="5.00", bill_id="2025010200000011"),
+            self.REFUND.format(amount="3.00", bill_id="2025010200000011_r1"),
+            self.REFUND.format(amount="3.00", bill_id="2025010200000011_r2"),
+        ])
+
+        with pytest.raises(RefundError, match="2025010200000011_r2"):
+            Alipay(str(csv_path))
+
+    def test_over_refund_reports_first_exceeding_refund(self, tmp_path):
+        """测试报错的是使累计退款首次超过原订单的那一笔，而不是最后一笔"""
+        from core.utils import RefundError
+
+        csv_path = tmp_path / "alipay-over-refund.csv"
+        write_alipay_csv(csv_path, [
+            self.PAY.format(amount="5.00", bill_id="2025010200000012"),
+            self.REFUND.format(amount="3.00", bill_id="2025010200000012_r1"),
+            self.REFUND.format(amount="3.00", bill_id="2025010200000012_r2"),
+            self.REFUND.format(amount="1.00", bill_id="2025010200000012_r3"),
+        ])
+
+        with pytest.raises(RefundError, match="2025010200000012_r2"):
+            Alipay(str(csv_path))
+
+    @pytest.mark.slow
+    def test_benchmark_200k_rows(self, tmp_path):
+        """基准：20 万行合成账单（其中 1/10 带部分退款）的解析耗时"""
+        import time
+        from pytest import approx
+
+        rows = []
+        for i in range(180000):
+            bill_id = f"2025010200{i:010d}"
+            rows.append(self.PAY.format(amount="10.00", bill_id=bill_id))
+            if i % 9 == 0:
+                rows.append(self.REFUND.format(amount="1.00", bill_id=f"{bill_id}_r"))
+        csv_path = tmp_path / "alipay-200k.csv"
+        write_alipay_csv(csv_path, rows)
+
+        start = time.perf_counter()
+        processor = Alipay(str(csv_path))
+        elapsed = time.perf_counter() - start
+        print(f"\n{len(rows)} 行，耗时 {elapsed:.2f}s，{len(rows) / elapsed:,.0f} 行/秒")
+
+        assert processor.count_bills == 180000
+        assert processor.bill["20250102000000000000"]["金额"] == approx(9.0)
+        assert processor.bill["20250102000000000001"]["金额"] == approx(10.0)
@@ -8,6 +8,7 @@ import json
 import io
 import os
 from app import app
+from core.session_store import bill_session
 
 
 def write_alipay_csv(path, rows):
@@ -101,8 +102,7 @@ class TestBillsAPI:
     
     def test_get_bills_empty(self, client):
         """测试获取空账单列表"""
-        from app import current_bills
-        current_bills.clear()
+        bill_session.replace({})
         
         response = client.get('/api/bills')
         data = response.get_json()
@@ -111,9 +111,7 @@ class TestBillsAPI:
     
     def test_get_bills_with_data(self, client, sample_bills):
         """测试获取有数据的账单列表"""
-        from app import current_bills
-        current_bills.clear()
-        current_bills.update(sample_bills)
+        bill_session.replace(sample_bills)
         
         response = client.get('/api/bills')
         data = response.get_json()
@@ -123,8 +121,7 @@ class TestBillsAPI:
     
     def test_get_bill_stats_empty(self, client):
         """测试获取空账单统计"""
-        from app import current_bills
-        current_bills.clear()
+        bill_session.replace({})
         
         response = client.get('/api/bill_stats')
         data = response.get_json()
@@ -132,9 +129,7 @@ class TestBillsAPI:
     
     def test_get_bill_stats_with_data(self, client, sample_bills):
         """测试获取有数据的账单统计"""
-        from app import current_bills
-        current_bills.clear()
-        current_bills.update(sample_bills)
+        bill_session.replace(sample_bills)
         
         response = client.get('/api/bill_stats')
         data = response.get_json()
@@ -185,11 +180,82 @@ class TestRulesAPI:
         assert response.status_code == 400
         assert data['success'] == False
     
+    def test_update_rules_rejects_invalid_regex(self, client):
+        """测试保存包含无效正则的规则时返回 400 且不落盘"""
+        from core.utils import load_rules
+        before = load_rules()
+
+        new_rules = [{
+            "category": "食",
+            "tag": "",
+            "key": "交易对方",
+            "rule": ["[未闭合"],
+            "match_mode": "regex",
+            "time_based": [],
+            "comment": ""
+        }]
+
+        response = client.post('/api/rules',
+                              data=json.dumps({'rules': new_rules}),
+                              content_type='application/json')
+        data = response.get_json()
+        assert response.status_code == 400
+        assert data['success'] == False
+        assert len(data['errors']) == 1
+        assert load_rules() == before
+    
+    def test_preview_rule(self, client, sample_bills):
+        """测试预览候选规则命中的账单"""
+        bill_session.replace(sample_bills)
+
+        response = client.post('/api/rules/preview',
+                              data=json.dumps({'key': 'ANY', 'rule': ['外卖', '打车']}),
+                              content_type='application/json')
+        data = response.get_json()
+        assert data['success'] == True
+        assert data['bill_ids'] == ['001', '002']
+        assert data['count'] == 2
+        assert data['untagged_count'] == 1
+
+        response = client.post('/api/rules/preview',
+                              data=json.dumps({'key': '交易对方', 'rule': ['[未闭合'], 'match_mode': 'regex'}),
+                              content_type='application/json')
+        assert response.status_code == 400
+        assert response.get_json()['success'] == False
+
+    def test_rule_stats(self, client, sample_bills):
+        """测试规则命中统计接口（试运行，不修改当前账单）"""
+        from core.utils import load_rules
+        bill_session.replace(sample_bills)
+
+        response = client.get('/api/rules/stats?scope=all')
+        data = response.get_json()
+        assert data['success'] == True
+        assert data['stats']['bills'] == 2
+        assert len(data['stats']['rules']) == len(load_rules())
+        assert bill_session.bills['002']['类别'] == '行'
+
+        response = client.get('/api/rules/stats?scope=unknown')
+        assert response.status_code == 400
+
+    def test_optimize_rules_dry_run(self, client, sample_bills):
+        """测试规则顺序优化默认只返回报告，不修改规则"""
+        from core.utils import load_rules
+        bill_session.replace(sample_bills)
+        before = load_rules()
+
+        response = client.post('/api/rules/optimize',
+                              data=json.dumps({}),
+                              content_type='application/json')
+        data = response.get_json()
+        assert data['success'] == True
+        assert data['applied'] == False
+        assert sorted(data['report']['order']) == list(range(len(before)))
+        assert load_rules() == before
+
     def test_update_rules_triggers_retag(self, client, sample_bills):
         """测试更新规则后自动重新打标"""
-        from app import current_bills
-        current_bills.clear()
-        current_bills.update(sample_bills)
+        bill_session.replace(sample_bills)
         
         new_rules = [{
             "category": "食",
@@ -205,6 +271,38 @@ class TestRulesAPI:
                               content_type='application/json')
         assert response.status_code == 200
     
+    def test_update_rules_retags_bills_not_checked_by_old_rules(self, client, sample_bills):
+        """测试保存进度新增的未打标账单在规则变更时按全部规则打标，而不只是新增的规则"""
+        from core.utils import save_rules
+        old_rules = [{"category": "食", "tag": "外卖", "key": "交易对方", "rule": ["美团外卖"], "time_based": [], "comment": ""}]
+        save_rules(old_rules)
+        client.post('/api/save_progress',
+                   data=json.dumps({'bills': sample_bills}),
+                   content_type='application/json')
+        assert bill_session.bills['001']['类别'] == ''
+        assert bill_session.snapshot().tagged_rules is None
+
+        new_rules = old_rules + [{"category": "行", "tag": "", "key": "交易对方", "rule": ["地铁"], "time_based": [], "comment": ""}]
+        response = client.post('/api/rules',
+                              data=json.dumps({'rules': new_rules}),
+                              content_type='application/json')
+        assert response.get_json()['success'] == True
+        assert bill_session.bills['001']['类别'] == '食'
+        assert bill_session.snapshot().tagged_rules is not None
+
+    def test_update_rules_without_changes_keeps_version(self, client, sample_bills):
+        """测试增量打标没有账单变化时不发布新版本"""
+        from core.utils import save_rules
+        rules = [{"category": "食", "tag": "外卖", "key": "交易对方", "rule": ["美团外卖"], "time_based": [], "comment": ""}]
+        save_rules(rules)
+        bill_session.replace(sample_bills)
+        client.post('/api/rules', data=json.dumps({'rules': rules}), content_type='application/json')
+        version = bill_session.version
+
+        rules = rules + [{"category": "行", "tag": "", "key": "交易对方", "rule": ["地铁"], "time_based": [], "comment": ""}]
+        client.post('/api/rules', data=json.dumps({'rules': rules}), content_type='application/json')
+        assert bill_session.version == version
+
     def test_rules_form_get(self, client):
         """测试规则表单 GET 请求"""
         response = client.get('/rules')
@@ -233,17 +331,15 @@ class TestRulesAPI:
     
     def test_rules_form_post_with_bills_triggers_sync(self, client, sample_bills):
         """测试规则表单 POST - 存在账单数据时触发同步路径"""
-        from app import current_bills
         from core.utils import save_rules
         
         # 保存兼容格式的规则，这样 apply_rules_and_sync 不会出错
         save_rules([])
         
-        current_bills.clear()
-        current_bills.update(sample_bills)
+        bill_session.replace(sample_bills)
         
         # 表单提交后会保存新规则，然后 apply_rules_and_sync 会用空规则列表处理
-        # 由于规则为空，不会触发 _match_rule，只会走初始化分支
+        # 由于规则为空，不会匹配任何规则，只会走初始化分支
         response = client.post('/rules', data={}, follow_redirects=True)
         assert response.status_code == 200
     
@@ -425,6 +521,73 @@ class TestProgressAPI:
         assert data['success'] == False
 
 
+class TestPatchProgressAPI:
+    """测试增量保存进度API"""
+
+    def _save_all(self, client, bills):
+        response = client.post('/api/save_progress',
+                               data=json.dumps({'bills': bills}),
+                               content_type='application/json')
+        return response.get_json()['version']
+
+    def _patch(self, client, payload):
+        return client.patch('/api/save_progress',
+                            data=json.dumps(payload),
+                            content_type='application/json')
+
+    def test_patch_applies_changes(self, client, sample_bills):
+        """测试只提交改动的字段、新增和删除的账单"""
+        version = self._save_all(client, sample_bills)
+
+        response = self._patch(client, {
+            'version': version,
+            'bills': {
+                '001': {'类别': '食', '标签': '午餐'},
+                '003': {'交易时间': '2023-10-03 08:00', '金额': 5.0},
+            },
+            'removed': ['002'],
+        })
+        data = response.get_json()
+        assert data['success'] == True
+        assert data['saved'] == 3
+        assert data['version'] > version
+
+        current = bill_session.bills
+        assert current['001']['类别'] == '食'
+        assert current['001']['交易对方'] == '美团外卖'
+        assert current['003']['账本'] == ''
+        assert '002' not in current
+
+        loaded = client.get('/api/load_progress').get_json()['bills']
+        assert sorted(loaded) == ['001', '003']
+        assert loaded['001']['标签'] == '午餐'
+
+    def test_patch_version_conflict(self, client, sample_bills):
+        """测试版本号过期时拒绝保存"""
+        version = self._save_all(client, sample_bills)
+        self._patch(client, {'version': version, 'bills': {'001': {'备注': 'x'}}})
+
+        response = self._patch(client, {'version': version, 'bills': {'001': {'备注': 'y'}}})
+        data = response.get_json()
+        assert response.status_code == 409
+        assert data['conflict'] == True
+        assert data['version'] == bill_session.version
+        assert bill_session.bills['001']['备注'] == 'x'
+
+    def test_patch_without_changes(self, client, sample_bills):
+        """测试没有改动时不递增版本号"""
+        version = self._save_all(client, sample_bills)
+        data = self._patch(client, {'version': version}).get_json()
+        assert data['success'] == True
+        assert data['version'] == version
+
+    def test_patch_invalid_format(self, client):
+        """测试缺少版本号或格式错误"""
+        assert self._patch(client, {'bills': {}}).get_json()['success'] == False
+        data = self._patch(client, {'version': 1, 'bills': {'001': 'x'}}).get_json()
+        assert data['success'] == False
+
+
 # ==================== 自动打标 API 测试 ====================
 
 class TestAutoTagAPI:
@@ -432,8 +595,7 @@ class TestAutoTagAPI:
     
     def test_auto_tag_no_bills(self, client):
         """测试无账单时自动打标"""
-        from app import current_bills
-        current_bills.clear()
+        bill_session.replace({})
         # 确保没有进度文件
         if os.path.exists('bills.process'):
             os.remove('bills.process')
@@ -444,10 +606,8 @@ class TestAutoTagAPI:
     
     def test_auto_tag_with_bills(self, client, sample_bills):
         """测试有账单时自动打标"""
-        from app import current_bills
-        # 需要同时设置 current_bills 和保存进度
-        current_bills.clear()
-        current_bills.update(sample_bills)
+        # 需要同时设置当前账单和保存进度
+        bill_session.replace(sample_bills)
         
         # 保存进度文件
         client.post('/api/save_progress',
@@ -774,9 +934,7 @@ class TestAITagAPI:
     
     def test_apply_ai_tags_with_data(self, client, sample_bills):
         """测试应用 AI 打标结果"""
-        from app import current_bills
-        current_bills.clear()
-        current_bills.update(sample_bills)
+        bill_session.replace(sample_bills)
         
         # 保存进度
         client.post('/api/save_progress',
@@ -804,9 +962,7 @@ class TestAITagAPI:
     
     def test_apply_ai_tags_with_rules(self, client, sample_bills):
         """测试应用 AI 打标结果并保存规则"""
-        from app import current_bills
-        current_bills.clear()
-        current_bills.update(sample_bills)
+        bill_session.replace(sample_bills)
         
         # 保存进度
         client.post('/api/save_progress',
@@ -837,3 +993,7 @@ class TestAITagAPI:
                               content_type='application/json')
         data = response.get_json()
         assert data['success'] == True
+
+        from core.utils import get_compiled_rules
+        matched = get_compiled_rules().match({'交易对方': '测试商家'})
+        assert matched and matched[0]['tag'] == '测试'
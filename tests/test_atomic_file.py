@@ -0,0 +1,138 @@
+"""
+测试原子文件写入
+
+测试临时文件替换、写入失败时保留原文件，以及同一文件突发写入的合并
+"""
+import os
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from core.atomic_file import atomic_write_text, coalesced_write, file_lock, fcntl
+
+
+def _leftover_temp_files(directory):
+    return [path.name for path in directory.iterdir() if path.name.endswith(".tmp")]
+
+
+class TestAtomicWrite:
+    """测试原子写入"""
+
+    def test_replace_content(self, tmp_path):
+        """测试覆盖已有文件且不留临时文件"""
+        path = tmp_path / "sub" / "rules.json"
+        atomic_write_text(path, "[1]")
+        atomic_write_text(path, "[1, 2]")
+        assert path.read_text(encoding="utf-8") == "[1, 2]"
+        assert _leftover_temp_files(path.parent) == []
+
+    def test_keeps_file_mode(self, tmp_path):
+        """测试替换后保留原文件的权限，新文件按 umask 取默认权限"""
+        path = tmp_path / "rules.json"
+        atomic_write_text(path, "[1]")
+        umask = os.umask(0)
+        os.umask(umask)
+        assert stat.S_IMODE(path.stat().st_mode) == 0o666 & ~umask
+
+        os.chmod(path, 0o640)
+        atomic_write_text(path, "[2]")
+        assert stat.S_IMODE(path.stat().st_mode) == 0o640
+
+    def test_failed_render_keeps_old_file(self, tmp_path):
+        """测试生成内容失败时原文件不变"""
+        path = tmp_path / "rules.json"
+        atomic_write_text(path, "[1]")
+
+        def broken():
+            raise TypeError("不可序列化")
+
+        with pytest.raises(TypeError):
+            coalesced_write(path, broken)
+        assert path.read_text(encoding="utf-8") == "[1]"
+        assert _leftover_temp_files(tmp_path) == []
+
+        # 失败后仍可继续写入
+        coalesced_write(path, lambda: b"[2]")
+        assert path.read_text(encoding="utf-8") == "[2]"
+
+
+class TestCoalescedWrite:
+    """测试合并写入"""
+
+    def test_burst_is_coalesced(self, tmp_path):
+        """测试写入进行中提交的多次写入只落盘最后一次"""
+        path = tmp_path / "categories.json"
+        first_started = threading.Event()
+        release_first = threading.Event()
+        rendered = []
+        flushed = []
+        submitted = []
+
+        def render_first():
+            first_started.set()
+            release_first.wait(5)
+            rendered.append(0)
+            return b"0"
+
+        def submit(value):
+            def render():
+                rendered.append(value)
+                return str(value).encode()
+            submitted.append(value)
+            coalesced_write(path, render, lambda: flushed.append(value))
+
+        first = threading.Thread(target=coalesced_write, args=(path, render_first))
+        first.start()
+        assert first_started.wait(5)
+
+        others = [threading.Thread(target=submit, args=(value,)) for value in range(1, 6)]
+        for thread in others:
+            thread.start()
+        # 等其余写入都已提交并进入等待
+        while len(submitted) < len(others):
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release_first.set()
+        first.join(5)
+        for thread in others:
+            thread.join(5)
+
+        assert rendered[0] == 0
+        assert len(rendered) == 2
+        assert flushed == rendered[1:]
+        assert path.read_text(encoding="utf-8") == str(rendered[-1])
+
+    def test_sequential_writes_all_flushed(self, tmp_path):
+        """测试没有并发时每次写入都落盘"""
+        path = tmp_path / "books.json"
+        for value in range(3):
+            coalesced_write(path, lambda value=value: str(value).encode())
+            assert path.read_text(encoding="utf-8") == str(value)
+
+
+@pytest.mark.skipif(fcntl is None, reason="平台不支持 flock")
+class TestFileLock:
+    """测试跨进程文件锁"""
+
+    def test_excludes_other_process(self, tmp_path):
+        """测试持有锁时其他进程拿不到锁，释放后可以拿到"""
+        lock_path = tmp_path / "bills.process.lock"
+        probe = (
+            "import fcntl, os, sys\n"
+            "fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)\n"
+            "try:\n"
+            "    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)\n"
+            "except BlockingIOError:\n"
+            "    sys.exit(1)\n"
+        )
+
+        def other_process_can_lock():
+            return subprocess.run([sys.executable, "-c", probe, str(lock_path)]).returncode == 0
+
+        with file_lock(lock_path):
+            assert not other_process_can_lock()
+        assert other_process_can_lock()
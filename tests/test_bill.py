@@ -0,0 +1,113 @@
+"""
+测试账单记录类型
+
+测试 Bill 的字典读写语义、原始行裁剪和 JSON 序列化
+"""
+import json
+import pickle
+
+import pytest
+
+from core.bill import BILL_FIELDS, Bill, bill_json_default, bills_from_json
+from core.config import EXPORT_COLUMNS, STANDARD_FIELDS
+
+
+def _make_row():
+    return {
+        "交易时间": "2024-01-01 12:00:00",
+        "交易分类": "餐饮美食",
+        "交易对方": "美团外卖",
+        "商品说明": "午餐",
+        "收/支": "支出",
+        "金额": 25.5,
+        "收/付款方式": "余额",
+        "交易状态": "交易成功",
+        "商家订单号": "M123",
+    }
+
+
+class TestBillFields:
+    """测试标准字段与配置一致"""
+
+    def test_fields_follow_config(self):
+        """测试标准字段覆盖 config 中的导出列与标准字段，且不含其他字段"""
+        assert set(BILL_FIELDS) == {*EXPORT_COLUMNS, *STANDARD_FIELDS, "收/支"}
+        assert list(BILL_FIELDS)[:len(EXPORT_COLUMNS)] == EXPORT_COLUMNS
+        assert len(set(BILL_FIELDS.values())) == len(BILL_FIELDS)
+
+    def test_export_columns_kept_from_row(self):
+        """测试原始行中的全部导出列都保存在 Bill 中"""
+        row = {name: f"值{i}" for i, name in enumerate(EXPORT_COLUMNS)}
+        bill = Bill.from_row(row)
+        assert bill.to_dict() == row
+        assert not bill.extra
+
+
+class TestBillMapping:
+    """测试 Bill 与字典一致的读写行为"""
+
+    def test_standard_and_extra_fields(self):
+        """测试标准字段和其他字段的读写、删除与遍历"""
+        bill = Bill({"交易对方": "美团", "自定义": "x"})
+        assert bill["交易对方"] == "美团"
+        assert bill["自定义"] == "x"
+        assert bill.get("类别", "") == ""
+        assert "类别" not in bill
+
+        bill["类别"] = "食"
+        bill.setdefault("备注", "")
+        assert list(bill) == ["类别", "交易对方", "备注", "自定义"]
+        assert len(bill) == 4
+
+        del bill["自定义"]
+        assert bill.extra == {}
+        with pytest.raises(KeyError):
+            del bill["标签"]
+        with pytest.raises(KeyError):
+            bill["不存在"]
+
+    def test_equals_dict(self):
+        """测试与内容相同的字典相等"""
+        data = {"交易时间": "2024-01-01 12:00:00", "金额": 1.0, "其他": 1}
+        assert Bill(data) == data
+        assert Bill(data).to_dict() == data
+
+    def test_from_row_drops_unused_columns(self):
+        """测试原始行只保留标准字段"""
+        bill = Bill.from_row(_make_row())
+        assert bill.to_dict() == {
+            "交易时间": "2024-01-01 12:00:00",
+            "金额": 25.5,
+            "交易对方": "美团外卖",
+            "商品说明": "午餐",
+            "收/支": "支出",
+        }
+        assert bill.extra is None
+        assert Bill.from_row(_make_row(), ["交易状态"])["交易状态"] == "交易成功"
+
+    def test_pickle(self):
+        """测试可以发送给打标进程池"""
+        bill = Bill.from_row(_make_row())
+        assert pickle.loads(pickle.dumps(bill)) == bill
+
+
+class TestBillJson:
+    """测试 JSON 序列化边界"""
+
+    def test_round_trip(self):
+        """测试写入进度文件后读回"""
+        bills = {"001": Bill.from_row(_make_row())}
+        text = json.dumps(bills, ensure_ascii=False, default=bill_json_default)
+        loaded = bills_from_json(json.loads(text))
+        assert isinstance(loaded["001"], Bill)
+        assert loaded == bills
+
+    def test_non_bill_rejected(self):
+        """测试其他对象仍按 json 默认行为报错"""
+        with pytest.raises(TypeError):
+            json.dumps({"x": object()}, default=bill_json_default)
+
+    def test_list_passthrough(self):
+        """测试列表格式的旧进度原样返回"""
+        data = [{"交易订单号": "001"}]
+        assert bills_from_json(data) is data
@@ -0,0 +1,140 @@
+"""
+测试账单文本倒排索引
+
+测试 BillTextIndex 的查询结果与逐条规则匹配一致，以及增量更新
+"""
+import random
+
+import pytest
+
+from core.bill import Bill
+from core import bill_index
+from core.bill_index import BillTextIndex, search_bill_index, sync_bill_index, update_bill_index
+from core.rule_engine import match_single_rule
+from core.session_store import BillSession
+
+
+def _make_bills():
+    return {
+        "001": {"交易对方": "美团外卖", "商品说明": "午餐"},
+        "002": {"交易对方": "滴滴出行", "商品说明": "打车"},
+        "003": {"交易对方": "美团", "商品说明": "美团单车骑行"},
+        "004": {"交易对方": "", "商品说明": "外卖订单"},
+        "005": {"交易对方": "肯德基", "商品说明": ""},
+    }
+
+
+class TestBillTextIndex:
+    """测试倒排索引查询"""
+
+    def test_keyword_search(self):
+        """测试关键词查询（单字、双字、多字）"""
+        index = BillTextIndex.from_bills(_make_bills())
+        assert index.search(["美团"], "交易对方") == {"001", "003"}
+        assert index.search(["外"], "交易对方") == {"001"}
+        assert index.search(["美团外卖"], "交易对方") == {"001"}
+        assert index.search(["外卖"], "ANY") == {"001", "004"}
+        assert index.search(["不存在"], "ANY") == set()
+
+    def test_regex_search(self):
+        """测试正则查询与无效正则"""
+        index = BillTextIndex.from_bills(_make_bills())
+        assert index.search([r"^美团$"], "交易对方", "regex") == {"003"}
+        with pytest.raises(ValueError):
+            index.search(["[未闭合"], "ANY", "regex")
+
+    def test_matches_rule_engine(self):
+        """测试随机数据上的查询结果与逐条规则匹配一致"""
+        rng = random.Random(7)
+        alphabet = "美团外卖滴出行肯德基饿了么"
+        bills = {
+            str(i): {
+                "交易对方": "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6))),
+                "商品说明": "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6))),
+            }
+            for i in range(300)
+        }
+        index = BillTextIndex.from_bills(bills)
+
+        for _ in range(100):
+            key = rng.choice(["交易对方", "商品说明", "ANY"])
+            patterns = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3)))
+                        for _ in range(rng.randint(1, 2))]
+            rule = {"key": key, "rule": patterns, "match_mode": "keyword"}
+            expected = {bid for bid, bill in bills.items() if match_single_rule(bill, rule)}
+            assert index.search(patterns, key) == expected
+
+    def test_sync_follows_in_place_changes(self):
+        """测试账单字典被原地修改后同步索引"""
+        bills = _make_bills()
+        assert sync_bill_index(bills).search(["肯德基"], "交易对方") == {"005"}
+
+        bills["005"]["交易对方"] = "麦当劳"
+        del bills["001"]
+        bills["006"] = {"交易对方": "肯德基宅急送", "商品说明": ""}
+
+        index = sync_bill_index(bills)
+        assert index.search(["肯德基"], "交易对方") == {"006"}
+        assert index.search(["美团"], "交易对方") == {"003"}
+        assert len(index) == 5
+
+
+class TestSessionIndex:
+    """测试随账单会话发布同步的索引"""
+
+    def test_index_follows_published_edits(self, monkeypatch):
+        """测试整体替换时建索引，编辑只更新涉及的账单，预览时不再全量同步"""
+        monkeypatch.setattr(bill_index, "_current_index", None)
+        session = BillSession()
+        session.on_publish(update_bill_index)
+
+        built = []
+        from_bills = BillTextIndex.from_bills.__func__
+        monkeypatch.setattr(BillTextIndex, "from_bills",
+                            classmethod(lambda cls, bills: built.append(len(bills)) or from_bills(cls, bills)))
+        session.replace({bill_id: Bill(bill) for bill_id, bill in _make_bills().items()})
+        assert built == [5]
+
+        monkeypatch.setattr(BillTextIndex, "refresh", lambda self, bills: pytest.fail("不应全量刷新"))
+        monkeypatch.setattr(BillTextIndex, "update_bill", lambda self, bill_id, bill, update=BillTextIndex.update_bill:
+                            built.append(bill_id) or update(self, bill_id, bill))
+        with session.edit() as edit:
+            edit.mutable("005")["交易对方"] = "麦当劳"
+            edit.remove("001")
+            edit.add("006", Bill({"交易对方": "肯德基宅急送", "商品说明": ""}))
+        assert sorted(built[1:]) == ["005", "006"]
+
+        snapshot = session.snapshot()
+        assert search_bill_index(snapshot, ["肯德基"], "交易对方") == {"006"}
+        assert search_bill_index(snapshot, ["美团"], "交易对方") == {"003"}
+
+    def test_replace_reuses_index(self, monkeypatch):
+        """测试整体替换为文本相同的账单时复用索引，不重新索引任何条目"""
+        session = BillSession()
+        session.on_publish(update_bill_index)
+        session.replace({bill_id: Bill(bill) for bill_id, bill in _make_bills().items()})
+        index = bill_index._current_index
+
+        monkeypatch.setattr(BillTextIndex, "from_bills", classmethod(lambda cls, bills: pytest.fail("不应重建")))
+        monkeypatch.setattr(BillTextIndex, "_discard", staticmethod(lambda *args: pytest.fail("不应重新索引")))
+        bills = {bill_id: Bill(bill) for bill_id, bill in _make_bills().items()}
+        bills["002"]["类别"] = "行"
+        session.replace(bills)
+
+        assert bill_index._current_index is index
+        snapshot = session.snapshot()
+        assert (index.epoch, index.version) == (snapshot.epoch, snapshot.version)
+        monkeypatch.undo()
+        assert search_bill_index(snapshot, ["外卖"], "ANY") == {"001", "004"}
+
+    def test_older_snapshot_limited_to_its_bills(self):
+        """测试用旧版本查询时结果限定在该版本的账单内"""
+        session = BillSession()
+        session.on_publish(update_bill_index)
+        session.replace({bill_id: Bill(bill) for bill_id, bill in _make_bills().items()})
+        before = session.snapshot()
+        with session.edit() as edit:
+            edit.add("006", Bill({"交易对方": "美团买菜", "商品说明": ""}))
+
+        assert search_bill_index(before, ["美团"], "交易对方") == {"001", "003"}
+        assert search_bill_index(session.snapshot(), ["美团"], "交易对方") == {"001", "003", "006"}
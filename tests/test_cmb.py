@@ -1,6 +1,10 @@
 """
-测试招商银行退款匹配逻辑
+测试招商银行 PDF 解析与退款匹配逻辑
 """
+import re
+
+import pytest
+
 from core.utils import CmbPDF
 from core.utils import _cmb_reconcile_refunds_with_issues
 from core.utils import _cmb_reconcile_refunds
@@ -236,3 +240,189 @@ def test_cmb_falls_back_to_summary_when_counterparty_and_customer_summary_missin
     bill = next(iter(processor.bill.values()))
     assert bill["交易对方"] == ""
     assert bill["商品说明"] == "便利店消费"
+
+
+CMB_HEADER_COLUMNS = [
+    ("记账日期", 40), ("货币", 110), ("交易金额", 150), ("联机余额", 220),
+    ("交易摘要", 290), ("对手信息", 370), ("客户摘要", 470),
+]
+
+
+def write_cmb_pdf(path, pages, rows_per_page=5):
+    """生成与招商银行流水版式一致的多页 PDF"""
+    import fitz
+
+    def put(page, x, y, text):
+        page.insert_text((x, y), text, fontname="helv" if text.isascii() else "china-s", fontsize=9)
+
+    doc = fitz.open()
+    for page_no in range(pages):
+        page = doc.new_page(width=595, height=842)
+        y = 80
+        for name, x in CMB_HEADER_COLUMNS:
+            put(page, x, y, name)
+        for idx in range(rows_per_page):
+            y += 20
+            values = [
+                f"2026-{page_no % 12 + 1:02d}-{idx + 1:02d}", "CNY", f"-{page_no}.{idx + 1}0",
+                "1000.00", "快捷支付", f"商户{page_no}", f"消费{idx}",
+            ]
+            for (_name, x), value in zip(CMB_HEADER_COLUMNS, values):
+                put(page, x, y, value)
+    doc.save(str(path))
+    doc.close()
+
+
+def test_cmb_parallel_extraction_matches_sequential(tmp_path, monkeypatch):
+    import fitz
+    import core.utils as utils
+    from core.utils import _cmb_extract_visual_rows
+
+    pdf_path = tmp_path / "cmb.pdf"
+    write_cmb_pdf(pdf_path, pages=7)
+
+    with fitz.open(str(pdf_path)) as doc:
+        expected = _cmb_extract_visual_rows(doc, str(pdf_path))
+        monkeypatch.setattr(utils, "CMB_PARALLEL_MIN_PAGES", 2)
+        monkeypatch.setattr(utils, "CMB_PARALLEL_PAGE_CHUNK", 2)
+        monkeypatch.setattr(utils, "CMB_PARALLEL_WORKERS", 2)
+        rows = _cmb_extract_visual_rows(doc, str(pdf_path))
+
+    assert len(expected) == 35
+    assert rows == expected
+    assert [row["page"] for row in rows] == [str(page) for page in range(1, 8) for _ in range(5)]
+
+
+def test_cmb_small_pdf_runs_in_process(tmp_path, monkeypatch):
+    import concurrent.futures
+    import core.utils as utils
+
+    def fail(*args, **kwargs):
+        raise AssertionError("不应启动进程池")
+
+    pdf_path = tmp_path / "cmb.pdf"
+    write_cmb_pdf(pdf_path, pages=2)
+    monkeypatch.setattr(utils, "CMB_PARALLEL_WORKERS", 4)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", fail)
+
+    processor = CmbPDF(str(pdf_path))
+
+    assert processor.count_rows == 10
+    assert len(processor.bill) == 10
+
+
+def test_cmb_span_crossing_columns_is_split(tmp_path):
+    import fitz
+    from core.utils import _cmb_extract_page_visual_rows
+
+    pdf_path = tmp_path / "cmb.pdf"
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    for name, x in CMB_HEADER_COLUMNS:
+        page.insert_text((x, 80), name, fontname="china-s", fontsize=9)
+    # 日期、货币、金额写在同一个文本片段里，跨越两个列边界
+    page.insert_text((40, 100), "2026-03-01" + " " * 10 + "CNY" + " " * 9 + "-12.50", fontname="helv", fontsize=9)
+    page.insert_text((220, 100), "1000.00", fontname="helv", fontsize=9)
+    page.insert_text((290, 100), "快捷支付", fontname="china-s", fontsize=9)
+    page.insert_text((370, 100), "星巴克", fontname="china-s", fontsize=9)
+    doc.save(str(pdf_path))
+    doc.close()
+
+    with fitz.open(str(pdf_path)) as doc:
+        rows = _cmb_extract_page_visual_rows(doc[0])
+
+    assert len(rows) == 1
+    assert rows[0]["date"] == "2026-03-01"
+    assert rows[0]["currency"] == "CNY"
+    assert rows[0]["amount"] == "-12.50"
+    assert rows[0]["summary"] == "快捷支付"
+    assert rows[0]["counterparty"] == "星巴克"
+
+
+def _group_items_into_lines_reference(items, y_tol=1.2):
+    """逐行线性查找的原始实现，用于对照"""
+    lines = []
+    for x0, y0, x1, _y1, text, _chars in sorted(items, key=lambda item: (item[1], item[0])):
+        matched = next((line for line in lines if abs(line["y"] - y0) <= y_tol), None)
+        if matched is None:
+            matched = {"y": y0, "items": []}
+            lines.append(matched)
+        matched["items"].append((x0, x1, text, None))
+        matched["y"] = (matched["y"] + y0) / 2
+    for line in lines:
+        line["items"].sort(key=lambda item: item[0])
+        line["text"] = "".join(item[2] for item in line["items"]).strip()
+        line["compact"] = re.sub(r"\s+", "", line["text"])
+    return sorted(lines, key=lambda item: item["y"])
+
+
+def _dense_page_items(lines, chars_per_line, seed=0):
+    """合成一页字符：每行字符的 y 有小幅抖动，行距随机"""
+    import random
+
+    rng = random.Random(seed)
+    items = []
+    y = 20.0
+    for _ in range(lines):
+        y += rng.choice([0.8, 1.5, 3.0, 12.0])
+        for idx in range(chars_per_line):
+            jitter = rng.uniform(-0.6, 0.6)
+            x0 = 10 + idx * 5 + rng.uniform(0, 0.5)
+            items.append((x0, y + jitter, x0 + 4.5, y + jitter + 9, chr(0x4E00 + rng.randrange(500)), None))
+    rng.shuffle(items)
+    return items
+
+
+def test_cmb_group_items_into_lines_matches_reference():
+    from core.utils import _cmb_group_items_into_lines
+
+    for seed in range(5):
+        items = _dense_page_items(lines=40, chars_per_line=30, seed=seed)
+        assert _cmb_group_items_into_lines(items) == _group_items_into_lines_reference(items)
+
+
+@pytest.mark.slow
+def test_cmb_benchmark_group_dense_page():
+    """基准：单页 200 行 × 60 字符的行归并耗时"""
+    import time
+    from core.utils import _cmb_group_items_into_lines
+
+    items = _dense_page_items(lines=200, chars_per_line=60)
+
+    start = time.perf_counter()
+    for _ in range(10):
+        lines = _cmb_group_items_into_lines(items)
+    elapsed = (time.perf_counter() - start) / 10
+    print(f"\n{len(items)} 个字符，{len(lines)} 行，每页耗时 {elapsed * 1000:.1f}ms")
+
+    assert elapsed < 0.5
+
+
+# 招商银行 PDF 解析吞吐量目标（单进程，页/秒）
+CMB_PAGES_PER_SECOND_TARGET = 50
+
+
+@pytest.mark.slow
+def test_cmb_benchmark_pages_per_second(tmp_path):
+    """基准：100 页 × 30 行流水的单进程解析吞吐量"""
+    import time
+    import fitz
+    from core.utils import _cmb_extract_pages
+
+    page_path = tmp_path / "cmb-1.pdf"
+    pdf_path = tmp_path / "cmb-100.pdf"
+    write_cmb_pdf(page_path, pages=1, rows_per_page=30)
+    with fitz.open(str(page_path)) as doc:
+        for _ in range(99):
+            doc.fullcopy_page(0)
+        doc.save(str(pdf_path))
+
+    with fitz.open(str(pdf_path)) as doc:
+        start = time.perf_counter()
+        rows = _cmb_extract_pages(doc, 0, doc.page_count)
+        elapsed = time.perf_counter() - start
+    pages_per_second = 100 / elapsed
+    print(f"\n100 页，{len(rows)} 行，耗时 {elapsed:.2f}s，{pages_per_second:.0f} 页/秒")
+
+    assert len(rows) == 3000
+    assert pages_per_second >= CMB_PAGES_PER_SECOND_TARGET
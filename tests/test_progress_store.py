@@ -0,0 +1,377 @@
+"""
+测试账单进度存储
+
+测试快照 + 追加日志的保存、重放、压缩，以及与旧版进度文件的兼容
+"""
+import json
+
+import pytest
+
+from core.bill import Bill
+from core.progress_store import SNAPSHOT_MAGIC, ProgressStore, decode_columnar, encode_columnar
+
+
+def _make_bills(count=5):
+    return {
+        f"{i:03d}": {"交易时间": f"2023-10-01 12:{i:02d}", "金额": float(i), "类别": "", "标签": ""}
+        for i in range(count)
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ProgressStore(tmp_path / "bills.process", tmp_path / "bills.process.journal", compact_entries=1000)
+
+
+def _journal_lines(store):
+    if not store.journal_path.exists():
+        return []
+    return store.journal_path.read_text(encoding="utf-8").splitlines()
+
+
+class TestProgressStore:
+    """测试保存与加载"""
+
+    def test_load_without_progress(self, store):
+        """测试没有进度时返回 None"""
+        assert store.load() is None
+        assert not store.exists()
+
+    def test_save_appends_only_changes(self, store):
+        """测试只把变化的账单追加到日志"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        assert _journal_lines(store) == []
+
+        bills["001"]["类别"] = "食"
+        assert store.save_bills(bills) == 1
+        assert store.save_bills(bills) == 0
+
+        del bills["002"]
+        bills["new"] = {"交易时间": "2023-10-02", "金额": 1.0}
+        assert store.save_bills(bills) == 2
+
+        entries = [json.loads(line) for line in _journal_lines(store)]
+        assert [entry["id"] for entry in entries] == ["001", "new", "002"]
+        assert entries[-1]["bill"] is None
+        assert store.load() == bills
+
+    def test_save_given_ids(self, store):
+        """测试只检查指定账单"""
+        bills = {bill_id: Bill(bill) for bill_id, bill in _make_bills().items()}
+        store.write_snapshot(bills)
+
+        bills["003"]["标签"] = "午餐"
+        bills["004"]["标签"] = "晚餐"
+        assert store.save_bills(bills, ["003"]) == 1
+        assert store.load()["004"]["标签"] == ""
+
+    def test_unknown_state_rewrites_snapshot(self, store, tmp_path):
+        """测试新进程（未加载过进度）保存时整体写快照"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+
+        fresh = ProgressStore(store.snapshot_path, store.journal_path)
+        assert fresh.save_bills(bills) == len(bills)
+        assert _journal_lines(fresh) == []
+
+        fresh.load()
+        bills["000"]["类别"] = "行"
+        assert fresh.save_bills(bills) == 1
+
+    def test_legacy_list_snapshot(self, store):
+        """测试旧版列表格式的进度文件"""
+        legacy = [{"交易订单号": "A1", "金额": 1.0}, {"交易订单号": "A2", "金额": 2.0}]
+        store.snapshot_path.write_text(json.dumps(legacy, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        bills = store.load()
+        assert list(bills) == ["A1", "A2"]
+        bills["A2"]["金额"] = 3.0
+        assert store.save_bills(bills) == 1
+        assert store.load()["A2"]["金额"] == 3.0
+
+    def test_torn_tail_is_ignored(self, store):
+        """测试日志末尾写了一半的行在重放时被忽略"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        bills["001"]["类别"] = "食"
+        store.save_bills(bills)
+        with open(store.journal_path, "a", encoding="utf-8") as f:
+            f.write('{"id": "002", "bill": {"金')
+
+        assert store.load() == bills
+
+    def test_torn_tail_truncated_before_append(self, store):
+        """测试上次崩溃留下的半行在追加前截掉，之后的改动不会被忽略"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        bills["001"]["类别"] = "食"
+        store.save_bills(bills)
+        with open(store.journal_path, "a", encoding="utf-8") as f:
+            f.write('{"id": "002", "bill": {"金')
+
+        fresh = ProgressStore(store.snapshot_path, store.journal_path)
+        loaded = fresh.load()
+        loaded["003"]["类别"] = "行"
+        assert fresh.save_bills(loaded) == 1
+        assert len(_journal_lines(fresh)) == 2
+        assert fresh.load() == loaded
+        assert loaded["003"]["类别"] == "行"
+
+    @pytest.mark.parametrize("before, after", [(-1.0, -2.0), (1, 1.0), (1, True), ([1], [2])])
+    def test_hash_collisions_are_saved(self, store, before, after):
+        """测试哈希相同或 == 相等但内容不同的改动不会被当成未变化"""
+        bills = _make_bills()
+        bills["001"]["金额"] = before
+        store.write_snapshot(bills)
+
+        fresh = ProgressStore(store.snapshot_path, store.journal_path)
+        loaded = fresh.load()
+        loaded["001"]["金额"] = after
+        assert fresh.save_bills(loaded) == 1
+        assert type(fresh.load()["001"]["金额"]) is type(after)
+        assert fresh.load()["001"]["金额"] == after
+
+    def test_clear(self, store):
+        """测试清除快照和日志"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        bills["001"]["类别"] = "食"
+        store.save_bills(bills)
+
+        store.clear()
+        assert not store.exists()
+        assert store.load() is None
+
+
+class TestCompaction:
+    """测试日志压缩"""
+
+    def test_compact_folds_journal(self, store):
+        """测试压缩后快照包含日志中的改动，日志被清空"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        for i in range(3):
+            bills[f"{i:03d}"]["类别"] = "食"
+            store.save_bills(bills)
+
+        store.compact()
+        assert _journal_lines(store) == []
+        assert not store.compacting_path.exists()
+        assert decode_columnar(store.snapshot_path.read_bytes())[0] == bills
+        assert store.load() == bills
+
+    def test_compact_list_valued_field(self, store):
+        """测试字符串表字段的值为列表时压缩不失败"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        bills["001"]["标签"] = ["a", "b"]
+        store.save_bills(bills)
+
+        store.compact()
+        assert not store.compacting_path.exists()
+        assert store.load() == bills
+
+    def test_interrupted_compaction_is_replayed(self, store):
+        """测试压缩中断（.compacting 残留）时加载与再次压缩都不丢改动"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        bills["001"]["类别"] = "食"
+        store.save_bills(bills)
+        store.journal_path.replace(store.compacting_path)
+        bills["002"]["类别"] = "行"
+        store.save_bills(bills)
+
+        assert store.load() == bills
+        store.compact()
+        assert store.load() == bills
+        assert not store.compacting_path.exists()
+
+    def test_background_compaction(self, tmp_path):
+        """测试日志达到阈值后在后台压缩"""
+        store = ProgressStore(tmp_path / "p", tmp_path / "p.journal", compact_entries=3)
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        for i in range(4):
+            bills[f"{i:03d}"]["备注"] = "x"
+            store.save_bills(bills)
+        store.wait_for_compaction()
+
+        assert len(_journal_lines(store)) <= 1
+        assert store.load() == bills
+
+    def test_snapshot_rewrite_discards_stale_compaction(self, store, monkeypatch):
+        """测试压缩期间整体重写快照时放弃压缩结果"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        bills["001"]["类别"] = "食"
+        store.save_bills(bills)
+
+        replay = ProgressStore._replay
+        replaced = {"000": {"金额": 99.0}}
+
+        def replay_then_rewrite(target, path):
+            count = replay(target, path)
+            if path == store.compacting_path:
+                store.write_snapshot(replaced)
+            return count
+
+        monkeypatch.setattr(ProgressStore, "_replay", staticmethod(replay_then_rewrite))
+        store.compact()
+        monkeypatch.undo()
+        assert store.load() == replaced
+        assert not store.compacting_path.exists()
+        assert not list(store.snapshot_path.parent.glob("*.tmp"))
+
+    def test_other_process_rewrite_discards_compaction(self, store, monkeypatch):
+        """测试压缩期间快照被另一个进程（另一个 ProgressStore）重写时放弃压缩结果"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        bills["001"]["类别"] = "食"
+        store.save_bills(bills)
+
+        other = ProgressStore(store.snapshot_path, store.journal_path)
+        replay = ProgressStore._replay
+        replaced = {"000": {"金额": 99.0}}
+
+        def replay_then_rewrite(target, path):
+            count = replay(target, path)
+            if path == store.compacting_path:
+                other.write_snapshot(replaced)
+            return count
+
+        monkeypatch.setattr(ProgressStore, "_replay", staticmethod(replay_then_rewrite))
+        store.compact()
+        monkeypatch.undo()
+        assert store.load() == replaced
+        assert not list(store.snapshot_path.parent.glob("*.tmp"))
+
+    def test_snapshot_replaced_by_other_process_forces_rewrite(self, store):
+        """测试快照被其他进程替换后不再向其追加日志，而是整体重写"""
+        bills = _make_bills()
+        store.write_snapshot(bills)
+        other = ProgressStore(store.snapshot_path, store.journal_path)
+        other.write_snapshot({"X": {"金额": 1.0}})
+
+        bills["001"]["类别"] = "食"
+        assert store.save_bills(bills) == len(bills)
+        assert store.load() == bills
+
+
+class TestColumnarSnapshot:
+    """测试列式快照格式"""
+
+    def test_round_trip(self):
+        """测试缺失字段、None、非标准字段和字符串表的编解码"""
+        bills = {
+            "A": Bill({"交易时间": "2024-01-01", "金额": 1.5, "类别": "食", "标签": "午餐", "自定义": [1, 2]}),
+            "B": {"交易时间": "2024-01-02", "金额": 2.0, "类别": "食", "备注": None},
+            "C": {"金额": 3.0, "类别": "", "账本": "微信"},
+        }
+        data, digests = encode_columnar(bills)
+        assert data.startswith(SNAPSHOT_MAGIC)
+
+        loaded, loaded_digests = decode_columnar(data)
+        assert list(loaded) == ["A", "B", "C"]
+        assert all(isinstance(bill, Bill) for bill in loaded.values())
+        assert loaded == bills
+        assert "标签" not in loaded["C"]
+        assert "备注" in loaded["B"] and loaded["B"]["备注"] is None
+        assert loaded_digests == digests
+
+    def test_list_valued_interned_field(self, store):
+        """测试字符串表字段的值为列表时按普通列保存"""
+        bills = _make_bills()
+        bills["001"]["标签"] = ["a", "b"]
+        store.write_snapshot(bills)
+        assert store.snapshot_path.read_bytes().startswith(SNAPSHOT_MAGIC)
+
+        fresh = ProgressStore(store.snapshot_path, store.journal_path)
+        assert fresh.load() == bills
+        assert fresh.save_bills(bills) == 0
+
+    def test_empty(self):
+        """测试没有账单"""
+        assert decode_columnar(encode_columnar({})[0]) == ({}, {})
+
+    def test_loaded_bills_compare_unchanged(self, store):
+        """测试从列式快照加载后未改动的账单不写日志"""
+        bills = _make_bills()
+        bills["000"]["自定义"] = {"x": 1}
+        store.write_snapshot(bills)
+
+        fresh = ProgressStore(store.snapshot_path, store.journal_path)
+        loaded = fresh.load()
+        assert fresh.save_bills(loaded) == 0
+        loaded["001"]["标签"] = "晚餐"
+        assert fresh.save_bills(loaded) == 1
+
+    def test_json_snapshot_migrated(self, store):
+        """测试旧版 JSON 快照加载时迁移为列式快照，日志一并折叠"""
+        bills = _make_bills()
+        legacy = ProgressStore(store.snapshot_path, store.journal_path, snapshot_format="json")
+        legacy.write_snapshot(bills)
+        bills["001"]["类别"] = "食"
+        legacy.save_bills(bills)
+        assert json.loads(store.snapshot_path.read_text(encoding="utf-8")) == _make_bills()
+
+        assert store.load() == bills
+        assert store.snapshot_path.read_bytes().startswith(SNAPSHOT_MAGIC)
+        assert _journal_lines(store) == []
+        assert store.load() == bills
+
+    def test_json_format_kept(self, store):
+        """测试配置为 JSON 格式时不迁移"""
+        legacy = ProgressStore(store.snapshot_path, store.journal_path, snapshot_format="json")
+        legacy.write_snapshot(_make_bills())
+        assert legacy.load() == _make_bills()
+        assert json.loads(store.snapshot_path.read_text(encoding="utf-8")) == _make_bills()
+
+    def test_unknown_format(self, tmp_path):
+        """测试未知的快照格式"""
+        with pytest.raises(ValueError):
+            ProgressStore(tmp_path / "p", tmp_path / "p.journal", snapshot_format="xml")
+
+
+@pytest.mark.slow
+def test_progress_benchmark_columnar_load(tmp_path):
+    """基准：10 万条账单的进度加载耗时与文件大小（旧版 JSON 对比列式快照）"""
+    import random
+    import time
+    from core.progress_store import load_progress_bills
+
+    random.seed(1)
+    bills = {
+        f"{i:012d}": Bill({
+            "交易时间": f"2023-10-{i % 28 + 1:02d} 12:{i % 60:02d}:00",
+            "金额": round(random.random() * 100, 2),
+            "类别": random.choice(["食", "行", "住", "购物", ""]),
+            "标签": random.choice(["午餐", "打车", "", "-"]),
+            "交易对方": f"商户{i % 500}",
+            "商品说明": f"商品{i % 2000}",
+            "备注": "",
+            "账本": random.choice(["支付宝", "微信"]),
+            "命中规则": random.choice(["", "规则1", "AI 打标"]),
+            "收/支": "支出",
+        })
+        for i in range(100000)
+    }
+
+    results = {}
+    for snapshot_format in ("json", "columnar"):
+        path = tmp_path / f"{snapshot_format}.process"
+        ProgressStore(path, tmp_path / f"{snapshot_format}.journal", snapshot_format=snapshot_format).write_snapshot(bills)
+        # 取三次加载中最快的一次，减少与其他测试并行时的抖动
+        timings = []
+        for _ in range(3):
+            store = ProgressStore(path, tmp_path / f"{snapshot_format}.journal", snapshot_format=snapshot_format)
+            start = time.perf_counter()
+            loaded = {bill_id: Bill.from_dict(bill) for bill_id, bill in store.load().items()}
+            timings.append(time.perf_counter() - start)
+        elapsed = min(timings)
+        results[snapshot_format] = (elapsed, path.stat().st_size)
+        assert loaded == bills
+        print(f"\n{snapshot_format}: 加载 {elapsed:.2f}s，{path.stat().st_size / 1024 / 1024:.1f} MB")
+
+    assert results["columnar"][0] * 2 <= results["json"][0]
+    assert results["columnar"][1] * 5 <= results["json"][1]
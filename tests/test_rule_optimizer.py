@@ -0,0 +1,85 @@
+"""
+测试规则顺序优化
+
+测试优化后的规则顺序不改变打标结果，并减少平均比较次数
+"""
+import copy
+import random
+
+from core.rule_optimizer import optimize_rule_order
+from core.utils import apply_rules_to_bills, save_rules
+
+
+def _tag(bills, rules):
+    save_rules(rules)
+    return apply_rules_to_bills(copy.deepcopy(bills), engine="dict")
+
+
+class TestRuleOptimizer:
+    """测试 optimize_rule_order()"""
+
+    def test_hot_rule_moves_forward(self):
+        """测试命中多且无冲突的规则被提前"""
+        rules = [
+            {"key": "交易对方", "rule": ["星巴克"], "category": "食", "tag": "咖啡"},
+            {"key": "交易对方", "rule": ["美团"], "category": "食", "tag": "外卖"},
+            {"key": "交易对方", "rule": ["美团外卖"], "category": "食", "tag": "午餐"},
+            {"key": "商品说明", "rule": ["打车"], "category": "行", "tag": "打车"},
+        ]
+        bills = {str(i): {"交易对方": "美团外卖", "商品说明": ""} for i in range(5)}
+        bills.update({f"t{i}": {"交易对方": "滴滴", "商品说明": "打车"} for i in range(8)})
+
+        report = optimize_rule_order(rules, bills)
+        # “美团” 与 “美团外卖” 互相包含，相对顺序保持不变
+        assert report.order.index(1) < report.order.index(2)
+        assert report.order[0] == 3
+        assert report.after < report.before
+
+    def test_reorder_preserves_tagging(self):
+        """测试随机规则下，按优化顺序打标与原顺序结果一致"""
+        rng = random.Random(42)
+        alphabet = "美团外卖咖啡星巴克滴滴出行"
+
+        def word(lo, hi):
+            return "".join(rng.choice(alphabet) for _ in range(rng.randint(lo, hi)))
+
+        rules = [
+            {
+                "key": rng.choice(["交易对方", "商品说明", "ANY"]),
+                "rule": [word(1, 3) for _ in range(rng.randint(1, 2))],
+                "match_mode": "regex" if rng.random() < 0.1 else "keyword",
+                "category": f"类别{idx}",
+                "tag": "",
+                "time_based": [],
+                "comment": "",
+            }
+            for idx in range(40)
+        ]
+        bills = {
+            str(i): {"交易时间": "2023-10-01 12:00", "交易对方": word(0, 5), "商品说明": word(0, 5), "类别": "", "标签": ""}
+            for i in range(300)
+        }
+
+        report = optimize_rule_order(rules, bills)
+        assert sorted(report.order) == list(range(len(rules)))
+        assert report.after <= report.before
+        assert _tag(bills, [rules[idx] for idx in report.order]) == _tag(bills, rules)
+
+    def test_co_occurring_swap_reported(self):
+        """测试关键词互不包含但共享字段的规则被交换时计入 unverified"""
+        rules = [
+            {"key": "交易对方", "rule": ["美团"], "category": "食", "tag": ""},
+            {"key": "交易对方", "rule": ["外卖"], "category": "购", "tag": ""},
+        ]
+        bills = {"1": {"交易对方": "美团", "商品说明": ""}}
+        bills.update({f"w{i}": {"交易对方": "外卖", "商品说明": ""} for i in range(3)})
+
+        report = optimize_rule_order(rules, bills)
+        assert report.order == [1, 0]
+        assert report.conflicts == 0
+        assert report.unverified == 1
+        assert report.to_dict()["unverified_pairs"] == 1
+        # 以后的 “美团外卖” 账单在新顺序下得到不同的类别
+        future = {"f": {"交易时间": "2023-10-01 12:00", "交易对方": "美团外卖", "商品说明": "", "类别": ""}}
+        assert _tag(future, rules)["f"]["类别"] == "食"
+        assert _tag(future, [rules[idx] for idx in report.order])["f"]["类别"] == "购"
@@ -374,3 +374,399 @@ class TestRulesEngine:
             # 恢复规则文件
             if os.path.exists("data/rules.json.bak"):
                 os.rename("data/rules.json.bak", "data/rules.json")
+
+
+class TestCompiledRuleSet:
+    """测试编译后的规则匹配器与逐条匹配结果一致"""
+
+    @staticmethod
+    def _reference_match(bill, rules):
+        from core.rule_engine import match_single_rule
+        for rule in rules:
+            matched = match_single_rule(bill, rule)
+            if matched:
+                return rule, matched
+        return None
+
+    def test_overlapping_keywords_follow_rule_order(self):
+        """测试关键词互相包含时仍按规则顺序命中"""
+        from core.rule_engine import compile_rules
+
+        rules = [
+            {"key": "商品说明", "rule": ["咖啡豆"], "category": "食", "tag": "", "time_based": []},
+            {"key": "交易对方", "rule": ["星巴克咖啡", "星巴克"], "category": "食", "tag": "咖啡", "time_based": []},
+            {"key": "ANY", "rule": ["咖啡"], "category": "食", "tag": "饮料", "time_based": []},
+        ]
+        matcher = compile_rules(rules)
+
+        bill = {"交易对方": "星巴克咖啡店", "商品说明": "拿铁"}
+        assert matcher.match(bill) == (rules[1], "星巴克咖啡")
+
+        bill = {"交易对方": "瑞幸", "商品说明": "咖啡豆"}
+        assert matcher.match(bill) == (rules[0], "咖啡豆")
+
+        bill = {"交易对方": "瑞幸", "商品说明": "生椰咖啡"}
+        assert matcher.match(bill) == (rules[2], "咖啡")
+
+        assert matcher.match({"交易对方": "美团", "商品说明": "外卖"}) is None
+
+    def test_random_rules_match_reference(self):
+        """测试随机规则与账单下，编译匹配与逐条匹配结果完全一致"""
+        import random
+        from core.rule_engine import compile_rules
+
+        rng = random.Random(20240601)
+        alphabet = "美团外卖咖啡星巴克滴滴出行"
+
+        def word(max_len=3):
+            return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, max_len)))
+
+        rules = []
+        for _ in range(60):
+            mode = "regex" if rng.random() < 0.15 else "keyword"
+            patterns = [word() for _ in range(rng.randint(1, 4))]
+            if mode == "regex":
+                patterns = [f"^{p}" if rng.random() < 0.5 else f"{p}$" for p in patterns]
+                if rng.random() < 0.2:
+                    patterns.append("[无效")
+            rules.append({
+                "key": rng.choice(["交易对方", "商品说明", "ANY"]),
+                "rule": patterns,
+                "match_mode": mode,
+                "category": "类别",
+                "tag": "",
+                "time_based": [],
+            })
+
+        matcher = compile_rules(rules)
+        for _ in range(500):
+            bill = {"交易对方": word(8), "商品说明": word(8)}
+            assert matcher.match(bill) == self._reference_match(bill, rules)
+
+    def test_empty_pattern_matches_reference(self):
+        """测试规则中含空模式时与逐条匹配一致（空模式视为未命中并结束该规则）"""
+        from core.rule_engine import compile_rules
+
+        rules = [
+            {"key": "ANY", "rule": ["星巴克", "", "美团"], "category": "食"},
+            {"key": "交易对方", "rule": [""], "match_mode": "regex", "category": "其他"},
+            {"key": "ANY", "rule": ["美团"], "category": "外卖"},
+        ]
+        matcher = compile_rules(rules)
+        for bill in [
+            {"交易对方": "星巴克", "商品说明": ""},
+            {"交易对方": "美团", "商品说明": ""},
+            {"交易对方": "", "商品说明": "星巴克"},
+            {"交易对方": "滴滴", "商品说明": "美团"},
+        ]:
+            assert matcher.match(bill) == self._reference_match(bill, rules)
+
+    def test_grouped_regex_respects_rule_order(self):
+        """测试合并正则时，排在前面但命中位置靠右的规则仍然优先"""
+        from core.rule_engine import compile_rules
+
+        rules = [
+            {"key": "交易对方", "rule": ["商城$"], "match_mode": "regex", "category": "购物"},
+            {"key": "交易对方", "rule": ["^支付宝"], "match_mode": "regex", "category": "其他"},
+            {"key": "交易对方", "rule": [r"(\d)\1"], "match_mode": "regex", "category": "数字"},
+        ]
+        matcher = compile_rules(rules)
+
+        assert matcher.match({"交易对方": "支付宝-天猫商城"}) == (rules[0], "商城$")
+        assert matcher.match({"交易对方": "支付宝-饿了么"}) == (rules[1], "^支付宝")
+        assert matcher.match({"交易对方": "门店88号"}) == (rules[2], r"(\d)\1")
+
+    def test_many_regex_rules_span_multiple_groups(self):
+        """测试正则数量超过单组上限时结果仍与逐条匹配一致"""
+        from core.rule_engine import compile_rules, REGEX_GROUP_SIZE
+
+        rules = [
+            {"key": "商品说明", "rule": [f"订单{idx:03d}$"], "match_mode": "regex", "category": str(idx)}
+            for idx in range(REGEX_GROUP_SIZE * 2 + 5)
+        ]
+        matcher = compile_rules(rules)
+
+        for idx in (0, REGEX_GROUP_SIZE - 1, REGEX_GROUP_SIZE, len(rules) - 1):
+            bill = {"商品说明": f"测试订单{idx:03d}"}
+            assert matcher.match(bill) == self._reference_match(bill, rules)
+        assert matcher.match({"商品说明": "订单999"}) is None
+
+    def test_invalid_regex_is_reported_once(self):
+        """测试无效正则在编译阶段被收集，匹配时直接跳过"""
+        from core.rule_engine import compile_rules, validate_rules
+
+        rules = [
+            {"key": "交易对方", "rule": ["[无效", "美团"], "match_mode": "regex", "category": "食"},
+        ]
+        errors = validate_rules(rules)
+        assert len(errors) == 1
+        assert "[无效" in errors[0]
+
+        matcher = compile_rules(rules)
+        assert matcher.errors == errors
+        assert matcher.match({"交易对方": "美团外卖"}) == (rules[0], "美团")
+
+
+class TestIncrementalTagging:
+    """测试规则变更后的增量打标"""
+
+    @staticmethod
+    def _bills():
+        return {
+            "a": {"交易时间": "2023-10-01 12:00", "交易对方": "美团外卖", "商品说明": "午餐", "类别": "", "标签": ""},
+            "b": {"交易时间": "2023-10-01 09:00", "交易对方": "滴滴出行", "商品说明": "快车", "类别": "", "标签": ""},
+            "c": {"交易时间": "2023-10-01 20:30", "交易对方": "星巴克", "商品说明": "拿铁", "类别": "", "标签": ""},
+            "d": {"交易时间": "2023-10-01 15:00", "交易对方": "便利店", "商品说明": "矿泉水", "类别": "娱乐", "标签": "手动"},
+        }
+
+    def test_diff_rules_detects_changes(self):
+        """测试按匹配条件比较规则差异"""
+        from core.rule_engine import diff_rules
+
+        old = [
+            {"key": "交易对方", "rule": ["美团"], "category": "食"},
+            {"key": "交易对方", "rule": ["滴滴"], "category": "行"},
+            {"key": "商品说明", "rule": ["拿铁"], "category": "食"},
+        ]
+        assert diff_rules(old, [dict(rule) for rule in old]).unchanged
+
+        # 只改类别不影响匹配条件
+        new = [dict(old[0], category="外卖")] + old[1:]
+        assert diff_rules(old, new).unchanged
+
+        new = [old[1], old[0], {"key": "交易对方", "rule": ["星巴克"], "category": "食"}]
+        diff = diff_rules(old, new)
+        assert diff.added == [2]
+        assert diff.removed == [2]
+        assert diff.reordered
+
+    def test_incremental_matches_full_retag(self):
+        """测试增量打标结果与全量打标一致"""
+        from core.utils import save_rules, apply_rules_to_bills, apply_rules_incrementally
+
+        old_rules = [
+            {"key": "交易对方", "rule": ["美团"], "category": "食", "tag": "外卖", "time_based": [], "comment": ""},
+        ]
+        new_rules = [
+            {"key": "商品说明", "rule": ["拿铁"], "category": "食", "tag": "", "time_based": ["全部"], "comment": "咖啡"},
+            old_rules[0],
+            {"key": "ANY", "rule": ["滴滴", "美团"], "category": "行", "tag": "打车", "time_based": [], "comment": ""},
+        ]
+
+        save_rules(old_rules)
+        full = apply_rules_to_bills(self._bills())
+        incremental = apply_rules_to_bills(self._bills())
+
+        save_rules(new_rules)
+        full = apply_rules_to_bills(full)
+        changed = apply_rules_incrementally(incremental, old_rules, new_rules)
+
+        assert incremental == full
+        assert sorted(changed) == ["b", "c"]
+        assert incremental["c"]["标签"] == "夜宵"
+        assert incremental["d"]["类别"] == "娱乐"
+
+    def test_removed_rule_changes_only_its_bills(self):
+        """测试删除规则时只有该规则打标的账单需要更新"""
+        from core.utils import save_rules, apply_rules_to_bills, apply_rules_incrementally, find_changed_rule_bills
+
+        old_rules = [
+            {"key": "交易对方", "rule": ["美团"], "category": "食", "tag": "外卖", "time_based": [], "comment": ""},
+            {"key": "交易对方", "rule": ["滴滴"], "category": "行", "tag": "打车", "time_based": [], "comment": ""},
+        ]
+        save_rules(old_rules)
+        bills = apply_rules_to_bills(self._bills())
+
+        assert find_changed_rule_bills(bills, old_rules, old_rules) == []
+        assert apply_rules_incrementally(bills, old_rules, old_rules[:1]) == []
+
+        recheck = find_changed_rule_bills(bills, old_rules, old_rules[1:])
+        assert recheck == ["a"]
+        assert apply_rules_incrementally(bills, old_rules, old_rules[1:], recheck) == ["a"]
+        assert bills["a"]["类别"] == "" and bills["a"]["命中规则"] == ""
+
+    def test_changed_rule_retags_its_bills(self):
+        """测试改动规则的打标结果后重新打标该规则命中的账单，手动修改过的账单不变"""
+        from core.utils import save_rules, apply_rules_to_bills, apply_rules_incrementally, find_changed_rule_bills
+
+        old_rules = [
+            {"key": "ANY", "rule": ["美团", "拿铁"], "category": "食", "tag": "外卖", "time_based": [], "comment": ""},
+        ]
+        new_rules = [dict(old_rules[0], category="餐饮", tag="")]
+        save_rules(old_rules)
+        bills = apply_rules_to_bills(self._bills())
+        bills["c"]["类别"] = "娱乐"
+
+        recheck = find_changed_rule_bills(bills, old_rules, new_rules)
+        assert recheck == ["a"]
+        assert apply_rules_incrementally(bills, old_rules, new_rules, recheck) == ["a"]
+        assert (bills["a"]["类别"], bills["a"]["标签"]) == ("餐饮", "-")
+        assert bills["c"]["类别"] == "娱乐"
+
+
+class TestVectorizedEngine:
+    """测试向量化打标引擎与字典引擎结果一致"""
+
+    def test_engines_produce_identical_output(self, temp_rules_file):
+        """测试随机规则与账单下两种引擎的打标结果完全一致"""
+        import copy
+        import random
+        from core.utils import save_rules
+
+        rng = random.Random(20240707)
+        alphabet = "美团外卖咖啡星巴克滴滴出行"
+
+        def word(lo, hi):
+            return "".join(rng.choice(alphabet) for _ in range(rng.randint(lo, hi)))
+
+        rules = []
+        for _ in range(40):
+            rules.append({
+                "key": rng.choice(["交易对方", "商品说明", "ANY"]),
+                "rule": [word(1, 3) for _ in range(rng.randint(1, 3))],
+                "category": rng.choice(["食", "行", ""]),
+                "tag": rng.choice(["", "外卖", "咖啡"]),
+                "comment": rng.choice(["", "备注"]),
+                "time_based": rng.choice([[], ["全部"], ["午餐", "晚餐"], ["无"]]),
+                "match_mode": "keyword",
+            })
+        rules.insert(10, {"key": "ANY", "rule": ["^星.*克$", "[未闭合", "外卖?$"], "category": "食",
+                          "tag": "", "comment": "", "time_based": ["全部"], "match_mode": "regex"})
+        save_rules(rules)
+
+        bills = {}
+        for i in range(400):
+            tagged = rng.random() < 0.2
+            bills[str(i)] = {
+                "交易时间": f"2023-10-01 {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.choice([0, 30])}",
+                "交易对方": word(0, 6),
+                "商品说明": word(0, 6),
+                "类别": "行" if tagged else rng.choice(["", " "]),
+                "标签": "手动" if tagged else "",
+            }
+
+        by_dict = apply_rules_to_bills(copy.deepcopy(bills), engine="dict")
+        by_vectorized = apply_rules_to_bills(copy.deepcopy(bills), engine="vectorized")
+        assert by_vectorized == by_dict
+        assert any(bill.get("命中规则") for bill in by_dict.values())
+
+    def test_mixed_time_formats(self, temp_rules_file):
+        """测试同一批账单混用带秒/不带秒等时间格式时，两种引擎的餐点标签一致"""
+        import copy
+        from core.utils import save_rules
+
+        save_rules([{"key": "交易对方", "rule": ["餐厅"], "category": "食", "tag": "", "time_based": ["全部"], "comment": ""}])
+        times = [
+            "2023-10-01 12:00",
+            "2023-10-01 07:30:00",
+            "2023-10-01 18:05:30",
+            "2023/10/02 8:05",
+            "2023年10月03日 12:30",
+            "2023-10-01 15:00",
+        ]
+        bills = {
+            str(i): {"交易时间": time, "交易对方": "餐厅", "商品说明": "", "类别": "", "标签": ""}
+            for i, time in enumerate(times)
+        }
+
+        by_dict = apply_rules_to_bills(copy.deepcopy(bills), engine="dict")
+        by_vectorized = apply_rules_to_bills(copy.deepcopy(bills), engine="vectorized")
+        assert by_vectorized == by_dict
+        assert [by_dict[str(i)]["标签"] for i in range(len(times))] == ["午餐", "早餐", "晚餐", "早餐", "午餐", "-"]
+
+    def test_auto_never_picks_vectorized(self, temp_rules_file, monkeypatch):
+        """测试 auto 在单 CPU 下用字典引擎，向量化引擎只在显式指定时使用"""
+        import core.utils as utils
+
+        monkeypatch.setattr(utils, "_parallel_workers", lambda: 1)
+        monkeypatch.setattr(utils, "_apply_rules_vectorized", lambda bills, rules: pytest.fail("不应使用向量化引擎"))
+        bills = {str(i): {"交易时间": "2023-10-01 12:00", "交易对方": "", "商品说明": "", "类别": ""}
+                 for i in range(utils.PARALLEL_TAGGING_MIN_BILLS)}
+        apply_rules_to_bills(bills)
+
+    def test_unknown_engine(self):
+        """测试未知引擎名报错"""
+        with pytest.raises(ValueError):
+            apply_rules_to_bills({}, engine="gpu")
+
+
+class TestParallelEngine:
+    """测试多进程打标"""
+
+    def test_parallel_matches_dict_engine(self, temp_rules_file, monkeypatch):
+        """测试分片多进程打标与字典引擎结果一致"""
+        import copy
+        import core.utils as utils
+        from core.utils import save_rules
+
+        save_rules([
+            {"key": "交易对方", "rule": ["美团"], "category": "食", "tag": "", "time_based": ["全部"], "comment": ""},
+            {"key": "ANY", "rule": ["滴滴", "出行"], "category": "行", "tag": "打车", "time_based": [], "comment": "c"},
+        ])
+        bills = {
+            str(i): {
+                "交易时间": f"2023-10-01 {i % 24:02d}:30:00",
+                "交易对方": ["美团外卖", "滴滴", "便利店"][i % 3],
+                "商品说明": ["午餐", "绿色出行", "矿泉水"][i % 5 % 3],
+                "类别": "娱乐" if i % 7 == 0 else "",
+                "标签": "",
+            }
+            for i in range(60)
+        }
+
+        monkeypatch.setattr(utils, "PARALLEL_TAGGING_CHUNK_SIZE", 16)
+        monkeypatch.setattr(utils, "PARALLEL_TAGGING_WORKERS", 2)
+        expected = apply_rules_to_bills(copy.deepcopy(bills), engine="dict")
+        assert apply_rules_to_bills(copy.deepcopy(bills), engine="process") == expected
+
+    def test_small_input_runs_in_process(self, temp_rules_file, monkeypatch):
+        """测试未打标账单不足一个分片时不启动进程池"""
+        import concurrent.futures
+        import core.utils as utils
+        from core.utils import save_rules
+
+        def fail(*args, **kwargs):
+            raise AssertionError("不应启动进程池")
+
+        save_rules([{"key": "交易对方", "rule": ["美团"], "category": "食", "tag": "外卖", "time_based": [], "comment": ""}])
+        monkeypatch.setattr(utils, "PARALLEL_TAGGING_WORKERS", 4)
+        monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", fail)
+
+        bills = {"1": {"交易时间": "2023-10-01 12:00", "交易对方": "美团", "商品说明": "", "类别": "", "标签": ""}}
+        apply_rules_to_bills(bills, engine="process")
+        assert bills["1"]["标签"] == "外卖"
+
+
+class TestRuleStats:
+    """测试规则命中统计"""
+
+    def test_stats_follow_rule_order(self, temp_rules_file):
+        """测试统计结果与打标结果一致，且匹配次数随规则位置递减"""
+        import copy
+        from core.rule_engine import RuleStats
+        from core.utils import save_rules, load_rules
+
+        save_rules([
+            {"key": "交易对方", "rule": ["美团"], "category": "食", "tag": "外卖", "time_based": [], "comment": ""},
+            {"key": "ANY", "rule": ["滴滴"], "category": "行", "tag": "打车", "time_based": [], "comment": ""},
+            {"key": "商品说明", "rule": ["不会命中"], "category": "其他", "tag": "", "time_based": [], "comment": ""},
+        ])
+        bills = {
+            "1": {"交易时间": "2023-10-01 12:00", "交易对方": "美团外卖", "商品说明": "", "类别": "", "标签": ""},
+            "2": {"交易时间": "2023-10-01 12:00", "交易对方": "滴滴出行", "商品说明": "", "类别": "", "标签": ""},
+            "3": {"交易时间": "2023-10-01 12:00", "交易对方": "便利店", "商品说明": "", "类别": "", "标签": ""},
+            "4": {"交易时间": "2023-10-01 12:00", "交易对方": "美团", "商品说明": "", "类别": "手动", "标签": "x"},
+        }
+
+        stats = RuleStats(load_rules())
+        tagged = apply_rules_to_bills(copy.deepcopy(bills), stats=stats)
+        assert tagged == apply_rules_to_bills(copy.deepcopy(bills), engine="dict")
+
+        assert stats.bills == 3
+        assert stats.evaluations == [3, 2, 1]
+        assert stats.hits == [1, 1, 0]
+        assert stats.average_position() == 0.5
+
+        report = stats.to_dict()
+        assert report["matched"] == 2
+        assert [rule["hits"] for rule in report["rules"]] == [1, 1, 0]
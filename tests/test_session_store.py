@@ -0,0 +1,168 @@
+"""
+测试当前账单会话
+
+测试写时复制的编辑、版本号与 epoch、编辑的串行化，以及编辑期间读者不被阻塞
+"""
+import threading
+
+import pytest
+
+from core.bill import Bill
+from core.bill_index import BillTextIndex, sync_bill_index
+from core.session_store import BillSession
+
+
+def _make_bills(count=3):
+    return {
+        f"{i:03d}": Bill({"交易时间": f"2023-10-01 12:{i:02d}", "金额": float(i), "类别": "", "交易对方": f"商户{i}"})
+        for i in range(count)
+    }
+
+
+@pytest.fixture
+def session():
+    session = BillSession()
+    session.replace(_make_bills())
+    return session
+
+
+class TestBillSession:
+    """测试编辑与发布"""
+
+    def test_snapshot_isolated_from_edit(self, session):
+        """测试编辑不影响之前取得的快照"""
+        before = session.snapshot()
+        with session.edit() as edit:
+            edit.mutable("001")["类别"] = "食"
+            edit.add("new", Bill({"金额": 9.0}))
+            edit.bills.pop("002")
+
+        assert before.bills["001"]["类别"] == ""
+        assert set(before.bills) == {"000", "001", "002"}
+        assert session.bills["001"]["类别"] == "食"
+        assert set(session.bills) == {"000", "001", "new"}
+        # 未修改的账单在两个版本间共享
+        assert session.bills["000"] is before.bills["000"]
+
+    def test_copy_if(self, session):
+        """测试进入编辑时预先复制满足条件的账单"""
+        before = session.snapshot()
+        with session.edit(copy_if=lambda bill: bill["金额"] > 0) as edit:
+            for bill in edit.bills.values():
+                if bill["金额"] > 0:
+                    bill["类别"] = "食"
+
+        assert [bill["类别"] for bill in before.bills.values()] == ["", "", ""]
+        assert [bill["类别"] for bill in session.bills.values()] == ["", "食", "食"]
+        assert session.bills["000"] is before.bills["000"]
+
+    def test_version_and_epoch(self, session):
+        """测试每次发布版本加一，只有整体替换时 epoch 加一"""
+        base = session.snapshot()
+        with session.edit() as edit:
+            edit.mutable("000")["备注"] = "x"
+        assert edit.result.version == base.version + 1
+        assert edit.result.epoch == base.epoch
+
+        replaced = session.replace({})
+        assert replaced.version == base.version + 2
+        assert replaced.epoch == base.epoch + 1
+        assert session.snapshot() == replaced
+
+    def test_cancel_and_error_discard_edit(self, session):
+        """测试取消或抛出异常时不发布"""
+        base = session.snapshot()
+        with session.edit() as edit:
+            edit.mutable("000")["类别"] = "食"
+            edit.cancel()
+        assert edit.result is base
+
+        with pytest.raises(RuntimeError):
+            with session.edit() as edit:
+                edit.mutable("000")["类别"] = "食"
+                raise RuntimeError("打标失败")
+
+        assert session.snapshot() is base
+        assert session.bills["000"]["类别"] == ""
+
+    def test_tagged_rules(self, session):
+        """测试整体替换时记录规则集，取消编辑时只更新记录不发布新版本"""
+        assert session.snapshot().tagged_rules is None
+        with session.edit() as edit:
+            edit.replace(_make_bills(), "rules-1")
+        assert session.snapshot().tagged_rules == "rules-1"
+
+        base = session.snapshot()
+        with session.edit() as edit:
+            edit.tagged_rules = "rules-2"
+            edit.cancel()
+        assert session.snapshot() == base._replace(tagged_rules="rules-2")
+
+
+class TestConcurrency:
+    """测试并发访问"""
+
+    def test_edits_are_serialized(self, session):
+        """测试并发编辑不丢失更新"""
+        def add_one():
+            for _ in range(50):
+                with session.edit() as edit:
+                    edit.mutable("000")["金额"] += 1
+
+        threads = [threading.Thread(target=add_one) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        assert session.bills["000"]["金额"] == 200
+        assert session.version == 1 + 200
+
+    def test_readers_not_blocked_by_edit(self, session):
+        """测试编辑进行中读者读取上一版本"""
+        editing = threading.Event()
+        release = threading.Event()
+
+        def slow_edit():
+            with session.edit() as edit:
+                edit.mutable("000")["类别"] = "食"
+                editing.set()
+                release.wait(5)
+
+        writer = threading.Thread(target=slow_edit)
+        writer.start()
+        assert editing.wait(5)
+
+        seen = []
+        reader = threading.Thread(target=lambda: seen.append(session.bills["000"]["类别"]))
+        reader.start()
+        reader.join(5)
+        assert seen == [""]
+
+        release.set()
+        writer.join(5)
+        assert session.bills["000"]["类别"] == "食"
+
+
+class TestIndexEpoch:
+    """测试搜索索引按 epoch 重建或增量刷新"""
+
+    def test_rebuild_only_on_new_epoch(self, session, monkeypatch):
+        """测试编辑后增量刷新，整体替换后重建"""
+        snapshot = session.snapshot()
+        index = sync_bill_index(snapshot.bills, snapshot.epoch)
+
+        # 同一 epoch 内的编辑只刷新改动的账单
+        with session.edit() as edit:
+            edit.mutable("001")["交易对方"] = "咖啡店"
+        monkeypatch.setattr(BillTextIndex, "from_bills", classmethod(lambda cls, bills: pytest.fail("不应重建")))
+        snapshot = session.snapshot()
+        assert sync_bill_index(snapshot.bills, snapshot.epoch) is index
+        assert index.search(["咖啡"], "交易对方") == {"001"}
+        monkeypatch.undo()
+
+        session.replace(_make_bills(2))
+        snapshot = session.snapshot()
+        rebuilt = sync_bill_index(snapshot.bills, snapshot.epoch)
+        assert rebuilt is not index
+        assert rebuilt.epoch == snapshot.epoch
@@ -0,0 +1,88 @@
+"""
+测试配置文件读写工具函数
+
+测试 load_* / save_* 的进程级缓存与规则编译缓存
+"""
+import json
+import os
+from core.config import RULES_FILE, CATEGORIES_FILE
+from core.utils import (
+    load_rules,
+    save_rules,
+    load_categories,
+    save_categories,
+    get_compiled_rules,
+)
+
+
+def write_json_externally(path, data):
+    """绕过 save_* 直接写文件，并确保 mtime 与之前不同"""
+    before = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.utime(path, ns=(before + 1_000_000, before + 1_000_000))
+
+
+class TestConfigCache:
+    """测试配置缓存"""
+
+    def test_unchanged_file_returns_cached_object(self):
+        """测试文件未变化时不重新解析"""
+        save_rules([{"key": "交易对方", "rule": ["美团"], "category": "食"}])
+        assert load_rules() is load_rules()
+
+    def test_save_refreshes_cache(self):
+        """测试 save_* 后立即读到新数据"""
+        save_categories({"食": ["早餐"]})
+        assert load_categories() == {"食": ["早餐"]}
+        save_categories({"行": ["地铁"]})
+        assert load_categories() == {"行": ["地铁"]}
+
+    def test_external_change_invalidates_cache(self):
+        """测试外部修改文件后缓存失效"""
+        save_rules([{"key": "交易对方", "rule": ["美团"], "category": "食"}])
+        load_rules()
+
+        write_json_externally(RULES_FILE, [{"key": "交易对方", "rule": ["滴滴"], "category": "行"}])
+        assert load_rules()[0]["rule"] == ["滴滴"]
+
+    def test_missing_file_returns_default(self):
+        """测试文件被删除后返回默认值"""
+        save_categories({"食": []})
+        os.remove(CATEGORIES_FILE)
+        assert load_categories() == {}
+
+
+class TestCompiledRulesCache:
+    """测试规则编译缓存"""
+
+    def test_compiled_rules_reused_until_rules_change(self):
+        """测试规则未变化时复用编译结果"""
+        save_rules([{"key": "交易对方", "rule": ["美团"], "category": "食"}])
+        first = get_compiled_rules()
+        assert get_compiled_rules() is first
+
+        save_rules([{"key": "交易对方", "rule": ["滴滴"], "category": "行"}])
+        second = get_compiled_rules()
+        assert second is not first
+        assert second.match({"交易对方": "滴滴出行"})[0]["category"] == "行"
+
+    def test_in_place_edit_saved_back_recompiles(self):
+        """测试原地修改缓存的规则列表再写回同一对象时重新编译"""
+        save_rules([{"key": "交易对方", "rule": ["美团"], "category": "食"}])
+        first = get_compiled_rules()
+
+        rules = load_rules()
+        rules.insert(0, {"key": "交易对方", "rule": ["滴滴"], "category": "行"})
+        save_rules(rules)
+        second = get_compiled_rules()
+        assert second is not first
+        assert second.match({"交易对方": "滴滴出行"})[0]["category"] == "行"
+
+    def test_external_change_recompiles(self):
+        """测试外部修改规则文件后重新编译"""
+        save_rules([{"key": "交易对方", "rule": ["美团"], "category": "食"}])
+        get_compiled_rules()
+
+        write_json_externally(RULES_FILE, [{"key": "交易对方", "rule": ["滴滴"], "category": "行"}])
+        assert get_compiled_rules().match({"交易对方": "滴滴出行"})[0]["category"] == "行"
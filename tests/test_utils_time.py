@@ -88,3 +88,39 @@ class TestTimeMapping:
         """测试带秒的时间格式"""
         assert time_map("08:30:45") == "早餐"
         assert time_map("12:00:00") == "午餐"
+
+
+class TestTimeMapTable:
+    """测试分钟查找表与向量化版本"""
+
+    def test_matches_time_cmp(self):
+        """测试查找表结果与逐段 time_cmp 比较一致"""
+        from core.config import MEAL_TIME_PERIODS
+
+        def reference(t):
+            for start, end, meal_type in MEAL_TIME_PERIODS:
+                if time_cmp(start, t, end):
+                    return meal_type
+            return None
+
+        for hour in range(24):
+            for minute in range(60):
+                for suffix in ("", ":00", ":30"):
+                    t = f"{hour:02d}:{minute:02d}{suffix}"
+                    assert time_map(t) == reference(t), t
+
+    def test_time_map_series(self):
+        """测试按列批量计算餐点"""
+        from core.utils import time_map_series
+        times = [
+            "2024-01-01 07:30:00",
+            "2024-01-01 10:59:30",
+            "2024-01-01 11:00:30",
+            "2024-01-01 23:59:30",
+            "2024-01-01 15:00:00",
+            "无效时间",
+        ]
+        assert time_map_series(times).tolist() == ["早餐", "早餐", "午餐", None, None, None]
+        assert time_map_series(times).tolist() == [
+            time_map(t.split(" ")[1]) if " " in t else None for t in times
+        ]